@@ -0,0 +1,176 @@
+"""
+Benchmarks every phase of copy_to on synthetic libraries.
+
+Usage: python -m benchmarks [--sizes 1000,10000] [--output baseline.json] [--compare old.json]
+"""
+
+import argparse
+import json
+import platform
+import shutil
+import sys
+import time
+import tracemalloc
+
+from functools import wraps
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from benchmarks.synthetic import create_empty_mixxxdb, generate_mixxxdb, generate_musiclib
+from mixync.options import Options
+from mixync.store import Store
+from mixync.store.mixxx import MixxxStore
+from mixync.store.portable import PortableStore
+
+PHASES = [
+    'copy_directories_to',
+    'copy_tracks_to',
+    'copy_track_files_to',
+    'copy_playlists_to',
+    'copy_crates_to',
+]
+PAIRINGS = [
+    ('mixxx', 'portable'),
+    ('portable', 'mixxx'),
+    ('portable', 'portable'),
+    ('mixxx', 'mixxx'),
+]
+
+def instrument(store: Store, measure_memory: bool) -> dict[str, dict[str, Any]]:
+    """Wraps the store's copy phases to record their timings and memory peaks."""
+    results = {}
+
+    def measured(phase: str, method: Callable) -> Callable:
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            if measure_memory:
+                tracemalloc.reset_peak()
+            start = time.perf_counter()
+            result = method(*args, **kwargs)
+            results[phase] = {'seconds': time.perf_counter() - start}
+            if measure_memory:
+                results[phase]['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+            return result
+        return wrapper
+
+    for phase in PHASES:
+        # Instance attributes shadow the methods called by copy_to
+        setattr(store, phase, measured(phase, getattr(store, phase)))
+    return results
+
+def open_store(kind: str, path: Path) -> Store:
+    if kind == 'mixxx':
+        return MixxxStore(path / 'mixxxdb.sqlite')
+    else:
+        return PortableStore(path / 'library.musiclib')
+
+def prepare_fixture(work_path: Path, size: int, audio_size: int) -> Path:
+    """Generates (or reuses) the source libraries for the given size."""
+    fixture_path = work_path / 'fixtures' / f'{size}-{audio_size}'
+    done_path = fixture_path / '.done'
+    if not done_path.exists():
+        shutil.rmtree(fixture_path, ignore_errors=True)
+        print(f'Generating synthetic libraries with {size} tracks...', file=sys.stderr)
+        mixxx_path = fixture_path / 'mixxx'
+        generate_mixxxdb(mixxx_path / 'mixxxdb.sqlite', fixture_path / 'music', size, audio_size)
+        generate_musiclib(fixture_path / 'portable' / 'library.musiclib', mixxx_path / 'mixxxdb.sqlite')
+        done_path.touch()
+    return fixture_path
+
+def run_pairing(fixture_path: Path, run_path: Path, source_kind: str, dest_kind: str, opts: Options, measure_memory: bool) -> list[dict[str, Any]]:
+    shutil.rmtree(run_path, ignore_errors=True)
+    if dest_kind == 'mixxx':
+        create_empty_mixxxdb(run_path / 'mixxxdb.sqlite')
+    opts.dest_root_dir = run_path / 'music'
+
+    results = []
+    for scenario in ['initial', 'repeat']:
+        source = open_store(source_kind, fixture_path / source_kind)
+        dest = open_store(dest_kind, run_path)
+        phases = instrument(source, measure_memory)
+        start = time.perf_counter()
+        source.copy_to(dest, opts)
+        results.append({
+            'source': source_kind,
+            'dest': dest_kind,
+            'scenario': scenario,
+            'seconds': time.perf_counter() - start,
+            'phases': phases,
+        })
+    return results
+
+def compare(baseline: dict[str, Any], results: list[dict[str, Any]]):
+    """Prints the relative change of every phase against a baseline."""
+    def key(result: dict[str, Any]) -> tuple:
+        return (result['size'], result['source'], result['dest'], result['scenario'])
+
+    old_results = {key(r): r for r in baseline['results']}
+    for result in results:
+        old = old_results.get(key(result))
+        if not old:
+            continue
+        print(' '.join(map(str, key(result))))
+        for phase, metrics in result['phases'].items():
+            old_metrics = old['phases'].get(phase)
+            if not old_metrics:
+                continue
+            deltas = []
+            for metric, value in metrics.items():
+                old_value = old_metrics.get(metric)
+                if old_value:
+                    deltas.append(f'{metric} {old_value:.3g} -> {value:.3g} ({(value / old_value - 1) * 100:+.1f}%)')
+            print(f'  {phase}: {", ".join(deltas)}')
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks mixync on synthetic libraries')
+    parser.add_argument('--sizes', default='1000,10000,100000', help='Comma-separated track counts to benchmark.')
+    parser.add_argument('--pairings', default=','.join(f'{s}:{d}' for s, d in PAIRINGS), help='Comma-separated source:dest store pairings (mixxx or portable).')
+    parser.add_argument('--audio-size', type=int, default=4096, help='The size of each dummy audio file in bytes.')
+    parser.add_argument('--work-dir', default='.benchmarks', help='The directory to generate fixtures and destinations in. Fixtures are reused across runs.')
+    parser.add_argument('--no-memory', action='store_true', help='Skips memory profiling, which slows down the timed code.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='The number of track files to copy concurrently.')
+    parser.add_argument('-p', '--pipeline', action='store_true', help='Transfers track files while the remaining metadata is still being copied.')
+    parser.add_argument('-o', '--output', help='Writes the results as JSON to the given file.')
+    parser.add_argument('--compare', help='Compares the results against a previously written JSON baseline.')
+
+    args = parser.parse_args()
+    work_path = Path(args.work_dir).resolve()
+    sizes = [int(size) for size in args.sizes.split(',')]
+    pairings = [tuple(pairing.split(':')) for pairing in args.pairings.split(',')]
+    measure_memory = not args.no_memory
+
+    if measure_memory:
+        tracemalloc.start()
+
+    results = []
+    for size in sizes:
+        fixture_path = prepare_fixture(work_path, size, args.audio_size)
+        for source_kind, dest_kind in pairings:
+            print(f'Benchmarking {source_kind} -> {dest_kind} with {size} tracks...', file=sys.stderr)
+            opts = Options(assume_yes=True, delta=True, jobs=args.jobs, pipeline=args.pipeline)
+            run_path = work_path / 'runs' / f'{size}-{source_kind}-{dest_kind}'
+            for result in run_pairing(fixture_path, run_path, source_kind, dest_kind, opts, measure_memory):
+                results.append({'size': size, **result})
+            shutil.rmtree(run_path, ignore_errors=True)
+
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'audio_size': args.audio_size,
+        'memory': measure_memory,
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare(json.load(f), results)
+
+if __name__ == '__main__':
+    main()
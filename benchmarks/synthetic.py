@@ -0,0 +1,162 @@
+"""Generators for synthetic libraries of arbitrary size."""
+
+from datetime import datetime, timedelta
+from pathlib import Path
+from random import Random
+from sqlalchemy import create_engine, insert
+from typing import Iterator
+
+from mixync.model.cue_type import CueType
+from mixync.model.playlist_type import PlaylistType
+from mixync.options import Options
+from mixync.store.mixxx import MIN_SCHEMA_VERSION, MixxxStore
+from mixync.store.mixxx.model import Base as MixxxBase
+from mixync.store.mixxx.model.crate import MixxxCrate
+from mixync.store.mixxx.model.crate_track import MixxxCrateTrack
+from mixync.store.mixxx.model.cue import MixxxCue
+from mixync.store.mixxx.model.directory import MixxxDirectory
+from mixync.store.mixxx.model.playlist import MixxxPlaylist
+from mixync.store.mixxx.model.playlist_track import MixxxPlaylistTrack
+from mixync.store.mixxx.model.setting import MixxxSetting
+from mixync.store.mixxx.model.track import MixxxTrack
+from mixync.store.mixxx.model.track_location import MixxxTrackLocation
+from mixync.store.portable import PortableStore
+from mixync.utils.list import chunks
+
+DIRECTORY_NAMES = ['Electronic', 'Hip-Hop', 'Misc']
+GENRES = ['House', 'Techno', 'Drum & Bass', 'Hip-Hop', 'Disco', 'Ambient']
+KEYS = ['Am', 'C', 'Em', 'G', 'Bm', 'D', 'F#m', 'A']
+SAMPLE_RATE = 44100
+CHANNELS = 2
+INSERT_CHUNK_SIZE = 5000
+
+def create_empty_mixxxdb(path: Path):
+    """Creates an empty mixxxdb with the schema expected by mixync."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    engine = create_engine(f'sqlite:///{path}')
+    MixxxBase.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(insert(MixxxSetting.__table__), [{'name': 'mixxx.schema.version', 'value': str(MIN_SCHEMA_VERSION)}])
+    engine.dispose()
+
+def generate_mixxxdb(path: Path, music_path: Path, track_count: int, audio_size: int, seed: int=0):
+    """
+    Generates a mixxxdb at the given path with the given number of tracks,
+    along with realistic cues, beats/keys blobs, playlists and crates and
+    dummy audio files of the given size in the given music folder.
+    """
+    random = Random(seed)
+    create_empty_mixxxdb(path)
+    engine = create_engine(f'sqlite:///{path}')
+    directories = [music_path / name for name in DIRECTORY_NAMES]
+    artist_count = max(1, track_count // 10)
+    now = datetime(2022, 1, 1)
+
+    def track_rows() -> Iterator[tuple[dict, dict, list[dict]]]:
+        for id in range(1, track_count + 1):
+            directory = directories[id % len(directories)]
+            file_path = directory / f'{id // 1000:03}' / f'track-{id}.mp3'
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            file_path.write_bytes(random.randbytes(audio_size))
+            duration = random.uniform(120, 480)
+            location = {
+                'id': id,
+                'location': str(file_path),
+                'filename': file_path.name,
+                'directory': str(file_path.parent),
+                'filesize': audio_size,
+                'fs_deleted': 0,
+                'needs_verification': 0,
+            }
+            track = {
+                'id': id,
+                'title': f'Track {id}',
+                'artist': f'Artist {random.randrange(artist_count)}',
+                'album': f'Album {id // 12}',
+                'year': str(random.randint(1980, 2022)),
+                'genre': random.choice(GENRES),
+                'tracknumber': str(id % 12 + 1),
+                'location': id,
+                'duration': duration,
+                'samplerate': SAMPLE_RATE,
+                'channels': CHANNELS,
+                'bpm': random.uniform(80, 180),
+                'beats': random.randbytes(random.randint(2_000, 16_000)),
+                'beats_version': 'BeatMap-1.0',
+                'beats_sub_version': '',
+                'key': random.choice(KEYS),
+                'keys': random.randbytes(random.randint(50, 200)),
+                'keys_version': 'KeyMap-1.0',
+                'keys_sub_version': '',
+                'timesplayed': random.randint(0, 50),
+                'rating': random.randint(0, 5),
+                'mixxx_deleted': 0,
+            }
+            samples = int(duration * SAMPLE_RATE * CHANNELS)
+            cues = [{
+                'track_id': id,
+                'type': CueType.MAIN_CUE,
+                'position': 0,
+                'length': 0,
+                'hotcue': -1,
+                'label': '',
+                'color': 0xFFFF0000,
+            }] + [{
+                'track_id': id,
+                'type': CueType.HOT_CUE,
+                'position': random.randrange(samples),
+                'length': 0,
+                'hotcue': hotcue,
+                'label': f'Hotcue {hotcue}',
+                'color': random.randrange(0xFFFFFF),
+            } for hotcue in range(random.randint(0, 8))]
+            yield location, track, cues
+
+    with engine.begin() as connection:
+        connection.execute(insert(MixxxDirectory.__table__), [{'directory': str(d)} for d in directories])
+        for chunk in chunks(track_rows(), INSERT_CHUNK_SIZE):
+            connection.execute(insert(MixxxTrackLocation.__table__), [l for l, _, _ in chunk])
+            connection.execute(insert(MixxxTrack.__table__), [t for _, t, _ in chunk])
+            connection.execute(insert(MixxxCue.__table__), [c for _, _, cs in chunk for c in cs])
+
+        # Playlists, including a large Auto DJ queue
+        playlist_count = max(1, track_count // 200)
+        playlist_rows = [{
+            'id': id,
+            'name': 'Auto DJ' if id == 1 else f'Playlist {id}',
+            'position': id,
+            'hidden': PlaylistType.AUTO_DJ if id == 1 else PlaylistType.DEFAULT,
+            'date_created': now + timedelta(days=id),
+            'date_modified': now + timedelta(days=id),
+            'locked': 0,
+        } for id in range(1, playlist_count + 1)]
+        connection.execute(insert(MixxxPlaylist.__table__), playlist_rows)
+        playlist_track_rows = []
+        for playlist in playlist_rows:
+            size = min(track_count, 5000 if playlist['id'] == 1 else random.randint(20, 200))
+            playlist_track_rows += [{
+                'playlist_id': playlist['id'],
+                'track_id': track_id,
+                'position': position,
+            } for position, track_id in enumerate(random.sample(range(1, track_count + 1), size))]
+        for chunk in chunks(playlist_track_rows, INSERT_CHUNK_SIZE):
+            connection.execute(insert(MixxxPlaylistTrack.__table__), chunk)
+
+        # Crates
+        crate_count = max(1, track_count // 500)
+        connection.execute(insert(MixxxCrate.__table__), [{
+            'id': id,
+            'name': f'Crate {id}',
+            'locked': 0,
+        } for id in range(1, crate_count + 1)])
+        crate_track_rows = [{
+            'crate_id': id,
+            'track_id': track_id,
+        } for id in range(1, crate_count + 1) for track_id in random.sample(range(1, track_count + 1), min(track_count, random.randint(50, 500)))]
+        for chunk in chunks(crate_track_rows, INSERT_CHUNK_SIZE):
+            connection.execute(insert(MixxxCrateTrack.__table__), chunk)
+    engine.dispose()
+
+def generate_musiclib(path: Path, mixxxdb_path: Path):
+    """Generates a musiclib by exporting the given (synthetic) mixxxdb."""
+    MixxxStore(mixxxdb_path).copy_to(PortableStore(path), Options(assume_yes=True))
@@ -1,19 +1,23 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
 import argparse
+import json
 import sys
 
+from dataclasses import replace
 from pathlib import Path
 
+from mixync.metrics import Metrics
 from mixync.options import Options, ResourceType
-from mixync.store import Store
-from mixync.store.debug import DebugStore
-from mixync.store.mixxx import MixxxStore
-from mixync.store.portable import PortableStore
+from mixync.registry import BUILTIN_STORES, find_store
+from mixync.utils.cli import info
+from mixync.utils.sqlite import SQLITE_PROFILES
 
-STORES = [
-    DebugStore,
-    MixxxStore,
-    PortableStore,
-]
+# Stores, the server and the planner are imported where they are needed, so
+# that starting the CLI (e.g. for --help) does not import SQLAlchemy
+if TYPE_CHECKING:
+    from mixync.store import Store
 
 RESOURCE_TYPES = {
     'tracks': ResourceType.TRACK,
@@ -21,17 +25,47 @@ RESOURCE_TYPES = {
     'crates': ResourceType.CRATE,
 }
 
-def parse_ref(ref: str) -> Store:
-    for store_cls in STORES:
-        store = store_cls.parse_ref(ref)
-        if store:
-            return store
+def parse_ref(ref: str, opts: Options) -> Store:
+    store_cls = find_store(ref)
+    store = store_cls.parse_ref(ref, opts) if store_cls else None
+    if store:
+        return store
 
     print(f"Could not parse ref '{ref}'!")
     sys.exit(1)
 
-def main():
-    parser = argparse.ArgumentParser(prog='mixync', description='Tool for copying Mixxx databases with tracks in a portable manner')
+def serve_main(argv: list[str]):
+    parser = argparse.ArgumentParser(prog='mixync serve', description='Serves a musiclib over HTTP, so it can be used as a remote ref (http://host:port)')
+    parser.add_argument('ref', help='The musiclib to serve')
+    parser.add_argument('--host', default='127.0.0.1', help='The address to listen on (only the local machine by default, since there is no authentication).')
+    parser.add_argument('-p', '--port', type=int, default=8421, help='The port to listen on (0 picks a free one).')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Whether to log every request.')
+    parser.add_argument('--sqlite-profile', choices=sorted(SQLITE_PROFILES.keys()), help="The SQLite settings to use for the musiclib ('fast' by default).")
+    parser.add_argument('--content-addressed', action='store_true', help='Whether a new musiclib should store audio by content digest, storing identical files only once.')
+
+    args = parser.parse_args(argv)
+
+    from mixync.server import serve
+    from mixync.store.portable import PortableStore
+
+    opts = Options(
+        log=True,
+        verbose=args.verbose,
+        assume_yes=True,
+        content_addressed=args.content_addressed,
+        sqlite_profile=SQLITE_PROFILES[args.sqlite_profile] if args.sqlite_profile else None,
+    )
+
+    store = parse_ref(args.ref, opts)
+    # Other stores (e.g. mixxxdbs) use absolute paths and may prompt, which clients cannot handle
+    if not isinstance(store, PortableStore):
+        print(f"Only musiclibs can be served, not a {type(store).__name__}!")
+        sys.exit(1)
+
+    serve(store, args.host, args.port, verbose=args.verbose)
+
+def add_copy_arguments(parser: argparse.ArgumentParser):
+    """Adds the arguments shared by copying and planning a copy."""
     parser.add_argument('source', help='The source ref (to be copied from)')
     parser.add_argument('dest', help='The destination ref (to be copied to)')
     parser.add_argument('-r', '--dest-root-dir', type=str, help='A root folder to place copied music directories in. Only used by some destination stores.')
@@ -39,21 +73,29 @@ def main():
     parser.add_argument('-d', '--filter-dirs', default='', help='Comma-separated list of directory names to filter.')
     parser.add_argument('-y', '--assume-yes', action='store_true', help='Whether to disable interactive prompts.')
     parser.add_argument('-v', '--verbose', action='store_true', help='Whether to log verbosely.')
-    parser.add_argument('--dry-run', action='store_true', help='Whether to skip all actual file changes.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='The number of track files to transfer in parallel.')
+    parser.add_argument('-p', '--pipeline', action='store_true', help='Whether to transfer track files while the remaining metadata is still being copied.')
+    parser.add_argument('-b', '--batch-size', type=int, default=1000, help='The number of entries to write (and commit) to the destination at once.')
+    parser.add_argument('--sqlite-profile', choices=sorted(SQLITE_PROFILES.keys()), help="The SQLite settings to use for databases (by default 'safe' for mixxxdbs and 'fast' for musiclibs).")
+    parser.add_argument('--content-addressed', action='store_true', help='Whether new musiclibs should store audio by content digest, storing identical files only once.')
+    parser.add_argument('--match-content', action='store_true', help='Whether to also identify tracks by a digest of their audio content, recognizing moved or retagged tracks (only supported by musiclib destinations). Tags are ignored in MP3 and FLAC files, other formats are only recognized if unchanged.')
+    parser.add_argument('-u', '--delta', action='store_true', help='Whether to skip track files whose size and modification time are unchanged in the destination.')
+    parser.add_argument('-c', '--checksum', action='store_true', help='Whether to compare content digests instead of modification times to detect unchanged track files (implies --delta).')
 
-    args = parser.parse_args()
-
-    if args.source == args.dest:
-        print('Source and destination identical, doing nothing.')
-        sys.exit(0)
-
-    source = parse_ref(args.source)
-    dest = parse_ref(args.dest)
+def parse_copy_options(args: argparse.Namespace) -> Options:
+    """Creates the options from the arguments added by add_copy_arguments."""
     opts = Options(
         log=True,
         verbose=args.verbose,
-        dry_run=args.dry_run,
         assume_yes=args.assume_yes,
+        delta=args.delta or args.checksum,
+        checksum=args.checksum,
+        content_addressed=args.content_addressed,
+        match_content=args.match_content,
+        pipeline=args.pipeline,
+        jobs=max(1, args.jobs),
+        batch_size=max(1, args.batch_size),
+        sqlite_profile=SQLITE_PROFILES[args.sqlite_profile] if args.sqlite_profile else None,
         dest_root_dir=Path(args.dest_root_dir) if args.dest_root_dir else None,
         filter={t for t in [RESOURCE_TYPES.get(t, None) for t in args.filter.split(',')] if t},
         filter_dirs={d.strip() for d in args.filter_dirs.split(',') if d.strip()}
@@ -62,4 +104,138 @@ def main():
     if opts.filter and not ResourceType.TRACK in opts.filter:
         print('Warning: Not including tracks in your filter will always lead to empty playlists/crates!')
 
-    source.copy_to(dest, opts=opts)
+    return opts
+
+def add_stats_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--stats', action='store_true', help='Whether to print timings, SQL statement counts and transfer rates after copying.')
+    parser.add_argument('--stats-json', type=str, help='A file to write the timings, SQL statement counts and transfer rates to as JSON.')
+
+def print_stats(metrics: Metrics, args: argparse.Namespace):
+    if args.stats:
+        for line in metrics.summary():
+            info(line)
+
+    if args.stats_json:
+        with open(args.stats_json, 'w') as f:
+            json.dump(metrics.to_json(), f, indent=2)
+
+def absolute_ref(ref: str) -> str:
+    """Makes path refs absolute, so a plan can be applied from another working directory."""
+    if ref.startswith('@') or '://' in ref:
+        return ref
+    return str(Path(ref).absolute())
+
+def plan_main(argv: list[str]):
+    from mixync.plan import BYTES_PER_SEC, ROWS_PER_SEC, make_plan, save_plan
+
+    parser = argparse.ArgumentParser(prog='mixync plan', description='Computes what copying from the source to the destination would write and how long it would take, without writing anything. Only a musiclib destination that does not exist yet is created (empty), since the plan refers to its library id.')
+    add_copy_arguments(parser)
+    parser.add_argument('-o', '--output', type=str, help="A file to save the plan to as JSON, for applying it later with 'mixync apply'.")
+    parser.add_argument('--rows-per-sec', type=float, default=ROWS_PER_SEC, help=f'The number of metadata rows the destination writes per second, for estimating the duration ({ROWS_PER_SEC} by default).')
+    parser.add_argument('--mb-per-sec', type=float, default=BYTES_PER_SEC / 1_000_000, help=f'The track file throughput in MB/s, for estimating the duration ({BYTES_PER_SEC // 1_000_000} by default).')
+
+    args = parser.parse_args(argv)
+
+    if args.source == args.dest:
+        print('Source and destination identical, doing nothing.')
+        sys.exit(0)
+
+    opts = parse_copy_options(args)
+    source = parse_ref(args.source, opts)
+    dest = parse_ref(args.dest, opts)
+
+    plan = make_plan(source, dest, absolute_ref(args.source), absolute_ref(args.dest), opts)
+    plan.estimate(rows_per_sec=args.rows_per_sec, bytes_per_sec=args.mb_per_sec * 1_000_000)
+    source.close()
+    dest.close()
+
+    if opts.verbose:
+        for item in plan.items:
+            print(f"{item.action.capitalize()} {item.resource[:-1]} '{item.name}'{f' ({item.size / 1_000_000} MB)' if item.size is not None else ''}")
+    for line in plan.summary():
+        info(line)
+
+    if args.output:
+        save_plan(plan, args.output)
+        info(f"Saved plan to {args.output}, apply it with 'mixync apply {args.output}'")
+
+def apply_main(argv: list[str]):
+    from mixync.plan import load_plan
+
+    parser = argparse.ArgumentParser(prog='mixync apply', description="Applies a plan saved by 'mixync plan'")
+    parser.add_argument('plan', help='The plan (as saved by mixync plan -o)')
+    parser.add_argument('-y', '--assume-yes', action='store_true', help='Whether to disable interactive prompts.')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Whether to log verbosely.')
+    parser.add_argument('-j', '--jobs', type=int, help='The number of track files to transfer in parallel (as planned by default).')
+    add_stats_arguments(parser)
+
+    args = parser.parse_args(argv)
+
+    plan = load_plan(args.plan)
+    opts = replace(
+        plan.opts,
+        log=True,
+        verbose=args.verbose,
+        assume_yes=args.assume_yes,
+        jobs=max(1, args.jobs) if args.jobs else plan.opts.jobs,
+    )
+
+    source = parse_ref(plan.source, opts)
+    dest = parse_ref(plan.dest, opts)
+
+    if source.identity() != plan.source_identity or dest.identity() != plan.dest_identity:
+        print(f'The plan was made for other stores than {plan.source} and {plan.dest}!')
+        sys.exit(1)
+
+    metrics = Metrics()
+    dest.save_id_mappings(source.identity(), plan.mappings)
+    source.copy_to(dest, opts=opts, metrics=metrics, only_ids=plan.only_ids())
+    source.close()
+    dest.close()
+
+    print_stats(metrics, args)
+
+COMMANDS = {
+    'apply': apply_main,
+    'plan': plan_main,
+    'serve': serve_main,
+}
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        COMMANDS[sys.argv[1]](sys.argv[2:])
+        return
+
+    parser = argparse.ArgumentParser(prog='mixync', description='Tool for copying Mixxx databases with tracks in a portable manner', epilog=f"Refs: {', '.join(spec.syntax for spec in BUILTIN_STORES)}. Other commands: {', '.join(COMMANDS.keys())} (see 'mixync <command> --help')")
+    add_copy_arguments(parser)
+    parser.add_argument('--dry-run', action='store_true', help='Whether to skip all actual file changes.')
+    parser.add_argument('-s', '--sync', action='store_true', help='Whether to sync both ways, only copying what changed on either side since the last sync (the source wins if both changed).')
+    parser.add_argument('--resume', action='store_true', help='Whether to resume an interrupted copy from the last checkpoint in the destination.')
+    add_stats_arguments(parser)
+
+    args = parser.parse_args()
+
+    if args.source == args.dest:
+        print('Source and destination identical, doing nothing.')
+        sys.exit(0)
+
+    opts = replace(parse_copy_options(args), dry_run=args.dry_run, resume=args.resume)
+
+    source = parse_ref(args.source, opts)
+    dest = parse_ref(args.dest, opts)
+
+    if args.sync and (opts.filter or opts.filter_dirs):
+        # The sync state would record filtered out changes as synced
+        print('Filters are not supported when syncing!')
+        sys.exit(1)
+
+    metrics = Metrics()
+    if args.sync:
+        from mixync.sync import sync
+        sync(source, dest, opts=opts, metrics=metrics)
+    else:
+        source.copy_to(dest, opts=opts, metrics=metrics)
+    source.close()
+    dest.close()
+
+    print_stats(metrics, args)
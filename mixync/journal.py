@@ -0,0 +1,101 @@
+from __future__ import annotations
+from pathlib import Path
+from threading import Lock
+from typing import Any, Optional, TextIO
+
+import json
+import os
+
+JOURNAL_FILE_NAME = 'journal.jsonl'
+
+class Journal:
+    """
+    An append-only, on-disk record of the progress of a copy, kept in the
+    destination store. It records completed phases, committed metadata
+    batches (along with their id mappings) and finished file transfers,
+    so an interrupted copy can be resumed from its last checkpoint.
+    """
+
+    def __init__(self, path: Path, source: str):
+        self.path = path
+        self.source = source
+        self.resumed = False
+        self.completed_phases: set[str] = set()
+        self.id_mappings: dict[str, dict[int, int]] = {}
+        self.copied_files: set[str] = set()
+        self.lock = Lock()
+        self.file: Optional[TextIO] = None
+
+    @staticmethod
+    def open(state_path: Path, source: str, resume: bool) -> Journal:
+        """Opens the journal in the given state directory, resuming the previous one if requested and possible."""
+        state_path.mkdir(parents=True, exist_ok=True)
+        journal = Journal(state_path / JOURNAL_FILE_NAME, source)
+        if resume and journal.path.exists():
+            journal._load()
+        if journal.resumed:
+            journal.file = open(journal.path, 'a', encoding='utf8')
+        else:
+            journal.file = open(journal.path, 'w', encoding='utf8')
+            journal._append({'type': 'start', 'source': source}, sync=True)
+        return journal
+
+    def _load(self):
+        with open(self.path, 'r', encoding='utf8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # The last record may be truncated if we were interrupted while writing it
+                    break
+                type = record.get('type')
+                if type == 'start':
+                    if record.get('source') != self.source:
+                        return
+                    self.resumed = True
+                elif type == 'phase':
+                    self.completed_phases.add(record['name'])
+                elif type == 'batch':
+                    mapping = self.id_mappings.setdefault(record['resource'], {})
+                    for source_id, dest_id in record['ids']:
+                        mapping[source_id] = dest_id
+                elif type == 'file':
+                    self.copied_files.add(record['location'])
+
+    def _append(self, record: dict[str, Any], sync: bool=False):
+        assert self.file, 'Journal is not open'
+        with self.lock:
+            self.file.write(json.dumps(record) + '\n')
+            self.file.flush()
+            if sync:
+                os.fsync(self.file.fileno())
+
+    def is_completed(self, phase: str) -> bool:
+        return phase in self.completed_phases
+
+    def is_committed(self, resource: str, source_id: Optional[int]) -> bool:
+        return source_id is not None and source_id in self.id_mappings.get(resource, {})
+
+    def is_copied(self, location: str) -> bool:
+        return location in self.copied_files
+
+    def complete(self, phase: str):
+        self.completed_phases.add(phase)
+        self._append({'type': 'phase', 'name': phase}, sync=True)
+
+    def commit(self, resource: str, ids: list[tuple[int, int]]):
+        self.id_mappings.setdefault(resource, {}).update(ids)
+        self._append({'type': 'batch', 'resource': resource, 'ids': ids}, sync=True)
+
+    def copied(self, location: str):
+        self._append({'type': 'file', 'location': location})
+
+    def finish(self):
+        """Removes the journal after a successful copy."""
+        self.close()
+        self.path.unlink(missing_ok=True)
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,65 @@
+import re
+import unicodedata
+
+from typing import Iterable, Optional
+
+from mixync.model.track import TrackHeader
+
+# Featuring artists, e.g. 'Artist feat. Other' or 'Title (ft Other)'. Outside of brackets,
+# only the abbreviations with a dot count, since 'feat' is also a word (e.g. 'Little Feat').
+BRACKETED_FEATURING_REGEX = re.compile(r'[\(\[]\s*(?:feat\.?|ft\.?|featuring)\s[^\)\]]*[\)\]]')
+TRAILING_FEATURING_REGEX = re.compile(r'(?<=\S)\s+(?:feat\.|ft\.|featuring)\s.*$')
+
+def normalize(s: str) -> str:
+    """Normalizes a title or artist for matching, i.e. ignoring case, Unicode forms, whitespace and featuring artists."""
+    s = unicodedata.normalize('NFKC', s).casefold()
+    s = BRACKETED_FEATURING_REGEX.sub(' ', s)
+    s = TRAILING_FEATURING_REGEX.sub('', s)
+    return ' '.join(s.split())
+
+class TrackIndex:
+    """An in-memory index for matching tracks by their normalized title and artist."""
+
+    def __init__(self, headers: Iterable[TrackHeader]=()):
+        self.entries: dict[tuple[str, str], list[TrackHeader]] = {}
+        self.headers: dict[Optional[int], TrackHeader] = {}
+        self.digests: dict[str, list[TrackHeader]] = {}
+        for header in headers:
+            self.add(header)
+
+    def add(self, header: TrackHeader):
+        """Adds a track to the index, replacing the entry with the same id (if any)."""
+        old_header = self.headers.get(header.id)
+        if old_header is not None:
+            old_key = self._key(old_header)
+            self.entries[old_key] = [h for h in self.entries[old_key] if h.id != header.id]
+            if old_header.digest:
+                self.digests[old_header.digest] = [h for h in self.digests[old_header.digest] if h.id != header.id]
+        self.headers[header.id] = header
+        self.entries.setdefault(self._key(header), []).append(header)
+        if header.digest:
+            self.digests.setdefault(header.digest, []).append(header)
+
+    def match(self, header: TrackHeader) -> Optional[int]:
+        """
+        Finds the id of the matching track, by digest if possible (which also
+        recognizes renamed tracks) and by title/artist otherwise, preferring
+        the closest duration (if known) and the lowest id.
+        """
+        key = self._key(header)
+        digest_candidates = self.digests.get(header.digest) if header.digest else None
+        if digest_candidates:
+            # The same audio may belong to different tracks (e.g. on an album and
+            # a compilation), so prefer the one whose title and artist agree
+            return next((c.id for c in digest_candidates if self._key(c) == key), digest_candidates[0].id)
+        candidates = self.entries.get(key)
+        if not candidates:
+            return None
+        def distance(candidate: TrackHeader) -> tuple[float, int]:
+            if header.duration_ms is None or candidate.duration_ms is None:
+                return (0, candidate.id or 0)
+            return (abs(header.duration_ms - candidate.duration_ms), candidate.id or 0)
+        return min(candidates, key=distance).id
+
+    def _key(self, header: TrackHeader) -> tuple[str, str]:
+        return (normalize(header.name), normalize(header.artist))
@@ -0,0 +1,144 @@
+from __future__ import annotations
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from heapq import heappush, heappushpop
+from threading import Lock
+from time import perf_counter
+from typing import TYPE_CHECKING, Any, Iterable, Iterator
+
+if TYPE_CHECKING:
+    from sqlalchemy.engine import Engine
+
+# The number of slowest file transfers to keep.
+SLOWEST_FILE_COUNT = 10
+
+@dataclass
+class SQLMetrics:
+    """Statistics about the SQL statements executed against a store."""
+
+    count: int = 0
+    seconds: float = 0
+
+@dataclass(order=True)
+class FileMetrics:
+    """Statistics about a single track file transfer."""
+
+    seconds: float
+    size: int = field(compare=False)
+    location: str = field(compare=False)
+
+    @property
+    def mb_per_sec(self) -> float:
+        return self.size / 1_000_000 / self.seconds if self.seconds > 0 else 0
+
+class Metrics:
+    """
+    Records where the time of a copy goes: Wall times of the phases, SQL
+    statements executed per store and the throughput of file transfers.
+    Safe to update from multiple threads.
+    """
+
+    def __init__(self):
+        self.phases: dict[str, float] = {}
+        self.sql: dict[str, SQLMetrics] = {}
+        self.file_count = 0
+        self.file_seconds = 0.0
+        # Includes the bytes read for computing digests
+        self.bytes_read = 0
+        self.digest_bytes_read = 0
+        self.bytes_written = 0
+        self.slowest_files: list[FileMetrics] = []
+        self.lock = Lock()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Measures the wall time of the enclosed phase."""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0) + perf_counter() - start
+
+    @contextmanager
+    def watch_sql(self, name: str, engines: Iterable[Engine]) -> Iterator[None]:
+        """Counts and times the statements executed on the given engines while in the enclosed block."""
+        from sqlalchemy import event
+
+        sql = self.sql.setdefault(name, SQLMetrics())
+
+        def before_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault('mixync_statement_starts', []).append(perf_counter())
+
+        def after_execute(conn, cursor, statement, parameters, context, executemany):
+            seconds = perf_counter() - conn.info['mixync_statement_starts'].pop()
+            with self.lock:
+                sql.count += 1
+                sql.seconds += seconds
+
+        engines = list(engines)
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', before_execute)
+            event.listen(engine, 'after_cursor_execute', after_execute)
+        try:
+            yield
+        finally:
+            for engine in engines:
+                event.remove(engine, 'before_cursor_execute', before_execute)
+                event.remove(engine, 'after_cursor_execute', after_execute)
+
+    def record_file(self, location: str, size: int, seconds: float):
+        """Records a track file transfer of the given number of bytes."""
+        file = FileMetrics(seconds=seconds, size=size, location=location)
+        with self.lock:
+            self.file_count += 1
+            self.file_seconds += seconds
+            self.bytes_read += size
+            self.bytes_written += size
+            if len(self.slowest_files) < SLOWEST_FILE_COUNT:
+                heappush(self.slowest_files, file)
+            else:
+                heappushpop(self.slowest_files, file)
+
+    def record_digest(self, size: int):
+        """Records reading a track file of the given number of bytes for computing its digest."""
+        with self.lock:
+            self.bytes_read += size
+            self.digest_bytes_read += size
+
+    def throughput(self) -> float:
+        """The overall transfer rate of the track files in MB/s (including parallelism)."""
+        seconds = self.phases.get('track_files', self.file_seconds)
+        return self.bytes_written / 1_000_000 / seconds if seconds > 0 else 0
+
+    def summary(self) -> list[str]:
+        """Formats the metrics as human-readable lines."""
+        lines = [f'Phase {name}: {seconds:.2f} s' for name, seconds in self.phases.items()]
+        lines += [f'SQL ({name}): {sql.count} statements in {sql.seconds:.2f} s' for name, sql in self.sql.items()]
+        lines.append(f'Files: {self.file_count} transferred, {self.bytes_read / 1_000_000:.1f} MB read ({self.digest_bytes_read / 1_000_000:.1f} MB for digests), {self.bytes_written / 1_000_000:.1f} MB written ({self.throughput():.1f} MB/s)')
+        if self.slowest_files:
+            lines.append('Slowest files:')
+        for file in sorted(self.slowest_files, reverse=True):
+            lines.append(f'  {file.seconds:.2f} s ({file.mb_per_sec:.1f} MB/s): {file.location}')
+        return lines
+
+    def to_json(self) -> dict[str, Any]:
+        """Converts the metrics to a JSON-serializable dict."""
+        return {
+            'phases': self.phases,
+            'sql': {name: {'count': sql.count, 'seconds': sql.seconds} for name, sql in self.sql.items()},
+            'files': {
+                'count': self.file_count,
+                'seconds': self.file_seconds,
+                'bytes_read': self.bytes_read,
+                'digest_bytes_read': self.digest_bytes_read,
+                'bytes_written': self.bytes_written,
+                'mb_per_sec': self.throughput(),
+                'slowest': [{
+                    'location': file.location,
+                    'size': file.size,
+                    'seconds': file.seconds,
+                    'mb_per_sec': file.mb_per_sec,
+                } for file in sorted(self.slowest_files, reverse=True)],
+            },
+        }
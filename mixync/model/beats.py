@@ -1,7 +1,10 @@
 from dataclasses import dataclass, field
 from typing import Optional
 
-@dataclass
+from mixync.utils.dataclass import slotted
+
+@slotted
+@dataclass(frozen=True)
 class Beats:
     """
     A binary beatgrid, in one of Mixxx's formats (e.g. BeatMap-1.0).
@@ -2,11 +2,15 @@ from dataclasses import dataclass, field
 from datetime import datetime
 from typing import Optional
 
+from mixync.utils.dataclass import slotted
+
+@slotted
 @dataclass
 class CrateHeader:
     id: Optional[int]
     name: str
 
+@slotted
 @dataclass
 class Crate:
     """An unordered list of tracks."""
@@ -2,7 +2,9 @@ from dataclasses import dataclass
 from typing import Optional
 
 from mixync.model.cue_type import CueType
+from mixync.utils.dataclass import slotted
 
+@slotted
 @dataclass
 class Cue:
     """A position or loop marker within a track."""
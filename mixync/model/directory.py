@@ -3,6 +3,9 @@ import re
 from dataclasses import dataclass
 from typing import Optional
 
+from mixync.utils.dataclass import slotted
+
+@slotted
 @dataclass
 class Directory:
     """A music directory containing audio files."""
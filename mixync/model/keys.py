@@ -1,7 +1,10 @@
 from dataclasses import dataclass
 from typing import Optional
 
-@dataclass
+from mixync.utils.dataclass import slotted
+
+@slotted
+@dataclass(frozen=True)
 class Keys:
     """
     A binary keygrid, in one of Mixxx's formats (e.g. KeyMap-1.0).
@@ -3,12 +3,15 @@ from datetime import datetime
 from typing import Optional
 
 from mixync.model.playlist_type import PlaylistType
+from mixync.utils.dataclass import slotted
 
+@slotted
 @dataclass
 class PlaylistHeader:
     id: Optional[int]
     name: str
 
+@slotted
 @dataclass
 class Playlist:
     """An ordered list of tracks."""
@@ -5,13 +5,18 @@ from typing import Optional
 from mixync.model.beats import Beats
 from mixync.model.cue import Cue
 from mixync.model.keys import Keys
+from mixync.utils.dataclass import slotted
 
+@slotted
 @dataclass
 class TrackHeader:
     id: Optional[int]
     name: str
     artist: str
+    duration_ms: Optional[int] = None
+    digest: Optional[str] = None
 
+@slotted
 @dataclass
 class Track:
     """A song."""
@@ -31,6 +36,7 @@ class Track:
     # We don't need cuepoint, since that one's stored in cues too
     cues: list[Cue] = field(default_factory=lambda: [])
     bpm: Optional[float] = None
+    # Beats and keys are only loaded for tracks that are actually written (see Store.load_track_blobs)
     beats: Optional[Beats] = None
     key: Optional[str] = None
     keys: Optional[Keys] = None
@@ -39,10 +45,14 @@ class Track:
     rating: Optional[int] = None
     color: Optional[int] = None
     last_played_at: Optional[datetime] = None
+    # A digest of the audio content, used to recognize moved or retagged tracks
+    digest: Optional[str] = None
 
     def header(self) -> TrackHeader:
         return TrackHeader(
             id=self.id,
             name=self.name,
-            artist=self.artist
+            artist=self.artist,
+            duration_ms=self.duration_ms,
+            digest=self.digest
         )
@@ -0,0 +1,12 @@
+from dataclasses import dataclass
+from typing import Optional
+
+from mixync.utils.dataclass import slotted
+
+@slotted
+@dataclass
+class TrackFileInfo:
+    """File system metadata about a stored audio file, used to detect unchanged files."""
+
+    size: int
+    mtime: Optional[float] = None # seconds since the epoch
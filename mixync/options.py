@@ -3,6 +3,8 @@ from enum import IntEnum
 from pathlib import Path
 from typing import Optional
 
+from mixync.utils.sqlite import SQLiteProfile
+
 class ResourceType(IntEnum):
     TRACK = 0
     PLAYLIST = 1
@@ -20,6 +22,31 @@ class Options:
     dry_run: bool = False
     # Whether to disable interactive prompts.
     assume_yes: bool = False
+    # Whether to skip track files whose size and modification time
+    # match the file already present in the destination.
+    delta: bool = False
+    # Whether to compare content digests instead of modification
+    # times when checking for unchanged track files. Implies delta.
+    checksum: bool = False
+    # Whether new portable musiclibs should store audio by content digest,
+    # storing identical files only once.
+    content_addressed: bool = False
+    # Whether to identify tracks by a digest of their audio content, so that
+    # moved or retagged tracks are recognized (requires reading new tracks).
+    match_content: bool = False
+    # Whether to resume an interrupted copy from the destination's journal.
+    resume: bool = False
+    # Whether to transfer the track files of committed track batches while
+    # later batches (and playlists/crates) are still being copied.
+    pipeline: bool = False
+    # The number of track files to transfer in parallel.
+    jobs: int = 1
+    # The number of entries to write (and commit) to the destination at once.
+    batch_size: int = 1000
+    # The SQLite connection settings to use for the stores' databases.
+    # None uses the store's default (safe for the mixxxdb and fast for
+    # portable musiclibs).
+    sqlite_profile: Optional[SQLiteProfile] = None
     # A root folder to place copied music directories in. Only used
     # by some stores. For example, when set to ~/Music/Mixync and when
     # copying to the @local Mixxx store, the directories would be placed
@@ -0,0 +1,237 @@
+from collections import Counter
+from dataclasses import dataclass, field, replace
+from typing import Any, Callable, Iterable, Optional
+
+import json
+
+from mixync.model.playlist import Playlist
+from mixync.model.track import Track
+from mixync.options import Options, ResourceType
+from mixync.store import PERSISTED_RESOURCES, IdMapping, IdMappings, Store
+from mixync.sync import row_hash
+from mixync.utils.codec import decode, encode
+from mixync.utils.list import chunks
+from mixync.utils.str import format_duration
+
+# Rough throughputs for estimating how long applying a plan takes. Both
+# depend a lot on the stores and the disk or network, so they can be
+# overridden from the command line.
+# The number of metadata rows (tracks, cues, memberships, ...) written per second.
+ROWS_PER_SEC = 10_000
+# The number of bytes of track files transferred per second.
+BYTES_PER_SEC = 50_000_000
+
+@dataclass
+class PlanCounts:
+    """How many values of a resource a plan inserts, updates, skips and deletes."""
+
+    insert: int = 0
+    update: int = 0
+    skip: int = 0
+    delete: int = 0
+
+@dataclass
+class PlanItem:
+    """A track, playlist, crate or track file that a plan writes."""
+
+    # The resource name, i.e. tracks, playlists, crates or files
+    resource: str
+    # Either insert or update
+    action: str
+    # The id in the source store (of the track, for files)
+    id: int
+    name: str
+    # The number of bytes to transfer (for files)
+    size: Optional[int] = None
+
+@dataclass
+class Plan:
+    """
+    What copying from one store to another would write, computed up front
+    without writing anything. Can be saved as JSON and applied later.
+    """
+
+    # The refs of the stores
+    source: str
+    dest: str
+    # The identities of the stores, to make sure that the plan is applied to the stores it was made for
+    source_identity: str
+    dest_identity: str
+    opts: Options
+    # The counts by resource, i.e. directories, tracks, cues, playlists, playlist entries, crates, crate entries and files
+    counts: dict[str, PlanCounts] = field(default_factory=dict)
+    items: list[PlanItem] = field(default_factory=list)
+    # The newly matched id mappings, which applying the plan persists first
+    mappings: dict[str, dict[int, int]] = field(default_factory=dict)
+    file_bytes: int = 0
+    estimated_secs: float = 0
+
+    def only_ids(self) -> dict[str, set[int]]:
+        """The ids of the source values to copy when applying the plan (by resource name)."""
+        ids: dict[str, set[int]] = {resource: set() for resource in PERSISTED_RESOURCES}
+        for item in self.items:
+            ids['tracks' if item.resource == 'files' else item.resource].add(item.id)
+        return ids
+
+    def estimate(self, rows_per_sec: float=ROWS_PER_SEC, bytes_per_sec: float=BYTES_PER_SEC):
+        """Estimates the duration of applying the plan from the given throughputs."""
+        rows = sum(c.insert + c.update + c.delete for r, c in self.counts.items() if r != 'files')
+        self.estimated_secs = rows / rows_per_sec + self.file_bytes / bytes_per_sec
+
+    def summary(self) -> list[str]:
+        lines = [f'Plan for copying from {self.source} to {self.dest}']
+        for resource, counts in self.counts.items():
+            label = resource.replace('_', ' ').capitalize()
+            lines.append(f'{label}: {counts.insert} to insert, {counts.update} to update, {counts.skip} to skip, {counts.delete} to delete')
+        lines.append(f'Track files to transfer: {self.file_bytes / 1_000_000:.1f} MB')
+        lines.append(f'Estimated duration: {format_duration(self.estimated_secs)}')
+        return lines
+
+    def to_json(self) -> dict[str, Any]:
+        return encode(self)
+
+    @staticmethod
+    def from_json(data: dict[str, Any]):
+        return decode(data, Plan)
+
+def load_plan(path: str) -> Plan:
+    with open(path, 'r') as f:
+        return Plan.from_json(json.load(f))
+
+def save_plan(plan: Plan, path: str):
+    with open(path, 'w') as f:
+        json.dump(plan.to_json(), f, indent=2)
+
+def make_plan(source: Store, dest: Store, source_ref: str, dest_ref: str, opts: Options) -> Plan:
+    """
+    Computes what copying from the source to the destination store would write,
+    the same way Store.copy_to maps the values. Values are only compared by their
+    metadata (not by their beats and keys), memberships and cues are compared
+    as multisets. Since copies never remove tracks, playlists or crates from the
+    destination, only cues and memberships are ever deleted.
+    """
+    plan = Plan(source=source_ref, dest=dest_ref, source_identity=source.identity(), dest_identity=dest.identity(), opts=opts)
+    id_mappings = IdMappings()
+    persisted_mappings = dest.load_id_mappings(source.identity())
+    id_mappings.update(persisted_mappings)
+
+    # Like when copying, directories are absolutized first, since that resolves the track locations
+    _plan_directories(plan, source, dest, id_mappings.directories, opts)
+    if opts.filters(ResourceType.TRACK):
+        _plan_tracks(plan, source, dest, id_mappings, opts)
+    if opts.filters(ResourceType.PLAYLIST):
+        _plan_memberships(plan, 'playlists', 'playlist_entries', list(source.playlists()), list(dest.playlists()), id_mappings, dest.match_playlists)
+    if opts.filters(ResourceType.CRATE):
+        _plan_memberships(plan, 'crates', 'crate_entries', list(source.crates()), list(dest.crates()), id_mappings, dest.match_crates)
+
+    # Persisting the matched mappings spares matching the values again when applying the plan
+    plan.mappings = id_mappings.changes(persisted_mappings, PERSISTED_RESOURCES)
+    plan.estimate()
+    return plan
+
+def _plan_directories(plan: Plan, source: Store, dest: Store, id_mapping: IdMapping, opts: Options):
+    rel_directories = [source.relativize_directory(d, opts) for d in source.directories()]
+    dest_directories = [dest.absolutize_directory(d, opts) for d in rel_directories if d]
+    counts = plan.counts.setdefault('directories', PlanCounts())
+    for directory in id_mapping.apply_or_match([d for d in dest_directories if d], dest.match_directories):
+        if directory.id is None:
+            counts.insert += 1
+        else:
+            counts.skip += 1
+
+def _plan_tracks(plan: Plan, source: Store, dest: Store, id_mappings: IdMappings, opts: Options):
+    track_counts = plan.counts.setdefault('tracks', PlanCounts())
+    cue_counts = plan.counts.setdefault('cues', PlanCounts())
+    file_counts = plan.counts.setdefault('files', PlanCounts())
+    # Only the hashes and cues of the destination's tracks are kept around
+    dest_tracks = {t.id: (_track_hash(t), _cue_counts(t)) for t in dest.tracks() if t.id}
+    match_digests = opts.match_content and dest.matches_track_digests()
+
+    for batch in chunks(source.track_pairs(dest, opts), opts.batch_size):
+        if match_digests:
+            batch = source.with_audio_digests(batch, id_mappings.tracks, opts)
+        mapped_values = id_mappings.tracks.apply_or_match([d for _, d in batch], lambda ts: source.match_tracks_to(dest, ts, id_mappings.tracks))
+        for (track, dest_track), mapped in zip(batch, mapped_values):
+            # Tracks read from a store always have ids
+            assert track.id is not None
+            existing = dest_tracks.get(mapped.id) if mapped.id else None
+            cues = _cue_counts(mapped)
+            if mapped.id is None or existing is None:
+                action = 'insert'
+                cue_counts.insert += sum(cues.values())
+            else:
+                existing_hash, existing_cues = existing
+                if existing_hash == _track_hash(mapped) and existing_cues == cues:
+                    action = None
+                    cue_counts.skip += sum(cues.values())
+                else:
+                    action = 'update'
+                    cue_counts.insert += sum((cues - existing_cues).values())
+                    cue_counts.delete += sum((existing_cues - cues).values())
+                    cue_counts.skip += sum((cues & existing_cues).values())
+                id_mappings.tracks.update([track], [mapped.id])
+            if action:
+                setattr(track_counts, action, getattr(track_counts, action) + 1)
+                plan.items.append(PlanItem(resource='tracks', action=action, id=track.id, name=track.name))
+            else:
+                track_counts.skip += 1
+            _plan_file(plan, file_counts, source, dest, track, dest_track, opts)
+
+def _plan_file(plan: Plan, counts: PlanCounts, source: Store, dest: Store, track: Track, dest_track: Track, opts: Options):
+    assert track.id is not None
+    file_info = source.track_file_info(track.location)
+    if opts.delta and source.track_file_unchanged(dest, track.location, dest_track.location, file_info, opts):
+        counts.skip += 1
+        return
+    action = 'update' if dest.track_file_info(dest_track.location) else 'insert'
+    setattr(counts, action, getattr(counts, action) + 1)
+    size = file_info.size if file_info else None
+    plan.file_bytes += size or 0
+    plan.items.append(PlanItem(resource='files', action=action, id=track.id, name=track.name, size=size))
+
+def _plan_memberships(plan: Plan, resource: str, entries_resource: str, values: list[Any], dest_values: list[Any], id_mappings: IdMappings, matcher: Callable[[list[Any]], Iterable[Optional[int]]]):
+    counts = plan.counts.setdefault(resource, PlanCounts())
+    entry_counts = plan.counts.setdefault(entries_resource, PlanCounts())
+    dest_by_id = {v.id: v for v in dest_values if v.id}
+    id_mapping: IdMapping = getattr(id_mappings, resource)
+    # Tracks that the plan inserts are not mapped yet, so they get a placeholder
+    planned_track_ids = {item.id for item in plan.items if item.resource == 'tracks' and item.action == 'insert'}
+
+    def map_track_ids(value):
+        mapped_ids = [id_mappings.tracks.get(id) or (-id if id in planned_track_ids else None) for id in value.track_ids]
+        return replace(value, track_ids=type(value.track_ids)(id for id in mapped_ids if id))
+
+    mapped_values = id_mapping.apply_or_match([map_track_ids(v) for v in values], lambda vs: matcher([v.header() for v in vs]))
+    for value, mapped in zip(values, mapped_values):
+        existing = dest_by_id.get(mapped.id) if mapped.id else None
+        entries = Counter(mapped.track_ids)
+        if existing is None:
+            action = 'insert'
+            entry_counts.insert += sum(entries.values())
+        else:
+            existing_entries = Counter(existing.track_ids)
+            id_mapping.mapping[value.id] = mapped.id
+            if _membership_hash(mapped) == _membership_hash(existing):
+                action = None
+            else:
+                action = 'update'
+                entry_counts.insert += sum((entries - existing_entries).values())
+                entry_counts.delete += sum((existing_entries - entries).values())
+            entry_counts.skip += sum((entries & existing_entries).values())
+        if action:
+            setattr(counts, action, getattr(counts, action) + 1)
+            plan.items.append(PlanItem(resource=resource, action=action, id=value.id, name=value.name))
+        else:
+            counts.skip += 1
+
+def _track_hash(track: Track) -> str:
+    # Cues are compared separately, beats/keys are not loaded and not every store keeps digests.
+    # Mixxx stores track numbers as text, so they are compared as such.
+    return row_hash(replace(track, cues=[], digest=None, track_number=str(track.track_number or '')))
+
+def _cue_counts(track: Track) -> Counter[str]:
+    return Counter(json.dumps(encode(cue), sort_keys=True) for cue in track.cues)
+
+def _membership_hash(value: Any) -> str:
+    # Not every store keeps the positions of playlists
+    return row_hash(replace(value, position=None) if isinstance(value, Playlist) else value)
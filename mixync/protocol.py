@@ -0,0 +1,65 @@
+from functools import lru_cache
+from inspect import signature
+from typing import Any, get_args, get_type_hints
+
+from mixync.store import Store
+from mixync.utils.codec import decode
+
+# The prefix of all paths, for evolving the protocol without breaking older clients.
+API_PREFIX = '/v1'
+
+# The store methods that clients can call remotely. Their arguments and results
+# are JSON-encoded according to the type hints of the corresponding Store method.
+# Most of them take whole batches, so metadata is never sent value by value.
+CALLABLE_METHODS = frozenset({
+    'load_track_blobs',
+    'load_id_mappings',
+    'save_id_mappings',
+    'load_sync_hashes',
+    'save_sync_hashes',
+    'match_tracks',
+    'match_playlists',
+    'match_crates',
+    'match_directories',
+    'update_tracks',
+    'update_playlists',
+    'update_crates',
+    'update_directories',
+    'track_file_info',
+    'track_file_digest',
+    'track_audio_digest',
+    'link_track',
+})
+
+# The store methods whose (potentially large) results are streamed as JSON lines.
+LISTABLE_METHODS = frozenset({
+    'tracks',
+    'playlists',
+    'crates',
+    'directories',
+})
+
+@lru_cache(maxsize=None)
+def method_hints(method: str) -> tuple[tuple[Any, ...], Any]:
+    """The parameter and return type hints of the given Store method."""
+    func = getattr(Store, method)
+    hints = get_type_hints(func)
+    params = [p for p in signature(func).parameters if p != 'self']
+    # Methods without results are not annotated
+    return tuple(hints[p] for p in params), hints.get('return', type(None))
+
+def decode_args(method: str, data: list[Any]) -> list[Any]:
+    """Decodes the JSON-encoded arguments of a call to the given Store method."""
+    param_hints, _ = method_hints(method)
+    return [decode(arg, hint) for arg, hint in zip(data, param_hints)]
+
+def decode_result(method: str, data: Any) -> Any:
+    """Decodes the JSON-encoded result of a call to the given Store method."""
+    _, return_hint = method_hints(method)
+    return decode(data, return_hint)
+
+def decode_item(method: str, data: Any) -> Any:
+    """Decodes a JSON-encoded value listed by the given Store method."""
+    _, return_hint = method_hints(method)
+    item_hint, = get_args(return_hint)
+    return decode(data, item_hint)
@@ -0,0 +1,68 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from functools import lru_cache
+from importlib import import_module
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Optional
+
+if TYPE_CHECKING:
+    from mixync.store import Store
+
+# The entry point group through which other packages can register stores.
+# Every entry point should refer to a StoreSpec, in a module that is cheap to import.
+ENTRY_POINT_GROUP = 'mixync.stores'
+
+@dataclass(frozen=True)
+class StoreSpec:
+    """
+    Declares a store by its ref syntax, so that the store (and its dependencies,
+    e.g. SQLAlchemy) is only imported once a ref actually selects it.
+    """
+
+    # The store class, as 'module:ClassName'
+    target: str
+    # Whether the given ref is meant for the store, checked without importing it
+    matches: Callable[[str], bool]
+    # An example of the ref syntax
+    syntax: str
+
+    def load(self) -> type[Store]:
+        module, name = self.target.split(':')
+        return getattr(import_module(module), name)
+
+def _ref_name(ref: str) -> str:
+    try:
+        return Path(ref).name
+    except:
+        return ''
+
+BUILTIN_STORES = [
+    StoreSpec('mixync.store.archive:ArchiveStore', lambda ref: _ref_name(ref).endswith('.musiclib.zip'), 'path/to/library.musiclib.zip'),
+    StoreSpec('mixync.store.debug:DebugStore', lambda ref: ref in ('@debug', '@debugcompact'), '@debug'),
+    StoreSpec('mixync.store.mixxx:MixxxStore', lambda ref: ref == '@local' or _ref_name(ref) == 'mixxxdb.sqlite', '@local'),
+    StoreSpec('mixync.store.portable:PortableStore', lambda ref: _ref_name(ref).endswith('.musiclib'), 'path/to/library.musiclib'),
+    StoreSpec('mixync.store.remote:RemoteStore', lambda ref: ref.startswith('http://') or ref.startswith('https://'), 'http://host:port'),
+]
+
+@lru_cache(maxsize=None)
+def registered_stores() -> tuple[StoreSpec, ...]:
+    """The stores registered by other packages through entry points."""
+    from importlib.metadata import entry_points
+    eps = entry_points()
+    # Python 3.9 only supports looking up groups by key
+    group = eps.select(group=ENTRY_POINT_GROUP) if hasattr(eps, 'select') else eps.get(ENTRY_POINT_GROUP, [])
+    return tuple(ep.load() for ep in group)
+
+def find_store(ref: str) -> Optional[type[Store]]:
+    """
+    Imports the store for the given ref. Since looking up entry points scans
+    the installed packages, registered stores are only considered if none of
+    the built-in stores matches.
+    """
+    for spec in BUILTIN_STORES:
+        if spec.matches(ref):
+            return spec.load()
+    for spec in registered_stores():
+        if spec.matches(ref):
+            return spec.load()
+    return None
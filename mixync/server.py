@@ -0,0 +1,173 @@
+from __future__ import annotations
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import PurePosixPath
+from threading import Lock
+from typing import Any, cast
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import json
+
+from mixync.protocol import API_PREFIX, CALLABLE_METHODS, LISTABLE_METHODS, decode_args
+from mixync.store import Store
+from mixync.utils.cli import info
+from mixync.utils.codec import encode
+from mixync.utils.http import ChunkedReader, ChunkedWriter
+from mixync.utils.io import copy_stream
+
+class StoreServer(ThreadingHTTPServer):
+    """An HTTP server exposing a store to RemoteStores, see mixync.protocol."""
+
+    def __init__(self, address: tuple[str, int], store: Store, verbose: bool=False):
+        super().__init__(address, StoreRequestHandler)
+        self.store = store
+        self.verbose = verbose
+        # Metadata calls are applied one (batch) at a time, file transfers run in parallel
+        self.call_lock = Lock()
+
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+class StoreRequestHandler(BaseHTTPRequestHandler):
+    # Keep connections alive between requests
+    protocol_version = 'HTTP/1.1'
+    # Headers and bodies are written separately, which would otherwise wait for delayed ACKs on every call
+    disable_nagle_algorithm = True
+
+    @property
+    def store_server(self) -> StoreServer:
+        return cast(StoreServer, self.server)
+
+    def do_GET(self):
+        self._handle(self._get)
+
+    def do_POST(self):
+        self._handle(self._post)
+
+    def do_PUT(self):
+        self._handle(self._put)
+
+    def log_request(self, code: Any='-', size: Any='-'):
+        # Errors are always logged, requests only when verbose
+        if self.store_server.verbose:
+            super().log_request(code, size)
+
+    def _handle(self, handler):
+        self._started_response = False
+        try:
+            parts = urlsplit(self.path)
+            if not parts.path.startswith(API_PREFIX + '/'):
+                raise HTTPError(404, f"Unknown path '{parts.path}'")
+            handler(parts.path[len(API_PREFIX):], parse_qs(parts.query))
+        except Exception as e:
+            if isinstance(e, HTTPError):
+                status = e.status
+            elif isinstance(e, FileNotFoundError):
+                status = 404
+            else:
+                status = 500
+                self.log_error('%s failed: %r', self.requestline, e)
+            # Closing the connection discards any unread request body and lets the
+            # client notice incomplete responses
+            self.close_connection = True
+            if not self._started_response:
+                try:
+                    self._send_json({'error': str(e)}, status=status, close=True)
+                except OSError:
+                    # The client is gone already
+                    pass
+
+    def _get(self, path: str, query: dict[str, list[str]]):
+        store = self.store_server.store
+        if path == '/info':
+            self._send_json({
+                'identity': store.identity(),
+                'links_track_files': store.links_track_files(),
+                'caches_track_file_digests': store.caches_track_file_digests(),
+                'matches_track_digests': store.matches_track_digests(),
+            })
+        elif path.startswith('/list/'):
+            method = path[len('/list/'):]
+            if method not in LISTABLE_METHODS:
+                raise HTTPError(404, f"Cannot list '{method}'")
+            filters = {k: v[0] for k, v in query.items()}
+            values = getattr(store, method)(**filters)
+            self._send_chunked_headers('application/jsonl')
+            writer = ChunkedWriter(self.wfile.write)
+            for value in values:
+                writer.write(json.dumps(encode(value)).encode('utf8') + b'\n')
+            writer.close()
+        elif path.startswith('/files/'):
+            location = self._location(path)
+            with store.read_track(location) as src:
+                self._send_chunked_headers('application/octet-stream')
+                writer = ChunkedWriter(self.wfile.write)
+                copy_stream(src, writer)
+                writer.close()
+        else:
+            raise HTTPError(404, f"Unknown path '{path}'")
+
+    def _post(self, path: str, query: dict[str, list[str]]):
+        if not path.startswith('/call/'):
+            raise HTTPError(404, f"Unknown path '{path}'")
+        method = path[len('/call/'):]
+        if method not in CALLABLE_METHODS:
+            raise HTTPError(404, f"Cannot call '{method}'")
+        length = int(self.headers.get('Content-Length', 0))
+        args = decode_args(method, json.loads(self.rfile.read(length)))
+        with self.store_server.call_lock:
+            result = getattr(self.store_server.store, method)(*args)
+        self._send_json({'result': encode(result)})
+
+    def _put(self, path: str, query: dict[str, list[str]]):
+        if not path.startswith('/files/'):
+            raise HTTPError(404, f"Unknown path '{path}'")
+        if self.headers.get('Transfer-Encoding', '').lower() != 'chunked':
+            raise HTTPError(411, 'Track files must be uploaded with chunked transfer coding')
+        location = self._location(path)
+        mtime = float(query['mtime'][0]) if 'mtime' in query else None
+        with self.store_server.store.write_track(location, mtime=mtime) as dst:
+            copy_stream(ChunkedReader(self.rfile), dst)
+        self._send_json({})
+
+    def _location(self, path: str) -> str:
+        location = unquote(path[len('/files/'):])
+        parts = PurePosixPath(location).parts
+        # Track locations are relative to the musiclib and must not escape it
+        if not parts or location.startswith('/') or '..' in parts:
+            raise HTTPError(400, f"Invalid track location '{location}'")
+        return location
+
+    def _send_json(self, value: Any, status: int=200, close: bool=False):
+        body = json.dumps(value).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if close:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_chunked_headers(self, content_type: str):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        self._started_response = True
+
+def serve(store: Store, host: str, port: int, verbose: bool=False):
+    """Serves the given store until interrupted, closing it afterwards."""
+    server = StoreServer((host, port), store, verbose=verbose)
+    try:
+        info(f'Serving a {type(store).__name__} at {server.url()}')
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        store.close()
@@ -1,23 +1,48 @@
 from __future__ import annotations
-from copy import deepcopy
+from concurrent.futures import FIRST_COMPLETED, CancelledError, Future, ThreadPoolExecutor, wait
 from dataclasses import dataclass, field, replace
 from pathlib import Path
+from queue import Queue
 from shutil import get_terminal_size
-from typing import Callable, Optional, Iterable, TypeVar
+from threading import Event
+from time import perf_counter
+from typing import TYPE_CHECKING, BinaryIO, Callable, ContextManager, Iterator, Optional, Iterable, TypeVar
 
 from mixync.model.crate import Crate, CrateHeader
 from mixync.model.directory import Directory
 from mixync.model.playlist import Playlist, PlaylistHeader
 from mixync.model.track import Track, TrackHeader
+from mixync.model.track_file import TrackFileInfo
+from mixync.journal import Journal
+from mixync.metrics import Metrics
 from mixync.options import Options, ResourceType
 from mixync.utils.cli import info
+from mixync.utils.hash import audio_digest_stream, digest_stream
+from mixync.utils.io import copy_stream
 from mixync.utils.progress import ProgressLine
 from mixync.utils.str import truncate
-from mixync.utils.list import with_compact, zip_or
+from mixync.utils.list import chunks, with_compact, zip_or
 from mixync.utils.typing import Identifiable
 
+if TYPE_CHECKING:
+    from sqlalchemy.engine import Engine
+
 T = TypeVar('T', bound='Identifiable')
 
+# The resources whose id mappings are persisted in the destination between
+# copies. Directories are cheap to match by location and some stores use
+# hashes as directory ids, so they are always matched.
+PERSISTED_RESOURCES = ('tracks', 'playlists', 'crates')
+
+# The number of committed track batches whose files may still be waiting for
+# their transfer, when copying metadata and files in a pipeline.
+PIPELINE_DEPTH = 4
+
+# The tolerance when comparing modification times. Some file systems
+# (notably FAT, which is common on flash drives) only store them with
+# a granularity of 2 seconds.
+MTIME_TOLERANCE_SECS = 2
+
 @dataclass
 class IdMapping:
     """Maps ids between stores for a specific resource (tracks/directories/...)."""
@@ -29,11 +54,14 @@ class IdMapping:
         return [None if v.id in self.mapping else v for v in values]
     
     def apply_or_match(self, values: list[T], matcher: Callable[[list[T]], Iterable[Optional[int]]]) -> list[T]:
-        """Maps the values with a mapped id directly and uses the matcher function for all others."""
+        """
+        Maps the values with a mapped id directly and uses the matcher function for all others.
+        Values are only copied if their id actually changes.
+        """
         known_ids = [self.get(d.id) if d.id else None for d in values]
         unmapped_values = self.filter_unmapped(values)
         mapped_ids = zip_or(known_ids, with_compact(matcher, unmapped_values))
-        mapped_values = [replace(d, id=id) for d, id in zip(values, mapped_ids)]
+        mapped_values = [d if d.id == id else replace(d, id=id) for d, id in zip(values, mapped_ids)]
         return mapped_values
     
     def get(self, id: int) -> Optional[int]:
@@ -45,6 +73,14 @@ class IdMapping:
             if v.id:
                 self.mapping[v.id] = id
 
+@dataclass
+class TrackTransfer:
+    """A track file to be copied from one store to another."""
+
+    name: str
+    location: str
+    dest_location: str
+
 @dataclass
 class IdMappings:
     """Id mappings for the different resource types that stores deal with."""
@@ -54,21 +90,47 @@ class IdMappings:
     playlists: IdMapping = field(default_factory=IdMapping)
     crates: IdMapping = field(default_factory=IdMapping)
 
+    def update(self, mappings: dict[str, dict[int, int]]):
+        """Adds the given mappings (by resource name)."""
+        for resource, mapping in mappings.items():
+            getattr(self, resource).mapping.update(mapping)
+
+    def changes(self, previous: dict[str, dict[int, int]], resources: Iterable[str]) -> dict[str, dict[int, int]]:
+        """The mappings of the given resources that are new or differ from the given previous ones."""
+        return {
+            resource: {k: v for k, v in getattr(self, resource).mapping.items() if previous.get(resource, {}).get(k) != v}
+            for resource in resources
+        }
+
 class Store:
     """A store interface for music and metadata, e.g. a local mixxxdb or a remote server."""
 
-    def copy_to(self, other: Store, opts: Options):
-        """Copies the contents of this store to the given other store."""
+    def copy_to(self, other: Store, opts: Options, metrics: Optional[Metrics]=None, only_ids: Optional[dict[str, set[int]]]=None) -> IdMappings:
+        """
+        Copies the contents of this store to the given other store, recording timings etc.
+        in the given metrics (if any). If given, only the tracks, playlists and crates with
+        the given ids (by resource name) are copied, the others are expected to be mapped
+        by previous copies already. Returns the id mappings from this to the other store.
+        """
 
         if opts.log:
             info(f'Copying from a {type(self).__name__} to a {type(other).__name__}')
         
-        # TODO: Deltas?
         # TODO: Add methods for matching tracks to existing tracks in the DB
         #       at the store level? Perhaps just more fine grained query methods?
 
-        # Create empty id mappings
+        # Reuse the id mappings persisted by previous copies from this store,
+        # so only new values need to be matched
         id_mappings = IdMappings()
+        persisted_mappings = other.load_id_mappings(self.identity())
+        id_mappings.update(persisted_mappings)
+
+        # Journal the progress in the destination, so the copy can be resumed if interrupted
+        journal = self._open_journal(other, opts)
+        if journal:
+            id_mappings.update(journal.id_mappings)
+            if journal.resumed and opts.log:
+                info(f'Resuming interrupted copy (completed: {", ".join(sorted(journal.completed_phases)) or "nothing"})')
 
         # Copy metadata and tracks
         # NOTE: It is important that directory metadata is copied first since
@@ -77,103 +139,350 @@ class Store:
         #       Also we want to make sure that tracks are copied before playlists
         #       and crates, since otherwise the ids wouldn't be mapped.
 
-        self.copy_directories_to(other, id_mappings, opts)
+        metrics = metrics or Metrics()
+        with metrics.watch_sql('source', self.engines()), metrics.watch_sql('dest', other.engines()):
+            if self._should_run('directories', journal):
+                with metrics.phase('directories'):
+                    self.copy_directories_to(other, id_mappings, opts, journal=journal)
+                self._complete('directories', journal)
+
+            if opts.pipeline and not opts.dry_run and opts.filters(ResourceType.TRACK) and self._should_run('track_files', journal):
+                self._copy_pipelined_to(other, id_mappings, opts, journal, metrics, only_ids)
+            else:
+                if opts.filters(ResourceType.TRACK):
+                    # Already committed tracks are skipped when resuming, but we need their file transfers
+                    with metrics.phase('tracks'):
+                        transfers = self.copy_tracks_to(other, id_mappings, opts, journal=journal, only_ids=self._only_ids(only_ids, 'tracks'), metrics=metrics)
+                    self._complete('tracks', journal)
+                    if self._should_run('track_files', journal):
+                        with metrics.phase('track_files'):
+                            self.copy_track_files_to(other, transfers, opts, journal=journal, metrics=metrics)
+                        self._complete('track_files', journal)
+                self._copy_memberships_to(other, id_mappings, opts, journal, metrics, only_ids)
+
+        if not opts.dry_run:
+            other.save_id_mappings(self.identity(), id_mappings.changes(persisted_mappings, PERSISTED_RESOURCES))
+
+        if journal:
+            journal.finish()
 
-        if opts.filters(ResourceType.TRACK):
-            tracks, dest_tracks = self.copy_tracks_to(other, id_mappings, opts)
-            self.copy_track_files_to(other, tracks, dest_tracks, id_mappings, opts)
+        return id_mappings
 
-        if opts.filters(ResourceType.PLAYLIST):
-            self.copy_playlists_to(other, id_mappings, opts)
+    def _copy_memberships_to(self, other: Store, id_mappings: IdMappings, opts: Options, journal: Optional[Journal], metrics: Metrics, only_ids: Optional[dict[str, set[int]]]):
+        """Copies the playlists and crates, which requires the track ids to be mapped already."""
+        if opts.filters(ResourceType.PLAYLIST) and self._should_run('playlists', journal):
+            with metrics.phase('playlists'):
+                self.copy_playlists_to(other, id_mappings, opts, journal=journal, only_ids=self._only_ids(only_ids, 'playlists'))
+            self._complete('playlists', journal)
 
-        if opts.filters(ResourceType.CRATE):
-            self.copy_crates_to(other, id_mappings, opts)
+        if opts.filters(ResourceType.CRATE) and self._should_run('crates', journal):
+            with metrics.phase('crates'):
+                self.copy_crates_to(other, id_mappings, opts, journal=journal, only_ids=self._only_ids(only_ids, 'crates'))
+            self._complete('crates', journal)
 
-    def copy_directories_to(self, other: Store, id_mappings: IdMappings, opts: Options):
+    def _copy_pipelined_to(self, other: Store, id_mappings: IdMappings, opts: Options, journal: Optional[Journal], metrics: Metrics, only_ids: Optional[dict[str, set[int]]]):
+        """
+        Copies the track metadata, playlists and crates in a background thread, while
+        the files of the already committed track batches are transferred, so that the
+        metadata and file I/O overlap. The metadata may only run PIPELINE_DEPTH batches
+        ahead of the file transfers.
+        """
+        batches: Queue[Optional[list[TrackTransfer]]] = Queue(maxsize=PIPELINE_DEPTH)
+        cancelled = Event()
+
+        def enqueue(transfers: list[TrackTransfer]):
+            if cancelled.is_set():
+                raise CancelledError('File transfers failed')
+            batches.put(transfers)
+
+        def copy_metadata():
+            try:
+                with metrics.phase('tracks'):
+                    self.copy_tracks_to(other, id_mappings, opts, journal=journal, only_ids=self._only_ids(only_ids, 'tracks'), on_batch=enqueue, metrics=metrics)
+                self._complete('tracks', journal)
+            finally:
+                batches.put(None)
+            self._copy_memberships_to(other, id_mappings, opts, journal, metrics, only_ids)
+
+        def committed_transfers() -> Iterator[TrackTransfer]:
+            while (batch := batches.get()) is not None:
+                yield from batch
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            metadata = executor.submit(copy_metadata)
+            try:
+                with metrics.phase('track_files'):
+                    self.copy_track_files_to(other, committed_transfers(), opts, journal=journal, metrics=metrics)
+            except BaseException:
+                # Unblock and stop the metadata thread
+                cancelled.set()
+                while not batches.empty():
+                    batches.get_nowait()
+                raise
+            # The files are only complete if all tracks have been committed
+            metadata.result()
+        self._complete('track_files', journal)
+
+    def _only_ids(self, only_ids: Optional[dict[str, set[int]]], resource: str) -> Optional[set[int]]:
+        return None if only_ids is None else only_ids.get(resource, set())
+
+    def _open_journal(self, other: Store, opts: Options) -> Optional[Journal]:
+        state_path = other.state_path()
+        if opts.dry_run or not state_path:
+            if opts.resume and opts.log:
+                info(f'Cannot resume, since a {type(other).__name__} does not keep a journal')
+            return None
+        return Journal.open(state_path, self.identity(), resume=opts.resume)
+
+    def _should_run(self, phase: str, journal: Optional[Journal]) -> bool:
+        return not journal or not journal.is_completed(phase)
+
+    def _complete(self, phase: str, journal: Optional[Journal]):
+        if journal:
+            journal.complete(phase)
+
+    def copy_directories_to(self, other: Store, id_mappings: IdMappings, opts: Options, journal: Optional[Journal]=None):
         """Copies directory metadata to the given store."""
         directories = list(self.directories())
         # Relativize paths here, absolute them in the other store
         rel_directories = [self.relativize_directory(d, opts) for d in directories]
         dest_directories = [other.absolutize_directory(d, opts) if d else None for d in rel_directories]
-        updated_directories = [d for d in dest_directories if d]
-        # Map the ids (by first looking up already known mappings, then matching)
-        mapped_directories = id_mappings.directories.apply_or_match(updated_directories, other.match_directories)
-        # Update the directories
-        if not opts.dry_run:
-            new_ids = other.update_directories(mapped_directories)
-            id_mappings.directories.update(directories, new_ids)
+        pairs = [(d, dest) for d, dest in zip(directories, dest_directories) if dest]
+        # Map the ids (by first looking up already known mappings, then matching) and update the directories
+        self._merge_into('directories', pairs, id_mappings.directories, other.match_directories, other.update_directories, opts, journal)
         if opts.log:
-            info(f'Copied {len(mapped_directories)} directory entries')
+            info(f'Copied {len(pairs)} directory entries')
 
-    def copy_tracks_to(self, other: Store, id_mappings: IdMappings, opts: Options) -> tuple[list[Track], list[Optional[Track]]]:
-        """Copies track metadata ot the given store."""
-        tracks = list(self.tracks())
-        # Relativize paths here, absolute them in the other store
-        rel_tracks = [self.relativize_track(t, opts) for t in tracks]
-        dest_tracks = [other.absolutize_track(t, opts) if t and (not opts.filter_dirs or self.track_directory_name(t) in opts.filter_dirs) else None for t in rel_tracks]
-        updated_tracks = [t for t in dest_tracks if t]
-        # Map the ids (by first looking up already known mappings, then matching)
-        mapped_tracks = id_mappings.tracks.apply_or_match(updated_tracks, lambda ts: other.match_tracks([t.header() for t in ts]))
-        # Update the tracks
-        if not opts.dry_run:
-            new_ids = other.update_tracks(mapped_tracks)
-            id_mappings.tracks.update(tracks, new_ids)
+    def copy_tracks_to(self, other: Store, id_mappings: IdMappings, opts: Options, journal: Optional[Journal]=None, only_ids: Optional[set[int]]=None, on_batch: Optional[Callable[[list[TrackTransfer]], None]]=None, metrics: Optional[Metrics]=None) -> list[TrackTransfer]:
+        """
+        Copies track metadata (of the tracks with the given ids, if any) to the
+        given store. Tracks are streamed through in batches of opts.batch_size,
+        so only the locations of the copied tracks are kept around (for copying
+        the files afterwards). If given, on_batch is called with the transfers
+        of every batch once it is committed. The files read for matching audio
+        digests are recorded in the given metrics (if any).
+        """
+        transfers = []
+        match_digests = opts.match_content and other.matches_track_digests()
+        for batch in chunks(self.track_pairs(other, opts, only_ids), opts.batch_size):
+            if match_digests:
+                batch = self.with_audio_digests(batch, id_mappings.tracks, opts, metrics=metrics)
+            # Map the ids (by first looking up already known mappings, then matching) and update the tracks
+            self._merge_into('tracks', batch, id_mappings.tracks, lambda ts: self.match_tracks_to(other, ts, id_mappings.tracks), other.update_tracks, opts, journal, prepare=self._with_track_blobs)
+            batch_transfers = [TrackTransfer(name=t.name, location=t.location, dest_location=d.location) for t, d in batch]
+            if on_batch:
+                on_batch(batch_transfers)
+            transfers += batch_transfers
         if opts.log:
-            info(f'Copied {len(mapped_tracks)} track entries')
-        return tracks, dest_tracks
-
-    def copy_track_files_to(self, other: Store, tracks: list[Track], dest_tracks: list[Optional[Track]], id_mappings: IdMappings, opts: Options):
-        """Copies actual track files to the given store."""
-        zipped_tracks = [] if opts.dry_run else [(t, d) for t, d in zip(tracks, dest_tracks) if d]
+            info(f'Copied {len(transfers)} track entries')
+        return transfers
+
+    def track_pairs(self, other: Store, opts: Options, only_ids: Optional[set[int]]=None) -> Iterator[tuple[Track, Track]]:
+        """Lazily pairs the tracks of this store with their counterparts for the given store."""
+        for track in self.tracks():
+            if only_ids is not None and track.id not in only_ids:
+                continue
+            # Relativize paths here, absolute them in the other store
+            rel_track = self.relativize_track(track, opts)
+            if not rel_track or (opts.filter_dirs and self.track_directory_name(rel_track) not in opts.filter_dirs):
+                continue
+            dest_track = other.absolutize_track(rel_track, opts)
+            if dest_track:
+                yield track, dest_track
+
+    def with_audio_digests(self, pairs: list[tuple[Track, Track]], id_mapping: IdMapping, opts: Options, metrics: Optional[Metrics]=None) -> list[tuple[Track, Track]]:
+        """Adds the audio digests to the not yet mapped destination tracks, computing up to opts.jobs in parallel."""
+        missing = [i for i, (source, dest) in enumerate(pairs) if not dest.digest and (source.id is None or id_mapping.get(source.id) is None)]
+        with ThreadPoolExecutor(max_workers=opts.jobs) as executor:
+            digests = list(executor.map(lambda location: self._try_track_audio_digest(location, metrics), [pairs[i][0].location for i in missing]))
+        pairs = list(pairs)
+        for i, digest in zip(missing, digests):
+            source, dest = pairs[i]
+            pairs[i] = (source, replace(dest, digest=digest))
+        return pairs
+
+    def match_tracks_to(self, other: Store, tracks: list[Track], id_mapping: IdMapping) -> list[Optional[int]]:
+        """
+        Matches the given (not yet mapped) tracks of this store in the given store. Tracks
+        with an audio digest are not matched to a track that another track of this store
+        is mapped to already, since identical audio may belong to different tracks (e.g.
+        on an album and a compilation), which would otherwise be merged into one.
+        """
+        ids = list(other.match_tracks([t.header() for t in tracks]))
+        if any(t.digest for t in tracks):
+            taken_ids = set(id_mapping.mapping.values())
+            for i, (track, id) in enumerate(zip(tracks, ids)):
+                if track.digest and id is not None:
+                    if id in taken_ids:
+                        ids[i] = None
+                    else:
+                        taken_ids.add(id)
+        return ids
+
+    def _try_track_audio_digest(self, location: str, metrics: Optional[Metrics]=None) -> Optional[str]:
+        try:
+            digest = self.track_audio_digest(location)
+        except OSError:
+            # The file is missing or unreadable, which the file copy will report
+            return None
+        if metrics:
+            # Audio digests are never stored, so computing one reads the file
+            file_info = self.track_file_info(location)
+            if file_info:
+                metrics.record_digest(file_info.size)
+        return digest
+
+    def _merge_into(self, resource: str, pairs: list[tuple[T, T]], id_mapping: IdMapping, matcher: Callable[[list[T]], Iterable[Optional[int]]], updater: Callable[[list[T]], list[int]], opts: Options, journal: Optional[Journal], prepare: Optional[Callable[[list[tuple[T, T]]], list[tuple[T, T]]]]=None):
+        """
+        Maps the ids of the destination values in the given (source, destination) pairs
+        and merges them into the other store in batches of opts.batch_size, each
+        committed separately. Records the new ids for the source values (and in
+        the journal, if any). Values already committed according to the journal
+        are skipped. The prepare function, if any, is applied to every batch
+        that is actually written.
+        """
+        if journal:
+            pairs = [(source, dest) for source, dest in pairs if not journal.is_committed(resource, source.id)]
+        for batch in chunks(pairs, opts.batch_size):
+            mapped_values = id_mapping.apply_or_match([dest for _, dest in batch], matcher)
+            if not opts.dry_run:
+                if prepare:
+                    batch = prepare(list(zip([source for source, _ in batch], mapped_values)))
+                    mapped_values = [dest for _, dest in batch]
+                new_ids = updater(mapped_values)
+                id_mapping.update([source for source, _ in batch], new_ids)
+                if journal:
+                    journal.commit(resource, [(source.id, id) for (source, _), id in zip(batch, new_ids) if source.id])
+
+    def _with_track_blobs(self, pairs: list[tuple[Track, Track]]) -> list[tuple[Track, Track]]:
+        """Loads the beats/keys of the given source tracks into their destination counterparts."""
+        loaded_tracks = self.load_track_blobs([source for source, _ in pairs])
+        return [(source, replace(dest, beats=loaded.beats, keys=loaded.keys)) for (source, dest), loaded in zip(pairs, loaded_tracks)]
+
+    def copy_track_files_to(self, other: Store, transfers: Iterable[TrackTransfer], opts: Options, journal: Optional[Journal]=None, metrics: Optional[Metrics]=None):
+        """
+        Copies actual track files to the given store, using up to opts.jobs parallel
+        transfers. The transfers may also be produced lazily, e.g. while the track
+        metadata is still being copied, in which case the progress total grows as
+        they arrive.
+        """
+        transfers = [] if opts.dry_run else transfers
+        if isinstance(transfers, Iterator):
+            # Filter lazily, since the transfers may still be arriving
+            if journal:
+                transfers = (t for t in transfers if not journal.is_copied(t.dest_location))
+            total = None
+        else:
+            transfers = [t for t in transfers if not journal or not journal.is_copied(t.dest_location)]
+            total = len(transfers)
+        submitted_count = 0
         copied_count = 0
-        with ProgressLine(len(zipped_tracks), final_newline=opts.log) as progress:
-            for track, dest_track in zipped_tracks:
-                try:
-                    location = track.location
-                    dest_location = dest_track.location
-                    raw = self.download_track(location)
-                    other.upload_track(dest_location, raw)
-                    copied_count += 1
-                    if opts.log:
-                        prefix = "Copied '"
-                        suffix = f"' ({len(raw) / 1_000_000} MB)"
-                        terminal_width = get_terminal_size((80, 20)).columns
-                        available_width = max(5, terminal_width - len(progress.prefix()) - len(prefix) - len(suffix) - 3)
-                        progress.update(prefix + truncate(Path(location).name, available_width) + suffix)
-                except Exception as e:
-                    if opts.log:
-                        progress.print(f'Could not copy {track.name}: {e}')
-                        progress.update(f'Skipping track...')
+        unchanged_count = 0
+        with ProgressLine(total or 0, final_newline=opts.log) as progress, ThreadPoolExecutor(max_workers=opts.jobs) as executor:
+            # Bound the number of submitted transfers to avoid queueing up the entire library
+            max_in_flight = 2 * opts.jobs
+            in_flight: dict[Future[Optional[int]], TrackTransfer] = {}
+
+            def handle(done: Iterable[Future[Optional[int]]]):
+                nonlocal copied_count, unchanged_count
+                for future in done:
+                    transfer = in_flight.pop(future)
+                    try:
+                        size = future.result()
+                        if journal:
+                            journal.copied(transfer.dest_location)
+                        if size is None:
+                            unchanged_count += 1
+                            if opts.log:
+                                progress.update(self._progress_message(progress, "Unchanged '", Path(transfer.location).name, "'"))
+                        else:
+                            copied_count += 1
+                            if opts.log:
+                                progress.update(self._progress_message(progress, "Copied '", Path(transfer.location).name, f"' ({size / 1_000_000} MB)"))
+                    except Exception as e:
+                        if opts.log:
+                            progress.print(f'Could not copy {transfer.name}: {e}')
+                            progress.update(f'Skipping track...')
+
+            for transfer in transfers:
+                if len(in_flight) >= max_in_flight:
+                    done, _ = wait(in_flight.keys(), return_when=FIRST_COMPLETED)
+                    handle(done)
+                if total is None:
+                    progress.extend(1)
+                in_flight[executor.submit(self._copy_track_file, other, transfer.location, transfer.dest_location, opts, metrics)] = transfer
+                submitted_count += 1
+            handle(list(in_flight.keys()))
         if opts.log:
-            info(f'Copied {copied_count} track files ({len(zipped_tracks) - copied_count} skipped)')
-
-    def copy_playlists_to(self, other: Store, id_mappings: IdMappings, opts: Options):
-        """Copies playlists to the given store."""
-        playlists = list(self.playlists())
-        # Map playlist ids and their track ids
-        mapped_playlists = []
-        for playlist in id_mappings.playlists.apply_or_match(playlists, lambda ps: other.match_playlists([p.header() for p in ps])):
-            mapped_ids = set()
+            failed_count = submitted_count - copied_count - unchanged_count
+            info(f'Copied {copied_count} track files ({unchanged_count} unchanged, {failed_count} skipped)')
+
+    def _copy_track_file(self, other: Store, location: str, dest_location: str, opts: Options, metrics: Optional[Metrics]=None) -> Optional[int]:
+        """Copies a single track file to the given store, returns the number of bytes copied or None if unchanged."""
+        start = perf_counter()
+        file_info = self.track_file_info(location)
+        mtime = file_info.mtime if file_info else None
+        if opts.delta and self.track_file_unchanged(other, location, dest_location, file_info, opts, metrics=metrics):
+            return None
+        if other.links_track_files() and (other.is_remote() or self.caches_track_file_digests()):
+            # Avoid transferring content that the other store already has. Otherwise the
+            # other store dedupes the content while writing, which spares reading the file twice.
+            digest = self._track_file_digest(location, file_info, metrics)
+            if digest and other.link_track(dest_location, digest, mtime=mtime):
+                return None
+        with self.read_track(location) as src, other.write_track(dest_location, mtime=mtime) as dst:
+            size = copy_stream(src, dst)
+        if metrics:
+            metrics.record_file(location, size, perf_counter() - start)
+        return size
+
+    def track_file_unchanged(self, other: Store, location: str, dest_location: str, file_info: Optional[TrackFileInfo], opts: Options, metrics: Optional[Metrics]=None) -> bool:
+        """Checks whether the destination already has an identical copy of the given track file."""
+        dest_info = other.track_file_info(dest_location)
+        if not file_info or not dest_info or file_info.size != dest_info.size:
+            return False
+        if opts.checksum:
+            source_digest = self._track_file_digest(location, file_info, metrics)
+            return source_digest is not None and source_digest == other._track_file_digest(dest_location, dest_info, metrics)
+        return file_info.mtime is not None and dest_info.mtime is not None and abs(file_info.mtime - dest_info.mtime) <= MTIME_TOLERANCE_SECS
+
+    def _track_file_digest(self, location: str, file_info: Optional[TrackFileInfo], metrics: Optional[Metrics]) -> Optional[str]:
+        """Fetches the digest of a track file, recording the bytes read for it (if not stored) in the given metrics."""
+        digest = self.track_file_digest(location)
+        if metrics and file_info and not self.caches_track_file_digests():
+            metrics.record_digest(file_info.size)
+        return digest
+
+    def _progress_message(self, progress: ProgressLine, prefix: str, name: str, suffix: str) -> str:
+        terminal_width = get_terminal_size((80, 20)).columns
+        available_width = max(5, terminal_width - len(progress.prefix()) - len(prefix) - len(suffix) - 3)
+        return prefix + truncate(name, available_width) + suffix
+
+    def copy_playlists_to(self, other: Store, id_mappings: IdMappings, opts: Options, journal: Optional[Journal]=None, only_ids: Optional[set[int]]=None):
+        """Copies playlists (with the given ids, if any) to the given store."""
+        playlists = [p for p in self.playlists() if only_ids is None or p.id in only_ids]
+        # Map the track ids of the playlists
+        pairs = []
+        for playlist in playlists:
+            mapped_ids = []
             for track_id in playlist.track_ids:
                 mapped_id = id_mappings.tracks.get(track_id)
                 if mapped_id:
-                    mapped_ids.add(mapped_id)
+                    mapped_ids.append(mapped_id)
                 elif opts.log and opts.verbose:
                     print(f"Skipping track id {track_id} from playlist '{playlist.name}', since it could not be mapped.")
-            mapped_playlists.append(replace(playlist, track_ids=mapped_ids))
-        # Update the playlists
-        if not opts.dry_run:
-            new_ids = other.update_playlists(mapped_playlists)
-            id_mappings.playlists.update(playlists, new_ids)
+            pairs.append((playlist, replace(playlist, track_ids=mapped_ids)))
+        # Map the playlist ids and update the playlists
+        self._merge_into('playlists', pairs, id_mappings.playlists, lambda ps: other.match_playlists([p.header() for p in ps]), other.update_playlists, opts, journal)
         if opts.log:
-            info(f'Copied {len(mapped_playlists)} playlists')
+            info(f'Copied {len(pairs)} playlists')
     
-    def copy_crates_to(self, other: Store, id_mappings: IdMappings, opts: Options):
-        """Copies crates to the given store."""
-        crates = list(self.crates())
-        # Map crate ids and their track ids
-        mapped_crates = []
-        for crate in id_mappings.crates.apply_or_match(crates, lambda cs: other.match_crates([c.header() for c in cs])):
+    def copy_crates_to(self, other: Store, id_mappings: IdMappings, opts: Options, journal: Optional[Journal]=None, only_ids: Optional[set[int]]=None):
+        """Copies crates (with the given ids, if any) to the given store."""
+        crates = [c for c in self.crates() if only_ids is None or c.id in only_ids]
+        # Map the track ids of the crates
+        pairs = []
+        for crate in crates:
             mapped_ids = set()
             for track_id in crate.track_ids:
                 mapped_id = id_mappings.tracks.get(track_id)
@@ -181,17 +490,53 @@ class Store:
                     mapped_ids.add(mapped_id)
                 elif opts.log and opts.verbose:
                     print(f"Skipping track id {track_id} from crate '{crate.name}', since it could not be mapped.")
-            mapped_crates.append(replace(crate, track_ids=mapped_ids))
-        # Update the crates
-        if not opts.dry_run:
-            new_ids = other.update_crates(mapped_crates)
-            id_mappings.crates.update(crates, new_ids)
+            pairs.append((crate, replace(crate, track_ids=mapped_ids)))
+        # Map the crate ids and update the crates
+        self._merge_into('crates', pairs, id_mappings.crates, lambda cs: other.match_crates([c.header() for c in cs]), other.update_crates, opts, journal)
         if opts.log:
-            info(f'Copied {len(mapped_crates)} crates')
+            info(f'Copied {len(pairs)} crates')
 
     @classmethod
-    def parse_ref(cls, ref: str):
+    def parse_ref(cls, ref: str, opts: Options):
         raise NotImplementedError(f'parse is not implemented for {cls.__name__}!')
+
+    def close(self):
+        """Releases the store's resources and completes pending writes (if any)."""
+        pass
+
+    def identity(self) -> str:
+        """A string identifying this store, e.g. for recognizing it as the source of a resumed copy."""
+        return type(self).__name__
+
+    def state_path(self) -> Optional[Path]:
+        """A directory for mixync's own state (e.g. the journal) when copying to this store or None if unsupported."""
+        return None
+
+    def load_id_mappings(self, source: str) -> dict[str, dict[int, int]]:
+        """
+        Loads the id mappings (by resource name) persisted by previous copies from the
+        store with the given identity to this store, omitting ids that no longer exist.
+        """
+        return {}
+
+    def save_id_mappings(self, source: str, mappings: dict[str, dict[int, int]]):
+        """Merges the given id mappings (by resource name) into the persisted ones for the given source."""
+        pass
+
+    def load_sync_hashes(self, peer: str) -> dict[str, dict[int, str]]:
+        """
+        Loads the content hashes of this store's values (by resource name and id)
+        as of the last sync with the store with the given identity, see mixync.sync.
+        """
+        return {}
+
+    def save_sync_hashes(self, peer: str, hashes: dict[str, dict[int, str]]):
+        """Merges the given content hashes (by resource name and id) into the persisted ones for the given peer."""
+        pass
+
+    def engines(self) -> list[Engine]:
+        """The SQLAlchemy engines this store uses, e.g. for collecting metrics about the executed statements."""
+        return []
     
     # Match methods
 
@@ -214,8 +559,18 @@ class Store:
     # Query methods
 
     def tracks(self, name: Optional[str]=None, artist: Optional[str]=None) -> Iterable[Track]:
-        """Fetches the tracks (and cues) from this store."""
+        """
+        Fetches the tracks (and cues) from this store. Stores may omit the
+        (potentially large) beats/keys, see load_track_blobs.
+        """
         return []
+
+    def load_track_blobs(self, tracks: list[Track]) -> list[Track]:
+        """
+        Loads the beats/keys of the given tracks from this store, if they have
+        been omitted by 'tracks'. This is only called for tracks to be written.
+        """
+        return tracks
     
     def crates(self, name: Optional[str]=None) -> Iterable[Crate]:
         """Fetches the crates from this store."""
@@ -252,6 +607,9 @@ class Store:
         raise NotImplementedError(f'update_directories is not implemented for {type(self).__name__}!')
 
     # Relativization/absolutization methods
+    # NOTE: Implementations must not modify the values passed in, since the
+    #       caller still uses them, but return (shallow) copies instead, e.g.
+    #       via dataclasses.replace, which shares the cues and blobs.
     
     def relativize_track(self, track: Track, opts: Options) -> Optional[Track]:
         """
@@ -259,7 +617,7 @@ class Store:
         passed to the other store in methods like 'copy_to'. Returning
         None will filter out this track. This is the identity function by default.
         """
-        return deepcopy(track)
+        return track
     
     def absolutize_track(self, track: Track, opts: Options) -> Optional[Track]:
         """
@@ -267,7 +625,7 @@ class Store:
         passed to the this store in methods like 'copy_to'. Returning
         None will filter out this track. This is the identity function by default.
         """
-        return deepcopy(track)
+        return track
 
     def relativize_directory(self, directory: Directory, opts: Options) -> Optional[Directory]:
         """
@@ -275,7 +633,7 @@ class Store:
         passed to the other store in methods like 'copy_to'. Returning
         None will filter out this track. This is the identity function by default.
         """
-        return deepcopy(directory)
+        return directory
     
     def absolutize_directory(self, directory: Directory, opts: Options) -> Optional[Directory]:
         """
@@ -283,20 +641,92 @@ class Store:
         passed to the this store in methods like 'copy_to'. Returning
         None will filter out this track. This is the identity function by default.
         """
-        return deepcopy(directory)
+        return directory
 
     # Upload/download methods
 
-    def upload_track(self, location: str, raw: bytes):
+    def read_track(self, location: str) -> ContextManager[BinaryIO]:
+        """
+        Opens a track from a track location for streamed reading.
+        """
+        raise NotImplementedError(f'read_track is not implemented for {type(self).__name__}!')
+
+    def write_track(self, location: str, mtime: Optional[float]=None) -> ContextManager[BinaryIO]:
+        """
+        Opens a track at a track location for streamed writing. If given,
+        the modification time is preserved on the written file.
+        """
+        raise NotImplementedError(f'write_track is not implemented for {type(self).__name__}!')
+
+    def upload_track(self, location: str, raw: bytes, mtime: Optional[float]=None):
         """
         Uploads a track from a track location from an in-memory buffer.
+        If given, the modification time is preserved on the uploaded file.
         """
-        raise NotImplementedError(f'upload_track is not implemented for {type(self).__name__}!')
+        with self.write_track(location, mtime=mtime) as f:
+            f.write(raw)
 
     def download_track(self, location: str) -> bytes:
         """
         Downloads a track from a track location to an in-memory buffer.
+        Prefer 'read_track' for large files.
+        """
+        with self.read_track(location) as f:
+            return f.read()
+
+    def track_file_info(self, location: str) -> Optional[TrackFileInfo]:
+        """
+        Fetches the size and modification time of a track file or None,
+        if the file does not exist or the store cannot determine them.
+        """
+        return None
+
+    def links_track_files(self) -> bool:
+        """
+        Whether this store stores track files by content, i.e. whether
+        'link_track' is supported. If so, copying a track file first tries
+        to link existing content before transferring any bytes.
+        """
+        return False
+
+    def caches_track_file_digests(self) -> bool:
+        """
+        Whether track_file_digest looks up a stored digest instead of
+        reading the entire file.
+        """
+        return False
+
+    def is_remote(self) -> bool:
+        """Whether track files are transferred to this store over the network."""
+        return False
+
+    def link_track(self, location: str, digest: str, mtime: Optional[float]=None) -> bool:
+        """
+        Points a track location to already stored content with the given
+        digest. Returns whether the content was found (and thus linked).
+        """
+        return False
+
+    def track_file_digest(self, location: str) -> Optional[str]:
         """
-        raise NotImplementedError(f'download_track is not implemented for {type(self).__name__}!')
+        Computes a content digest of a track file. By default this
+        streams the entire file, stores may override this with a
+        more efficient implementation.
+        """
+        with self.read_track(location) as f:
+            return digest_stream(f)
     
+    def track_audio_digest(self, location: str) -> Optional[str]:
+        """
+        Computes a digest of the audio content of a track file, which (unlike
+        track_file_digest) ignores tags, so it can be used to recognize moved
+        or retagged tracks.
+        """
+        with self.read_track(location) as f:
+            return audio_digest_stream(f)
+
+    def matches_track_digests(self) -> bool:
+        """Whether this store stores the audio digests of tracks and uses them in match_tracks."""
+        return False
+
     # TODO: Add upload/download methods for analysis data
@@ -0,0 +1,224 @@
+from contextlib import contextmanager
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import RLock
+from typing import BinaryIO, Iterator, Optional, cast
+from zipfile import ZIP_STORED, ZipFile, ZipInfo
+
+import os
+import struct
+import time
+import warnings
+import zlib
+
+from mixync.model.track_file import TrackFileInfo
+from mixync.options import Options
+from mixync.store.portable import PortableStore
+from mixync.utils.fs import fsync_dir
+from mixync.utils.io import CHUNK_SIZE, copy_stream
+from mixync.utils.sqlite import SQLITE_PROFILES, SQLiteProfile
+
+DB_ENTRY_NAME = 'library.sqlite3'
+AUDIO_ENTRY_PREFIX = 'audio/'
+# The earliest modification time that ZIP archives can represent
+MIN_ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+class ArchiveStore(PortableStore):
+    """
+    A portable musiclib packed into a single, uncompressed ZIP archive with the
+    library database and the audio files as entries. The archive is only ever
+    appended to: Updated files are added as new entries superseding the old
+    ones, which are dropped once they make up more than half of the archive.
+
+    The metadata is edited in an extracted copy of the database, which is only
+    written back on close, after which the update is complete. Before the first
+    write, the archive's central directory is saved next to it, so interrupted
+    updates can be rolled back when the archive is opened the next time.
+    """
+
+    def __init__(self, path: Path, sqlite_profile: SQLiteProfile=SQLITE_PROFILES['fast']):
+        self.archive_path = path
+        self.recovery_path = path.with_name(path.name + '.recovery')
+        self.compacted_path = path.with_name(path.name + '.tmp')
+        self._lock = RLock()
+        self._appending = False
+        self._recover()
+
+        self._zip: Optional[ZipFile] = ZipFile(path, 'r') if path.exists() else None
+        self._work_dir = TemporaryDirectory(prefix='mixync-')
+        work_path = Path(self._work_dir.name) / 'library.musiclib'
+        work_path.mkdir()
+        if self._entry_info(DB_ENTRY_NAME):
+            assert self._zip
+            with self._zip.open(DB_ENTRY_NAME) as src, open(work_path / DB_ENTRY_NAME, 'wb') as dst:
+                copy_stream(src, dst)
+
+        super().__init__(work_path, sqlite_profile=sqlite_profile)
+
+    @classmethod
+    def parse_ref(cls, ref: str, opts: Options):
+        try:
+            path = Path(ref)
+        except:
+            return None
+        if path.name.endswith('.musiclib.zip'):
+            return ArchiveStore(path, sqlite_profile=opts.sqlite_profile or SQLITE_PROFILES['fast'])
+        return None
+
+    def state_path(self) -> Optional[Path]:
+        # Interrupted updates are rolled back entirely, so there is nothing to resume
+        return None
+
+    def close(self):
+        """Writes the library database back into the archive, completing the update."""
+        self.engine.dispose()
+        with self._lock:
+            db_path = self.path / DB_ENTRY_NAME
+            if self._db_changed(db_path):
+                self._begin_append()
+                with open(db_path, 'rb') as src, self._open_entry(DB_ENTRY_NAME, db_path.stat().st_mtime) as dst:
+                    copy_stream(src, dst)
+            if self._appending:
+                self._compact()
+                self._finish_append()
+            elif self._zip:
+                self._zip.close()
+            self._zip = None
+        self._work_dir.cleanup()
+
+    def _entry_name(self, location: str) -> str:
+        return AUDIO_ENTRY_PREFIX + location
+
+    def _entry_info(self, name: str) -> Optional[ZipInfo]:
+        if not self._zip:
+            return None
+        try:
+            # Returns the latest entry with the name
+            return self._zip.getinfo(name)
+        except KeyError:
+            return None
+
+    @contextmanager
+    def _open_entry(self, name: str, mtime: Optional[float]) -> Iterator[BinaryIO]:
+        assert self._zip
+        info = ZipInfo(name, date_time=max(time.localtime(mtime)[:6], MIN_ZIP_DATE_TIME) if mtime is not None else MIN_ZIP_DATE_TIME)
+        info.compress_type = ZIP_STORED
+        with warnings.catch_warnings():
+            # Entries with duplicate names supersede the earlier ones
+            warnings.simplefilter('ignore', UserWarning)
+            with self._zip.open(info, 'w', force_zip64=True) as f:
+                yield cast(BinaryIO, f)
+
+    def _db_changed(self, db_path: Path) -> bool:
+        info = self._entry_info(DB_ENTRY_NAME)
+        if not info:
+            return True
+        crc = 0
+        with open(db_path, 'rb') as f:
+            while chunk := f.read(CHUNK_SIZE):
+                crc = zlib.crc32(chunk, crc)
+        return crc != info.CRC
+
+    def _recover(self):
+        # A compacted archive that was not moved into place yet is incomplete or outdated
+        self.compacted_path.unlink(missing_ok=True)
+        if not self.recovery_path.exists():
+            return
+        # Restore the previous central directory, dropping everything appended since
+        with open(self.recovery_path, 'rb') as f:
+            offset, = struct.unpack('<Q', f.read(8))
+            central_directory = f.read()
+        if offset == 0 and not central_directory:
+            self.archive_path.unlink(missing_ok=True)
+        else:
+            with open(self.archive_path, 'r+b') as f:
+                f.truncate(offset)
+                f.seek(offset)
+                f.write(central_directory)
+                f.flush()
+                os.fsync(f.fileno())
+        self.recovery_path.unlink()
+        fsync_dir(self.recovery_path.parent)
+
+    def _begin_append(self):
+        if self._appending:
+            return
+        # New entries are written from the start of the central directory on
+        offset = self._zip.start_dir if self._zip else 0
+        with open(self.recovery_path, 'wb') as f:
+            f.write(struct.pack('<Q', offset))
+            if self._zip:
+                with open(self.archive_path, 'rb') as archive:
+                    archive.seek(offset)
+                    copy_stream(archive, f)
+            f.flush()
+            os.fsync(f.fileno())
+        fsync_dir(self.recovery_path.parent)
+        if self._zip:
+            self._zip.close()
+        self._zip = ZipFile(self.archive_path, 'a')
+        self._appending = True
+
+    def _finish_append(self):
+        assert self._zip
+        self._zip.close()
+        with open(self.archive_path, 'rb') as f:
+            os.fsync(f.fileno())
+        # Compacting may have completed the update already
+        if self.recovery_path.exists():
+            self.recovery_path.unlink()
+            fsync_dir(self.recovery_path.parent)
+        self._appending = False
+
+    def _compact(self):
+        assert self._zip
+        infos = self._zip.infolist()
+        live_infos = list({i.filename: i for i in infos}.values())
+        live_size = sum(i.compress_size for i in live_infos)
+        if sum(i.compress_size for i in infos) - live_size <= live_size:
+            return
+        # Rewrite the archive with only the latest entries
+        tmp_path = self.compacted_path
+        with ZipFile(tmp_path, 'w', ZIP_STORED) as out:
+            for info in live_infos:
+                with self._zip.open(info) as src, out.open(ZipInfo(info.filename, date_time=info.date_time), 'w', force_zip64=True) as dst:
+                    copy_stream(src, dst)
+        with open(tmp_path, 'rb') as f:
+            os.fsync(f.fileno())
+        # The recovery file refers to the archive before compaction, so the update has to be
+        # completed (closing the appended archive, then removing the recovery file) before replacing it
+        self._zip.close()
+        with open(self.archive_path, 'rb') as f:
+            os.fsync(f.fileno())
+        self.recovery_path.unlink()
+        fsync_dir(self.recovery_path.parent)
+        tmp_path.replace(self.archive_path)
+        fsync_dir(self.archive_path.parent)
+        self._zip = ZipFile(self.archive_path, 'a')
+
+    # Upload/download methods
+
+    @contextmanager
+    def read_track(self, location: str) -> Iterator[BinaryIO]:
+        with self._lock:
+            info = self._entry_info(self._entry_name(location))
+            if not info:
+                raise FileNotFoundError(f"No audio stored for '{location}'")
+            # Entries are stored uncompressed, so the stream is seekable
+            assert self._zip
+            with self._zip.open(info) as f:
+                yield cast(BinaryIO, f)
+
+    @contextmanager
+    def write_track(self, location: str, mtime: Optional[float]=None) -> Iterator[BinaryIO]:
+        with self._lock:
+            self._begin_append()
+            with self._open_entry(self._entry_name(location), mtime) as f:
+                yield f
+
+    def track_file_info(self, location: str) -> Optional[TrackFileInfo]:
+        with self._lock:
+            info = self._entry_info(self._entry_name(location))
+        if not info:
+            return None
+        return TrackFileInfo(size=info.file_size, mtime=time.mktime(info.date_time + (0, 0, -1)))
@@ -1,9 +1,14 @@
-from typing import TypeVar
+from contextlib import contextmanager
+from io import BytesIO
+from typing import BinaryIO, Iterator, Optional, TypeVar
+
+import os
 
 from mixync.model.crate import Crate
 from mixync.model.directory import Directory
 from mixync.model.playlist import Playlist
 from mixync.model.track import Track
+from mixync.options import Options
 from mixync.store import Store
 from mixync.utils.typing import Identifiable
 
@@ -16,7 +21,7 @@ class DebugStore(Store):
         self.compact = compact
 
     @classmethod
-    def parse_ref(cls, ref: str):
+    def parse_ref(cls, ref: str, opts: Options):
         if ref == '@debug':
             return DebugStore(compact=False)
         elif ref == '@debugcompact':
@@ -56,8 +61,11 @@ class DebugStore(Store):
 
     # Upload/download methods
 
-    def upload_track(self, location: str, raw: bytes):
-        pass
+    @contextmanager
+    def read_track(self, location: str) -> Iterator[BinaryIO]:
+        yield BytesIO()
 
-    def download_track(self, location: str) -> bytes:
-        return bytes()
+    @contextmanager
+    def write_track(self, location: str, mtime: Optional[float]=None) -> Iterator[BinaryIO]:
+        with open(os.devnull, 'wb') as f:
+            yield f
@@ -1,18 +1,22 @@
-from sqlalchemy import create_engine, delete
+from sqlalchemy import insert, or_
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker
+from contextlib import contextmanager
+from dataclasses import replace
 from hashlib import sha1
 from pathlib import Path
-from typing import Iterable, Optional, TypeVar
+from typing import Any, BinaryIO, Iterable, Iterator, Optional, TypeVar
 
+import json
 import sys
 
-from mixync.model.beats import Beats
+from mixync.matching import TrackIndex
 from mixync.model.crate import Crate, CrateHeader
 from mixync.model.cue import Cue
 from mixync.model.directory import Directory
-from mixync.model.keys import Keys
 from mixync.model.playlist import Playlist, PlaylistHeader
 from mixync.model.track import Track, TrackHeader
+from mixync.model.track_file import TrackFileInfo
 from mixync.store import Store
 from mixync.store.mixxx.model.crate import *
 from mixync.store.mixxx.model.crate_track import *
@@ -25,6 +29,12 @@ from mixync.store.mixxx.model.track import *
 from mixync.store.mixxx.model.track_location import *
 from mixync.options import Options
 from mixync.utils.cli import confirm
+from mixync.utils.fs import file_info, write_replacing
+from mixync.utils.list import chunks, group_by
+from mixync.utils.path import PathTrie
+from mixync.utils.diff import diff_list
+from mixync.utils.sql import MAX_PARAMS, create_sqlite_engine, delete_in, delete_rows, existing_ids, group_rows_in, insert_ignore, load_track_blobs, match_ids, update_rows, upsert
+from mixync.utils.sqlite import SQLITE_PROFILES, SQLiteProfile
 
 T = TypeVar('T')
 
@@ -55,47 +65,132 @@ MIN_SCHEMA_VERSION = 32
 class MixxxStore(Store):
     """A wrapper around the user's local mixxxdb."""
 
-    def __init__(self, path: Optional[Path]=None):
+    def __init__(self, path: Optional[Path]=None, sqlite_profile: SQLiteProfile=SQLITE_PROFILES['safe']):
         path = path or find_local_mixxxdb()
         if not path:
             raise RuntimeError('No mixxxdb found')
-        engine = create_engine(f'sqlite:///{path}')
-        self.make_session = sessionmaker(bind=engine, expire_on_commit=False)
+        self.path = path
+        self.engine = create_sqlite_engine(path, sqlite_profile)
+        self._make_session = sessionmaker(bind=self.engine, expire_on_commit=False)
+        self._schema_checked = False
+        self._location_ids: Optional[dict[str, int]] = None
+        self._track_index: Optional[TrackIndex] = None
+        self._directory_paths: Optional[list[Path]] = None
+        self._directory_path_trie: Optional[PathTrie] = None
+        self._resolved_directories: dict[tuple[str, Optional[Path]], Path] = {}
 
-        schema_version = self._schema_version() or 0
-        if schema_version < MIN_SCHEMA_VERSION:
-            raise RuntimeError(f'Mixxxdb has schema version {schema_version}, but the minimum version supported by mixync is {MIN_SCHEMA_VERSION}.')
+    @property
+    def make_session(self) -> sessionmaker:
+        # The schema is only checked once the database is actually used, so creating the store does not open it
+        if not self._schema_checked:
+            schema_version = self._schema_version() or 0
+            if schema_version < MIN_SCHEMA_VERSION:
+                raise RuntimeError(f'Mixxxdb has schema version {schema_version}, but the minimum version supported by mixync is {MIN_SCHEMA_VERSION}.')
+            self._schema_checked = True
+        return self._make_session
     
     @classmethod
-    def parse_ref(cls, ref: str):
+    def parse_ref(cls, ref: str, opts: Options):
+        profile = opts.sqlite_profile or SQLITE_PROFILES['safe']
         if ref == '@local':
-            return MixxxStore()
+            return MixxxStore(sqlite_profile=profile)
         try:
             path = Path(ref)
         except:
             return None
         if path.name == 'mixxxdb.sqlite':
-            return MixxxStore(path)
+            return MixxxStore(path, sqlite_profile=profile)
         return None
     
-    def _schema_version(self) -> Optional[int]:
+    def identity(self) -> str:
+        return f'mixxx:{self.path.resolve()}'
+
+    def state_path(self) -> Path:
+        return self.path.parent / 'mixync'
+
+    def engines(self) -> list[Engine]:
+        return [self.engine]
+
+    def _state_file_path(self, kind: str, store: str) -> Path:
+        # Mixxx's schema is not ours to extend, so our state is kept in sidecar files
+        return self.state_path() / kind / f"{sha1(store.encode('utf8')).hexdigest()}.json"
+
+    def _read_state_file(self, kind: str, store: str, field: str) -> dict[str, dict[int, Any]]:
+        path = self._state_file_path(kind, store)
+        if not path.exists():
+            return {}
+        with open(path, 'r', encoding='utf8') as f:
+            data = json.load(f)
+        return {resource: {int(k): v for k, v in values.items()} for resource, values in data[field].items()}
+
+    def _merge_state_file(self, kind: str, store: str, store_field: str, field: str, values: dict[str, dict[int, Any]]):
+        if not any(values.values()):
+            return
+        merged = self._read_state_file(kind, store, field)
+        for resource, resource_values in values.items():
+            merged.setdefault(resource, {}).update(resource_values)
+        path = self._state_file_path(kind, store)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf8') as f:
+            json.dump({store_field: store, field: merged}, f)
+        tmp_path.replace(path)
+
+    def _read_id_mappings(self, source: str) -> dict[str, dict[int, int]]:
+        return self._read_state_file('id-mappings', source, 'mappings')
+
+    def load_id_mappings(self, source: str) -> dict[str, dict[int, int]]:
+        id_columns = {
+            'tracks': MixxxTrack.id,
+            'playlists': MixxxPlaylist.id,
+            'crates': MixxxCrate.id,
+        }
+        mappings = {}
         with self.make_session() as session:
+            for resource, mapping in self._read_id_mappings(source).items():
+                if resource in id_columns:
+                    existing = existing_ids(session, id_columns[resource], mapping.values())
+                    mappings[resource] = {k: v for k, v in mapping.items() if v in existing}
+        return mappings
+
+    def save_id_mappings(self, source: str, mappings: dict[str, dict[int, int]]):
+        self._merge_state_file('id-mappings', source, 'source', 'mappings', mappings)
+
+    def load_sync_hashes(self, peer: str) -> dict[str, dict[int, str]]:
+        return self._read_state_file('sync-hashes', peer, 'hashes')
+
+    def save_sync_hashes(self, peer: str, hashes: dict[str, dict[int, str]]):
+        self._merge_state_file('sync-hashes', peer, 'peer', 'hashes', hashes)
+
+    def _schema_version(self) -> Optional[int]:
+        with self._make_session() as session:
             row = session.query(MixxxSetting).where(MixxxSetting.name == 'mixxx.schema.version').first()
             if not row:
                 return None
             return int(row.value)
 
     def _directories(self) -> list[Path]:
-        with self.make_session() as session:
-            return [Path(dir.directory) for dir in session.query(MixxxDirectory)]
+        # Cache the directories for the lifetime of the store, update_directories keeps them up-to-date
+        if self._directory_paths is None:
+            with self.make_session() as session:
+                self._directory_paths = [Path(dir.directory) for dir in session.query(MixxxDirectory)]
+        return self._directory_paths
 
-    def _find_base_directory(self, path: Path, opts: Options) -> Optional[Path]:
-        directories = self._directories()
+    def _directory_trie(self) -> PathTrie:
+        if self._directory_path_trie is None:
+            self._directory_path_trie = PathTrie(self._directories())
+        return self._directory_path_trie
+
+    def _invalidate_directories(self):
+        self._directory_paths = None
+        self._directory_path_trie = None
+        self._resolved_directories.clear()
 
+    def _find_base_directory(self, path: Path, opts: Options) -> Optional[Path]:
         # Try to find the base directory among the stored directories
-        for directory in directories:
-            if path.is_relative_to(directory):
-                return directory
+        directory = self._directory_trie().longest_prefix(path)
+        if directory:
+            return directory
 
         # If not skip_uncategorized, use the parent directory
         return None if opts.skip_uncategorized else path.parent
@@ -105,8 +200,7 @@ class MixxxStore(Store):
         new_directory = super().relativize_directory(directory, opts)
         if not new_directory:
             return None
-        new_directory.location = Path(directory.location).name
-        return new_directory
+        return replace(new_directory, location=Path(directory.location).name)
 
     def relativize_track(self, track: Track, opts: Options) -> Optional[Track]:
         # Relativize w.r.t a base directory from the db and POSIX-ify paths
@@ -118,8 +212,7 @@ class MixxxStore(Store):
         if not base_directory:
             return None
         rel_location = location.relative_to(base_directory.parent)
-        new_track.location = rel_location.as_posix()
-        return new_track
+        return replace(new_track, location=rel_location.as_posix())
     
     def _find_matching_directory(self, name: str, opts: Options) -> Path:
         directories = self._directories()
@@ -137,6 +230,15 @@ class MixxxStore(Store):
         root_directory = Path.home() / 'Music'
         return root_directory / name
 
+    def _resolve_matching_directory(self, name: str, opts: Options) -> Path:
+        # Memoize the (resolved) matching directory since it is needed for every track
+        key = (name, opts.dest_root_dir)
+        resolved = self._resolved_directories.get(key)
+        if not resolved:
+            resolved = self._find_matching_directory(name, opts).resolve()
+            self._resolved_directories[key] = resolved
+        return resolved
+
     def absolutize_directory(self, directory: Directory, opts: Options) -> Optional[Directory]:
         new_directory = super().absolutize_directory(directory, opts)
         if not new_directory:
@@ -144,14 +246,13 @@ class MixxxStore(Store):
         location = Path(directory.location)
         if not location.parts:
             raise ValueError('Cannot absolutize a directory with an empty location path.')
-        matching_location = self._find_matching_directory(location.parts[0], opts).resolve()
+        matching_location = self._resolve_matching_directory(location.parts[0], opts)
         if not confirm(f"Map '{directory.location}' to '{matching_location}'?", opts):
             print('Okay, quitting')
             sys.exit(0)
         if opts.log and opts.assume_yes:
             print(f"Mapping '{directory.location}' to '{matching_location}'")
-        new_directory.location = str(matching_location)
-        return new_directory
+        return replace(new_directory, location=str(matching_location))
     
     def absolutize_track(self, track: Track, opts: Options) -> Optional[Track]:
         new_track = super().absolutize_track(track, opts)
@@ -160,12 +261,11 @@ class MixxxStore(Store):
         location = Path(track.location)
         if not location.parts:
             raise ValueError('Cannot absolutize a track with an empty location path.')
-        matching_directory = self._find_matching_directory(location.parts[0], opts).resolve()
+        matching_directory = self._resolve_matching_directory(location.parts[0], opts)
         matching_location = matching_directory.parent / location
         if opts.log and opts.verbose:
             print(f"Mapping '{track.location}' to '{matching_location}'")
-        new_track.location = str(matching_location)
-        return new_track
+        return replace(new_track, location=str(matching_location))
     
     def _directory_id(self, location: str) -> int:
         return int(sha1(location.encode('utf8')).hexdigest(), 16)
@@ -187,73 +287,94 @@ class MixxxStore(Store):
     def tracks(self, name: Optional[str]=None, artist: Optional[str]=None) -> Iterable[Track]:
         with self.make_session() as session:
             constraints = [c for c in [
-                MixxxTrack.name == name if name else None,
+                MixxxTrack.title == name if name else None,
                 MixxxTrack.artist == artist if artist else None,
-            ] if c]
-            for track in session.query(MixxxTrack).where(*constraints):
-                def sample_to_ms(s: int) -> int:
-                    return int(s * 1000 / (track.channels * track.samplerate))
-
-                location = session.query(MixxxTrackLocation).where(MixxxTrackLocation.id == track.location).first()
-                if location and not location.fs_deleted:
-                    yield Track(
-                        id=track.id,
-                        name=track.title or '',
-                        artist=track.artist or '',
-                        location=location.location or '',
-                        album=track.album or '',
-                        year=track.year or '',
-                        genre=track.genre or '',
-                        comment=track.comment or '',
-                        duration_ms=int(track.duration * 1000),
-                        track_number=track.tracknumber,
-                        url=track.url,
-                        sample_rate=track.samplerate,
-                        cues=[Cue(
-                            type=c.type,
-                            position_ms=sample_to_ms(c.position),
-                            length_ms=sample_to_ms(c.length),
-                            hotcue=c.hotcue if c.hotcue >= 0 else None,
-                            label=c.label if c.label else None,
-                            color=c.color
-                        ) for c in session.query(MixxxCue).where(MixxxCue.track_id == track.id)],
-                        bpm=track.bpm,
-                        beats=Beats(
-                            data=track.beats,
-                            version=track.beats_version,
-                            sub_version=track.beats_sub_version
-                        ),
-                        channels=track.channels,
-                        times_played=track.timesplayed,
-                        rating=track.rating,
-                        key=track.key,
-                        keys=Keys(
-                            data=track.keys,
-                            version=track.keys_version,
-                            sub_version=track.keys_sub_version
-                        ),
-                        color=track.color
-                    )
+                or_(MixxxTrackLocation.fs_deleted == None, MixxxTrackLocation.fs_deleted == 0),
+            ] if c is not None]
+            rows = session.query(MixxxTrack, MixxxTrackLocation) \
+                .join(MixxxTrackLocation, MixxxTrackLocation.id == MixxxTrack.location) \
+                .where(*constraints) \
+                .yield_per(MAX_PARAMS)
+            for batch in chunks(rows, MAX_PARAMS):
+                # Fetch the cues of each batch of tracks in a single query
+                cues = group_by(
+                    session.query(MixxxCue).where(MixxxCue.track_id.in_([track.id for track, _ in batch])),
+                    lambda c: c.track_id
+                )
+                yield from (self._to_track(track, location, cues.get(track.id, [])) for track, location in batch)
+
+    def _to_track(self, track: MixxxTrack, location: MixxxTrackLocation, cues: list[MixxxCue]) -> Track:
+        def sample_to_ms(s: int) -> int:
+            # Round, so positions written by ms_to_sample are read back unchanged
+            return round(s * 1000 / (track.channels * track.samplerate))
+
+        return Track(
+            id=track.id,
+            name=track.title or '',
+            artist=track.artist or '',
+            location=location.location or '',
+            album=track.album or '',
+            year=track.year or '',
+            genre=track.genre or '',
+            comment=track.comment or '',
+            duration_ms=round(track.duration * 1000),
+            track_number=track.tracknumber,
+            url=track.url,
+            sample_rate=track.samplerate,
+            cues=[Cue(
+                type=c.type,
+                position_ms=sample_to_ms(c.position),
+                length_ms=sample_to_ms(c.length),
+                hotcue=c.hotcue if c.hotcue >= 0 else None,
+                label=c.label if c.label else None,
+                color=c.color
+            ) for c in cues],
+            bpm=track.bpm,
+            channels=track.channels,
+            times_played=track.timesplayed,
+            rating=track.rating,
+            key=track.key,
+            color=track.color
+        )
+
+    def load_track_blobs(self, tracks: list[Track]) -> list[Track]:
+        with self.make_session() as session:
+            return load_track_blobs(session, MixxxTrack, tracks)
     
     def crates(self, name: Optional[str]=None) -> Iterable[Crate]:
         with self.make_session() as session:
             constraints = [c for c in [
                 MixxxCrate.name == name if name else None,
-            ] if c]
+            ] if c is not None]
+            # Fetch the memberships of all matching crates in a single query
+            crate_tracks = group_by(
+                session.query(MixxxCrateTrack)
+                    .join(MixxxCrate, MixxxCrate.id == MixxxCrateTrack.crate_id)
+                    .where(*constraints),
+                lambda t: t.crate_id
+            )
             for crate in session.query(MixxxCrate).where(*constraints):
                 # TODO: Proper creation/modification dates?
                 yield Crate(
                     id=crate.id,
                     name=crate.name,
                     locked=bool(crate.locked),
-                    track_ids={t.track_id for t in session.query(MixxxCrateTrack).where(MixxxCrateTrack.crate_id == crate.id)}
+                    track_ids={t.track_id for t in crate_tracks.get(crate.id, [])}
                 )
     
     def playlists(self, name: Optional[str]=None) -> Iterable[Playlist]:
         with self.make_session() as session:
             constraints = [c for c in [
                 MixxxPlaylist.name == name if name else None,
-            ] if c]
+            ] if c is not None]
+            # Fetch the (ordered) memberships of all matching playlists in a single query
+            playlist_tracks = group_by(
+                session.query(MixxxPlaylistTrack)
+                    .join(MixxxPlaylist, MixxxPlaylist.id == MixxxPlaylistTrack.playlist_id)
+                    .where(*constraints)
+                    .order_by(MixxxPlaylistTrack.playlist_id, MixxxPlaylistTrack.position),
+                lambda t: t.playlist_id
+            )
             for playlist in session.query(MixxxPlaylist).where(*constraints):
                 yield Playlist(
                     id=playlist.id,
@@ -263,175 +384,180 @@ class MixxxStore(Store):
                     date_modified=playlist.date_modified,
                     type=playlist.hidden,
                     locked=bool(playlist.locked),
-                    track_ids=[t.id for t in session.query(MixxxPlaylistTrack).where(MixxxPlaylistTrack.playlist_id == playlist.id)]
+                    track_ids=[t.track_id for t in playlist_tracks.get(playlist.id, [])]
                 )
 
-    def _query_id(self, session, cls, *constraints) -> Optional[int]:
-        row = session.query(cls).where(*constraints).first()
-        return row.id if row else None
-    
     def match_tracks(self, tracks: list[TrackHeader]) -> Iterable[Optional[int]]:
-        with self.make_session() as session:
-            for track in tracks:
-                yield self._query_id(
-                    session,
-                    MixxxTrack,
-                    MixxxTrack.title == track.name,
-                    MixxxTrack.artist == track.artist
-                )
+        index = self._track_matching_index()
+        return [index.match(t) for t in tracks]
+
+    def _track_matching_index(self) -> TrackIndex:
+        # Build the matching index once, it is kept up-to-date by update_tracks
+        if self._track_index is None:
+            with self.make_session() as session:
+                self._track_index = TrackIndex(TrackHeader(
+                    id=id,
+                    name=title or '',
+                    artist=artist or '',
+                    duration_ms=round(duration * 1000) if duration is not None else None,
+                ) for id, title, artist, duration in session.query(MixxxTrack.id, MixxxTrack.title, MixxxTrack.artist, MixxxTrack.duration))
+        return self._track_index
     
     def match_directories(self, directories: list[Directory]) -> Iterable[Optional[int]]:
         with self.make_session() as session:
-            for directory in directories:
-                row = session.query(MixxxDirectory).where(MixxxDirectory.directory == directory.location).first()
-                yield self._directory_id(row.directory) if row else None
+            locations = match_ids(session, MixxxDirectory.directory, [MixxxDirectory.directory], [(d.location,) for d in directories])
+            return [self._directory_id(l) if l else None for l in locations]
     
     def match_playlists(self, playlists: list[PlaylistHeader]) -> Iterable[Optional[int]]:
         with self.make_session() as session:
-            for playlist in playlists:
-                yield self._query_id(
-                    session,
-                    MixxxPlaylist,
-                    MixxxPlaylist.name == playlist.name
-                )
+            return match_ids(session, MixxxPlaylist.id, [MixxxPlaylist.name], [(p.name,) for p in playlists])
     
     def match_crates(self, crates: list[CrateHeader]) -> Iterable[Optional[int]]:
         with self.make_session() as session:
-            for crate in crates:
-                yield self._query_id(
-                    session,
-                    MixxxCrate,
-                    MixxxCrate.name == crate.name
-                )
+            return match_ids(session, MixxxCrate.id, [MixxxCrate.name], [(c.name,) for c in crates])
     
+    def _track_location_ids(self) -> dict[str, int]:
+        # Load the index of track locations once, it is kept up-to-date by update_tracks
+        if self._location_ids is None:
+            with self.make_session() as session:
+                self._location_ids = {l.location: l.id for l in session.query(MixxxTrackLocation.id, MixxxTrackLocation.location)}
+        return self._location_ids
+
     def update_tracks(self, tracks: list[Track]) -> list[int]:
-        new_ids = []
+        location_ids = self._track_location_ids()
         with self.make_session.begin() as session:
-            for track in tracks:
-                path = Path(track.location).resolve()
-                location = session.query(MixxxTrackLocation).where(MixxxTrackLocation.location == track.location).first()
-                if not location:
-                    location = session.merge(MixxxTrackLocation(
-                        location=track.location,
-                        filename=path.name,
-                        directory=str(path.parent),
-                        # TODO: Determine filesize?
-                        filesize=None,
-                        fs_deleted=0,
-                        needs_verification=0
-                    ))
-                    session.flush()
-                # TODO: Insert main cue point as 'cuepoint' (in addition to the cues below)?
-                new_track = session.merge(MixxxTrack(
-                    id=track.id,
-                    title=track.name,
-                    artist=track.artist,
-                    album=track.album,
-                    year=track.year,
-                    genre=track.genre,
-                    location=location.id,
-                    comment=track.comment,
-                    url=track.url,
-                    duration=float(track.duration_ms) / 1000.0 if track.duration_ms else None,
-                    samplerate=track.sample_rate,
-                    bpm=track.bpm,
-                    beats=track.beats.data if track.beats else None,
-                    beats_version=track.beats.version if track.beats else None,
-                    beats_sub_version=track.beats.sub_version if track.beats else None,
-                    key=track.key,
-                    keys=track.keys.data if track.keys else None,
-                    keys_version=track.keys.version if track.keys else None,
-                    keys_sub_version=track.keys.sub_version if track.keys else None,
-                    channels=track.channels,
-                    timesplayed=track.times_played,
-                    rating=track.rating,
-                    color=track.color,
-                    mixxx_deleted=0
-                ))
-                session.flush()
-                new_ids.append(new_track.id)
-                # TODO: More sophisticated cue merging strategy?
-                if track.cues:
-                    def ms_to_sample(m: int) -> Optional[int]:
-                        if track.channels and track.sample_rate:
-                            return int((m * track.channels * track.sample_rate) / 1000)
-                        else:
-                            return None
-
-                    session.execute(delete(MixxxCue).where(MixxxCue.track_id == new_track.id))
-                    for cue in track.cues:
-                        session.merge(MixxxCue(
-                            type=cue.type,
-                            position=ms_to_sample(cue.position_ms) if cue.position_ms else None,
-                            length=ms_to_sample(cue.length_ms),
-                            hotcue=cue.hotcue,
-                            label=cue.label,
-                            color=cue.color,
-                            track_id=new_track.id
-                        ))
+            # Insert the missing track locations
+            missing_locations = list(dict.fromkeys(t.location for t in tracks if t.location not in location_ids))
+            new_location_ids = dict(zip(missing_locations, upsert(session, MixxxTrackLocation.__table__, [{
+                'id': None,
+                'location': location,
+                'filename': Path(location).name,
+                'directory': str(Path(location).parent),
+                # TODO: Determine filesize?
+                'filesize': None,
+                'fs_deleted': 0,
+                'needs_verification': 0,
+            } for location in missing_locations])))
+
+            # TODO: Insert main cue point as 'cuepoint' (in addition to the cues below)?
+            new_ids = upsert(session, MixxxTrack.__table__, [{
+                'id': track.id,
+                'title': track.name,
+                'artist': track.artist,
+                'album': track.album,
+                'year': track.year,
+                'genre': track.genre,
+                'location': location_ids.get(track.location) or new_location_ids[track.location],
+                'comment': track.comment,
+                'tracknumber': str(track.track_number) if track.track_number is not None else None,
+                'url': track.url,
+                'duration': float(track.duration_ms) / 1000.0 if track.duration_ms else None,
+                'samplerate': track.sample_rate,
+                'bpm': track.bpm,
+                'beats': track.beats.data if track.beats else None,
+                'beats_version': track.beats.version if track.beats else None,
+                'beats_sub_version': track.beats.sub_version if track.beats else None,
+                'key': track.key,
+                'keys': track.keys.data if track.keys else None,
+                'keys_version': track.keys.version if track.keys else None,
+                'keys_sub_version': track.keys.sub_version if track.keys else None,
+                'channels': track.channels,
+                'timesplayed': track.times_played,
+                'rating': track.rating,
+                'color': track.color,
+                'mixxx_deleted': 0,
+            } for track in tracks])
+
+            # TODO: More sophisticated cue merging strategy?
+            tracks_with_cues = [(track, id) for track, id in zip(tracks, new_ids) if track.cues]
+            delete_in(session, MixxxCue.track_id, [id for _, id in tracks_with_cues])
+            cue_rows = []
+            for track, id in tracks_with_cues:
+                def ms_to_sample(m: int) -> Optional[int]:
+                    if track.channels and track.sample_rate:
+                        return int((m * track.channels * track.sample_rate) / 1000)
+                    else:
+                        return None
+
+                for cue in track.cues:
+                    cue_rows.append({
+                        'type': cue.type,
+                        'position': ms_to_sample(cue.position_ms) if cue.position_ms is not None else -1,
+                        'length': ms_to_sample(cue.length_ms) or 0,
+                        'hotcue': cue.hotcue if cue.hotcue is not None else -1,
+                        'label': cue.label or '',
+                        'color': cue.color,
+                        'track_id': id,
+                    })
+            if cue_rows:
+                session.execute(insert(MixxxCue.__table__), cue_rows)
+        location_ids.update(new_location_ids)
+        if self._track_index is not None:
+            for track, id in zip(tracks, new_ids):
+                self._track_index.add(replace(track.header(), id=id))
         return new_ids
 
     def update_directories(self, directories: list[Directory]) -> list[int]:
-        new_ids = []
         with self.make_session.begin() as session:
-            for directory in directories:
-                session.merge(MixxxDirectory(
-                    directory=directory.location
-                ))
-                session.flush()
-                new_ids.append(self._directory_id(directory.location))
-        return new_ids
+            insert_ignore(session, MixxxDirectory.__table__, [{'directory': d.location} for d in directories])
+        self._invalidate_directories()
+        return [self._directory_id(d.location) for d in directories]
 
     def update_crates(self, crates: list[Crate]) -> list[int]:
-        new_ids = []
         with self.make_session.begin() as session:
-            for crate in crates:
-                new_crate = session.merge(MixxxCrate(
-                    id=crate.id,
-                    name=crate.name,
-                    count=len(crate.track_ids),
-                    locked=crate.locked
-                ))
-                session.flush()
-                new_ids.append(new_crate.id)
-                # TODO: More sophisticated crate merging strategy
-                # (should we delete old tracks like with playlists, even though we don't have to worry about order?)
-                for track_id in crate.track_ids:
-                    session.merge(MixxxCrateTrack(
-                        crate_id=new_crate.id,
-                        track_id=track_id
-                    ))
+            new_ids = upsert(session, MixxxCrate.__table__, [{
+                'id': crate.id,
+                'name': crate.name,
+                'count': len(crate.track_ids),
+                'locked': crate.locked,
+            } for crate in crates])
+            # Only write the memberships that changed
+            existing = group_rows_in(session, MixxxCrateTrack.crate_id, new_ids, MixxxCrateTrack.track_id)
+            removed_rows = []
+            added_rows = []
+            for crate, id in zip(crates, new_ids):
+                existing_track_ids = {track_id for track_id, in existing.get(id, [])}
+                removed_rows += [{'crate_id': id, 'track_id': track_id} for track_id in existing_track_ids - crate.track_ids]
+                added_rows += [{'crate_id': id, 'track_id': track_id} for track_id in crate.track_ids - existing_track_ids]
+            delete_rows(session, MixxxCrateTrack.__table__, removed_rows)
+            insert_ignore(session, MixxxCrateTrack.__table__, added_rows)
         return new_ids
 
     def update_playlists(self, playlists: list[Playlist]) -> list[int]:
-        new_ids = []
         with self.make_session.begin() as session:
-            for playlist in playlists:
-                new_playlist = session.merge(MixxxPlaylist(
-                    id=playlist.id,
-                    name=playlist.name,
-                    # TODO: Merge position
-                    # position=playlist.position,
-                    hidden=playlist.type,
-                    locked=playlist.locked
-                ))
-                session.flush()
-                new_ids.append(new_playlist.id)
-                # TODO: More sophisticated playlist merging strategy than just replacing?
-                session.execute(delete(MixxxPlaylistTrack).where(MixxxPlaylistTrack.playlist_id == new_playlist.id))
-                for i, track_id in enumerate(playlist.track_ids):
-                    session.merge(MixxxPlaylistTrack(
-                        playlist_id=new_playlist.id,
-                        track_id=track_id,
-                        position=i
-                    ))
+            new_ids = upsert(session, MixxxPlaylist.__table__, [{
+                'id': playlist.id,
+                'name': playlist.name,
+                # TODO: Merge position
+                # 'position': playlist.position,
+                'hidden': playlist.type,
+                'locked': playlist.locked,
+            } for playlist in playlists])
+            # Only write the memberships that changed, by diffing them against the stored ones
+            existing = group_rows_in(session, MixxxPlaylistTrack.playlist_id, new_ids, MixxxPlaylistTrack.id, MixxxPlaylistTrack.track_id, MixxxPlaylistTrack.position, order_by=[MixxxPlaylistTrack.position, MixxxPlaylistTrack.id])
+            removed_ids = []
+            moved_rows = []
+            added_rows = []
+            for playlist, id in zip(playlists, new_ids):
+                diff = diff_list(existing.get(id, []), playlist.track_ids)
+                removed_ids += diff.deletes
+                moved_rows += [{'id': row_id, 'position': i} for row_id, i in diff.moves]
+                added_rows += [{'playlist_id': id, 'track_id': track_id, 'position': i} for i, track_id in diff.inserts]
+            delete_in(session, MixxxPlaylistTrack.id, removed_ids)
+            update_rows(session, MixxxPlaylistTrack.__table__, moved_rows)
+            if added_rows:
+                session.execute(insert(MixxxPlaylistTrack.__table__), added_rows)
         return new_ids
     
-    def download_track(self, location: str) -> bytes:
+    @contextmanager
+    def read_track(self, location: str) -> Iterator[BinaryIO]:
         with open(location, 'rb') as f:
-            return f.read()
-        
-    def upload_track(self, location: str, raw: bytes):
-        Path(location).parent.mkdir(parents=True, exist_ok=True)
-        with open(location, 'wb') as f:
-            f.write(raw)
+            yield f
+
+    @contextmanager
+    def write_track(self, location: str, mtime: Optional[float]=None) -> Iterator[BinaryIO]:
+        with write_replacing(Path(location), mtime=mtime) as f:
+            yield f
+
+    def track_file_info(self, location: str) -> Optional[TrackFileInfo]:
+        return file_info(Path(location))
@@ -1,4 +1,5 @@
 from sqlalchemy import Column, ForeignKey, Integer, Float, String, Text, LargeBinary
+from sqlalchemy.orm import deferred
 
 from mixync.store.mixxx.model import Base
 
@@ -33,12 +34,13 @@ class MixxxTrack(Base):
     timesplayed = Column(Integer, default=0)
     rating = Column(Integer, default=0)
     key = Column(String(8), default='')
-    beats = Column(LargeBinary)
+    # The blobs are deferred, since they are only needed for tracks to be written
+    beats = deferred(Column(LargeBinary))
     beats_version = Column(Text)
     beats_sub_version = Column(Text, default='')
     composer = Column(String(64), default='')
     bpm_lock = Column(Integer, default=0)
-    keys = Column(LargeBinary)
+    keys = deferred(Column(LargeBinary))
     keys_version = Column(Text)
     keys_sub_version = Column(Text)
     key_id = Column(Integer, default=0)
@@ -1,91 +1,248 @@
-from sqlalchemy import create_engine, delete
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import bindparam, insert, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+from contextlib import contextmanager
+from dataclasses import replace
 from pathlib import Path
-from typing import Iterable
+from threading import RLock
+from tempfile import NamedTemporaryFile
+from typing import BinaryIO, Iterable, Iterator, cast
+from uuid import uuid4
 
+from mixync.matching import TrackIndex
 from mixync.model.crate import *
 from mixync.model.cue import *
 from mixync.model.directory import *
 from mixync.model.playlist import *
 from mixync.model.track import *
+from mixync.model.track_file import TrackFileInfo
+from mixync.options import Options
 from mixync.store import Store
 from mixync.store.portable.model import Base
 from mixync.store.portable.model.crate import *
 from mixync.store.portable.model.crate_track import *
 from mixync.store.portable.model.cue import *
 from mixync.store.portable.model.directory import *
+from mixync.store.portable.model.id_mapping import *
 from mixync.store.portable.model.playlist import *
 from mixync.store.portable.model.playlist_track import *
+from mixync.store.portable.model.setting import *
+from mixync.store.portable.model.sync_hash import *
 from mixync.store.portable.model.track import *
+from mixync.store.portable.model.track_file import *
+from mixync.utils.fs import file_info, write_replacing
+from mixync.utils.hash import HashingWriter
+from mixync.utils.list import chunks, group_by
+from mixync.utils.diff import diff_list
+from mixync.utils.sql import MAX_PARAMS, add_missing_columns, create_sqlite_engine, delete_in, delete_rows, existing_ids, group_rows_in, insert_ignore, load_track_blobs, match_ids, update_rows, upsert
+from mixync.utils.sqlite import SQLITE_PROFILES, SQLiteProfile
+
+# Audio files are stored under their (relative) track locations in 'audio'.
+PATH_LAYOUT = 'path'
+# Audio files are stored once per distinct content under their digest in
+# 'blobs', the 'track_files' table maps track locations to these blobs.
+CONTENT_LAYOUT = 'content'
 
 class PortableStore(Store):
     """A wrapper around a portable musiclib."""
 
-    def __init__(self, path: Path):
+    def __init__(self, path: Path, sqlite_profile: SQLiteProfile=SQLITE_PROFILES['fast'], content_addressed: bool=False):
         path.mkdir(parents=True, exist_ok=True)
         self.path = path
         self.audio_path = path / 'audio'
+        self.blobs_path = path / 'blobs'
 
         db_path = path / 'library.sqlite3'
-        self.engine = create_engine(f'sqlite:///{db_path}')
+        self.engine = create_sqlite_engine(db_path, sqlite_profile)
         self.make_session = sessionmaker(bind=self.engine, expire_on_commit=False)
+        self._write_lock = RLock()
 
         self._create_tables()
+        self.layout = self._init_layout(CONTENT_LAYOUT if content_addressed else PATH_LAYOUT)
+        self.id = self._init_id()
+        self._track_index: Optional[TrackIndex] = None
 
-    @staticmethod
-    def parse_ref(ref: str):
+    @classmethod
+    def parse_ref(cls, ref: str, opts: Options):
         try:
             path = Path(ref)
         except:
             return None
         if path.name.endswith('.musiclib'):
-            return PortableStore(path)
+            return PortableStore(path, sqlite_profile=opts.sqlite_profile or SQLITE_PROFILES['fast'], content_addressed=opts.content_addressed)
         return None
     
+    def identity(self) -> str:
+        # Use a generated id, since the path of a musiclib (e.g. on a flash drive) may change
+        return f'musiclib:{self.id}'
+
+    def state_path(self) -> Optional[Path]:
+        return self.path / '.mixync'
+
+    def engines(self) -> list[Engine]:
+        return [self.engine]
+
+    def load_id_mappings(self, source: str) -> dict[str, dict[int, int]]:
+        id_columns = {
+            'tracks': PortableTrack.id,
+            'directories': PortableDirectory.id,
+            'playlists': PortablePlaylist.id,
+            'crates': PortableCrate.id,
+        }
+        with self.make_session() as session:
+            rows = session.query(PortableIdMapping.resource, PortableIdMapping.source_id, PortableIdMapping.dest_id) \
+                .where(PortableIdMapping.source == source)
+            mappings: dict[str, dict[int, int]] = {}
+            for resource, source_id, dest_id in rows:
+                mappings.setdefault(resource, {})[source_id] = dest_id
+            for resource, mapping in mappings.items():
+                # Drop mappings to values that have been deleted since
+                existing = existing_ids(session, id_columns[resource], mapping.values())
+                mappings[resource] = {k: v for k, v in mapping.items() if v in existing}
+            return mappings
+
+    def save_id_mappings(self, source: str, mappings: dict[str, dict[int, int]]):
+        rows = [{
+            'source': source,
+            'resource': resource,
+            'source_id': source_id,
+            'dest_id': dest_id,
+        } for resource, mapping in mappings.items() for source_id, dest_id in mapping.items()]
+        with self._write_session() as session:
+            upsert(session, PortableIdMapping.__table__, rows, key=('source', 'resource', 'source_id'))
+
+    def load_sync_hashes(self, peer: str) -> dict[str, dict[int, str]]:
+        with self.make_session() as session:
+            rows = session.query(PortableSyncHash.resource, PortableSyncHash.id, PortableSyncHash.hash) \
+                .where(PortableSyncHash.peer == peer)
+            hashes: dict[str, dict[int, str]] = {}
+            for resource, id, hash in rows:
+                hashes.setdefault(resource, {})[id] = hash
+            return hashes
+
+    def save_sync_hashes(self, peer: str, hashes: dict[str, dict[int, str]]):
+        rows = [{
+            'peer': peer,
+            'resource': resource,
+            'id': id,
+            'hash': hash,
+        } for resource, resource_hashes in hashes.items() for id, hash in resource_hashes.items()]
+        with self._write_session() as session:
+            upsert(session, PortableSyncHash.__table__, rows, key=('peer', 'resource', 'id'))
+
+    @contextmanager
+    def _write_session(self) -> Iterator[Session]:
+        # Writes are serialized (e.g. linking track files while tracks are updated), since a
+        # transaction that has read fails instead of waiting if another one has written since
+        with self._write_lock, self.make_session.begin() as session:
+            yield session
+
     def _create_tables(self):
         Base.metadata.create_all(self.engine, checkfirst=True)
+        # Migrate musiclibs created by earlier versions
+        add_missing_columns(self.engine, PortableTrack.__table__)
+
+    def _init_layout(self, requested_layout: str) -> str:
+        # The layout is fixed once the musiclib contains tracks (libraries predating
+        # the setting always use the path layout)
+        with self._write_session() as session:
+            setting = session.query(PortableSetting).where(PortableSetting.name == 'audio.layout').first()
+            if setting:
+                layout = setting.value
+            else:
+                layout = PATH_LAYOUT if session.query(PortableTrack.id).first() else requested_layout
+                session.add(PortableSetting(name='audio.layout', value=layout))
+        if layout != requested_layout and requested_layout != PATH_LAYOUT:
+            raise RuntimeError(f"Musiclib at '{self.path}' already uses the '{layout}' layout and cannot be converted to the '{requested_layout}' layout.")
+        return layout
+
+    def _init_id(self) -> str:
+        with self._write_session() as session:
+            setting = session.query(PortableSetting).where(PortableSetting.name == 'library.id').first()
+            if setting:
+                return setting.value
+            id = str(uuid4())
+            session.add(PortableSetting(name='library.id', value=id))
+            return id
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.blobs_path / digest[:2] / digest[2:]
+
+    def _track_file(self, location: str) -> Optional[PortableTrackFile]:
+        with self.make_session() as session:
+            return session.query(PortableTrackFile).where(PortableTrackFile.location == location).first()
+
+    def _link_track_file(self, location: str, digest: str, size: int, mtime: Optional[float]):
+        with self._write_session() as session:
+            upsert(session, PortableTrackFile.__table__, [{
+                'location': location,
+                'digest': digest,
+                'size': size,
+                'mtime': mtime,
+            }], key='location')
     
     def tracks(self, name: Optional[str]=None, artist: Optional[str]=None) -> Iterable[Track]:
         with self.make_session() as session:
             constraints = [c for c in [
                 PortableTrack.name == name if name else None,
                 PortableTrack.artist == artist if artist else None,
-            ] if c]
-            for track in session.query(PortableTrack).where(*constraints):
-                yield Track(
-                    id=track.id,
-                    name=track.name,
-                    artist=track.artist,
-                    location=track.location,
-                    album=track.album,
-                    year=track.year,
-                    genre=track.genre,
-                    comment=track.comment,
-                    duration_ms=track.duration_ms,
-                    track_number=track.track_number,
-                    url=track.url,
-                    sample_rate=track.sample_rate,
-                    cues=[Cue(
-                        type=cue.type,
-                        position_ms=cue.position_ms,
-                        length_ms=cue.length_ms,
-                        hotcue=cue.hotcue,
-                        label=cue.label,
-                        color=cue.color
-                    ) for cue in track.cues],
-                    bpm=track.bpm,
-                    channels=track.channels,
-                    times_played=track.times_played,
-                    rating=track.rating,
-                    key=track.key,
-                    color=track.color
+            ] if c is not None]
+            rows = session.query(PortableTrack).where(*constraints).yield_per(MAX_PARAMS)
+            for batch in chunks(rows, MAX_PARAMS):
+                # Fetch the cues of each batch of tracks in a single query
+                cues = group_by(
+                    session.query(PortableCue).where(PortableCue.track_id.in_([track.id for track in batch])),
+                    lambda c: c.track_id
                 )
+                yield from (self._to_track(track, cues.get(track.id, [])) for track in batch)
+
+    def _to_track(self, track: PortableTrack, cues: list[PortableCue]) -> Track:
+        return Track(
+            id=track.id,
+            name=track.name,
+            artist=track.artist,
+            location=track.location,
+            album=track.album,
+            year=track.year,
+            genre=track.genre,
+            comment=track.comment,
+            duration_ms=track.duration_ms,
+            track_number=track.track_number,
+            url=track.url,
+            sample_rate=track.sample_rate,
+            cues=[Cue(
+                type=cue.type,
+                position_ms=cue.position_ms,
+                length_ms=cue.length_ms,
+                hotcue=cue.hotcue,
+                label=cue.label,
+                color=cue.color
+            ) for cue in cues],
+            bpm=track.bpm,
+            channels=track.channels,
+            times_played=track.times_played,
+            rating=track.rating,
+            key=track.key,
+            color=track.color,
+            digest=track.digest
+        )
+
+    def load_track_blobs(self, tracks: list[Track]) -> list[Track]:
+        with self.make_session() as session:
+            return load_track_blobs(session, PortableTrack, tracks)
     
     def crates(self, name: Optional[str]=None) -> Iterable[Crate]:
         with self.make_session() as session:
             constraints = [c for c in [
                 PortableCrate.name == name if name else None,
-            ] if c]
+            ] if c is not None]
+            # Fetch the memberships of all matching crates in a single query
+            crate_tracks = group_by(
+                session.query(PortableCrateTrack)
+                    .join(PortableCrate, PortableCrate.id == PortableCrateTrack.crate_id)
+                    .where(*constraints),
+                lambda t: t.crate_id
+            )
             for crate in session.query(PortableCrate).where(*constraints):
                 yield Crate(
                     id=crate.id,
@@ -93,14 +250,22 @@ class PortableStore(Store):
                     date_created=crate.date_created,
                     date_modified=crate.date_modified,
                     locked=crate.locked,
-                    track_ids={t.track_id for t in crate.tracks}
+                    track_ids={t.track_id for t in crate_tracks.get(crate.id, [])}
                 )
     
     def playlists(self, name: Optional[str]=None) -> Iterable[Playlist]:
         with self.make_session() as session:
             constraints = [c for c in [
                 PortablePlaylist.name == name if name else None,
-            ] if c]
+            ] if c is not None]
+            # Fetch the (ordered) memberships of all matching playlists in a single query
+            playlist_tracks = group_by(
+                session.query(PortablePlaylistTrack)
+                    .join(PortablePlaylist, PortablePlaylist.id == PortablePlaylistTrack.playlist_id)
+                    .where(*constraints)
+                    .order_by(PortablePlaylistTrack.playlist_id, PortablePlaylistTrack.position),
+                lambda t: t.playlist_id
+            )
             for playlist in session.query(PortablePlaylist).where(*constraints):
                 yield Playlist(
                     id=playlist.id,
@@ -109,7 +274,7 @@ class PortableStore(Store):
                     date_modified=playlist.date_modified,
                     type=playlist.type,
                     locked=playlist.locked,
-                    track_ids=[t.track_id for t in sorted(playlist.tracks, key=lambda t: t.position)]
+                    track_ids=[t.track_id for t in playlist_tracks.get(playlist.id, [])]
                 )
 
     def directories(self) -> Iterable[Directory]:
@@ -120,164 +285,242 @@ class PortableStore(Store):
                     location=directory.location
                 )
     
-    def _query_id(self, session, cls, *constraints) -> Optional[int]:
-        row = session.query(cls).where(*constraints).first()
-        return row.id if row else None
-    
     def match_tracks(self, tracks: list[TrackHeader]) -> Iterable[Optional[int]]:
-        with self.make_session() as session:
-            for track in tracks:
-                yield self._query_id(
-                    session,
-                    PortableTrack,
-                    PortableTrack.name == track.name,
-                    PortableTrack.artist == track.artist
+        index = self._track_matching_index()
+        return [index.match(t) for t in tracks]
+
+    def _track_matching_index(self) -> TrackIndex:
+        # Build the matching index once, it is kept up-to-date by update_tracks
+        if self._track_index is None:
+            with self.make_session() as session:
+                self._track_index = TrackIndex(
+                    TrackHeader(id=id, name=name, artist=artist, duration_ms=duration_ms, digest=digest)
+                    for id, name, artist, duration_ms, digest in session.query(PortableTrack.id, PortableTrack.name, PortableTrack.artist, PortableTrack.duration_ms, PortableTrack.digest)
                 )
+        return self._track_index
     
     def match_directories(self, directories: list[Directory]) -> Iterable[Optional[int]]:
         with self.make_session() as session:
-            for directory in directories:
-                yield self._query_id(
-                    session,
-                    PortableDirectory,
-                    PortableDirectory.location == directory.location
-                )
+            return match_ids(session, PortableDirectory.id, [PortableDirectory.location], [(d.location,) for d in directories])
     
     def match_playlists(self, playlists: list[PlaylistHeader]) -> Iterable[Optional[int]]:
         with self.make_session() as session:
-            for playlist in playlists:
-                yield self._query_id(
-                    session,
-                    PortablePlaylist,
-                    PortablePlaylist.name == playlist.name
-                )
+            return match_ids(session, PortablePlaylist.id, [PortablePlaylist.name], [(p.name,) for p in playlists])
     
     def match_crates(self, crates: list[CrateHeader]) -> Iterable[Optional[int]]:
         with self.make_session() as session:
-            for crate in crates:
-                yield self._query_id(
-                    session,
-                    PortableCrate,
-                    PortableCrate.name == crate.name
-                )
+            return match_ids(session, PortableCrate.id, [PortableCrate.name], [(c.name,) for c in crates])
     
     def track_directory_name(self, track: Track) -> Optional[str]:
         parts = Path(track.location).parts
         return parts[0] if parts else None
 
     def update_tracks(self, tracks: list[Track]) -> list[int]:
-        new_ids = []
-        with self.make_session.begin() as session:
+        with self._write_session() as session:
+            old_locations = self._track_locations(session, [t.id for t in tracks if t.id])
+            new_ids = upsert(session, PortableTrack.__table__, [{
+                'id': track.id,
+                'name': track.name,
+                'artist': track.artist,
+                'location': track.location,
+                'album': track.album,
+                'year': track.year,
+                'genre': track.genre,
+                'comment': track.comment,
+                'duration_ms': track.duration_ms,
+                'track_number': track.track_number,
+                'url': track.url,
+                'sample_rate': track.sample_rate,
+                'bpm': track.bpm,
+                'beats': track.beats.data if track.beats else None,
+                'beats_version': track.beats.version if track.beats else None,
+                'beats_sub_version': track.beats.sub_version if track.beats else None,
+                'channels': track.channels,
+                'times_played': track.times_played,
+                'rating': track.rating,
+                'key': track.key,
+                'keys': track.keys.data if track.keys else None,
+                'keys_version': track.keys.version if track.keys else None,
+                'keys_sub_version': track.keys.sub_version if track.keys else None,
+                'color': track.color,
+            } for track in tracks])
+            # TODO: More sophisticated cue merging strategy?
+            tracks_with_cues = [(track, id) for track, id in zip(tracks, new_ids) if track.cues]
+            delete_in(session, PortableCue.track_id, [id for _, id in tracks_with_cues])
+            cue_rows = [{
+                'type': cue.type,
+                'position_ms': cue.position_ms,
+                'length_ms': cue.length_ms,
+                'hotcue': cue.hotcue,
+                'label': cue.label,
+                'color': cue.color,
+                'track_id': id,
+            } for track, id in tracks_with_cues for cue in track.cues]
+            if cue_rows:
+                session.execute(insert(PortableCue.__table__), cue_rows)
+            # Only set known digests, the others may just not have been computed in this run
+            digest_rows = [{'track_id': id, 'digest': track.digest} for track, id in zip(tracks, new_ids) if track.digest]
+            if digest_rows:
+                session.execute(update(PortableTrack.__table__).where(PortableTrack.id == bindparam('track_id')), digest_rows)
+            # Move the files of tracks that have moved in the source, instead of copying them again
+            moves = []
             for track in tracks:
-                new_track = session.merge(PortableTrack(
-                    id=track.id,
-                    name=track.name,
-                    artist=track.artist,
-                    location=track.location,
-                    album=track.album,
-                    year=track.year,
-                    genre=track.genre,
-                    comment=track.comment,
-                    duration_ms=track.duration_ms,
-                    track_number=track.track_number,
-                    url=track.url,
-                    sample_rate=track.sample_rate,
-                    bpm=track.bpm,
-                    beats=track.beats.data if track.beats else None,
-                    beats_version=track.beats.version if track.beats else None,
-                    beats_sub_version=track.beats.sub_version if track.beats else None,
-                    channels=track.channels,
-                    times_played=track.times_played,
-                    rating=track.rating,
-                    key=track.key,
-                    keys=track.keys.data if track.keys else None,
-                    keys_version=track.keys.version if track.keys else None,
-                    keys_sub_version=track.keys.sub_version if track.keys else None,
-                    color=track.color
-                ))
-                session.flush()
-                new_ids.append(new_track.id)
-                # TODO: More sophisticated cue merging strategy?
-                if track.cues:
-                    session.execute(delete(PortableCue).where(PortableCue.track_id == new_track.id))
-                    for cue in track.cues:
-                        session.merge(PortableCue(
-                            type=cue.type,
-                            position_ms=cue.position_ms,
-                            length_ms=cue.length_ms,
-                            hotcue=cue.hotcue,
-                            label=cue.label,
-                            color=cue.color,
-                            track_id=new_track.id
-                        ))
+                old_location = old_locations.get(track.id) if track.id else None
+                if old_location and old_location != track.location:
+                    moves.append((old_location, track.location))
+            if self.layout == CONTENT_LAYOUT:
+                for old_location, new_location in moves:
+                    self._move_track_file_entry(session, old_location, new_location)
+        if self.layout != CONTENT_LAYOUT:
+            # Only rename once the new locations are committed
+            for old_location, new_location in moves:
+                self._move_track_file(old_location, new_location)
+        if self._track_index is not None:
+            for track, id in zip(tracks, new_ids):
+                self._track_index.add(replace(track.header(), id=id))
         return new_ids
 
+    def _track_locations(self, session, ids: list[int]) -> dict[int, str]:
+        locations = {}
+        for chunk in chunks(ids, MAX_PARAMS):
+            locations.update(session.query(PortableTrack.id, PortableTrack.location).where(PortableTrack.id.in_(chunk)))
+        return locations
+
+    def _move_track_file_entry(self, session, old_location: str, new_location: str):
+        if not session.query(PortableTrackFile.location).where(PortableTrackFile.location == new_location).first():
+            session.execute(update(PortableTrackFile.__table__).where(PortableTrackFile.location == old_location).values(location=new_location))
+
+    def _move_track_file(self, old_location: str, new_location: str):
+        old_path = self.audio_path / old_location
+        new_path = self.audio_path / new_location
+        try:
+            if old_path.exists() and not new_path.exists():
+                new_path.parent.mkdir(parents=True, exist_ok=True)
+                old_path.rename(new_path)
+        except OSError:
+            # The file transfer copies the file to the new location instead
+            pass
+
     def update_directories(self, directories: list[Directory]) -> list[int]:
-        new_ids = []
-        with self.make_session.begin() as session:
-            for directory in directories:
-                new_directory = session.merge(PortableDirectory(
-                    id=directory.id,
-                    location=directory.location
-                ))
-                session.flush()
-                new_ids.append(new_directory.id)
-        return new_ids
+        with self._write_session() as session:
+            return upsert(session, PortableDirectory.__table__, [{
+                'id': directory.id,
+                'location': directory.location,
+            } for directory in directories])
 
     def update_crates(self, crates: list[Crate]) -> list[int]:
-        new_ids = []
-        with self.make_session.begin() as session:
-            for crate in crates:
-                new_crate = session.merge(PortableCrate(
-                    id=crate.id,
-                    name=crate.name,
-                    date_created=crate.date_created,
-                    date_modified=crate.date_modified,
-                    locked=crate.locked
-                ))
-                session.flush()
-                new_ids.append(new_crate.id)
-                # TODO: More sophisticated crate merging strategy
-                # (should we delete old tracks like with playlists, even though we don't have to worry about order?)
-                for track_id in crate.track_ids:
-                    session.merge(PortableCrateTrack(
-                        crate_id=new_crate.id,
-                        track_id=track_id
-                    ))
+        with self._write_session() as session:
+            new_ids = upsert(session, PortableCrate.__table__, [{
+                'id': crate.id,
+                'name': crate.name,
+                'date_created': crate.date_created,
+                'date_modified': crate.date_modified,
+                'locked': crate.locked,
+            } for crate in crates])
+            # Only write the memberships that changed
+            existing = group_rows_in(session, PortableCrateTrack.crate_id, new_ids, PortableCrateTrack.track_id)
+            removed_rows = []
+            added_rows = []
+            for crate, id in zip(crates, new_ids):
+                existing_track_ids = {track_id for track_id, in existing.get(id, [])}
+                removed_rows += [{'crate_id': id, 'track_id': track_id} for track_id in existing_track_ids - crate.track_ids]
+                added_rows += [{'crate_id': id, 'track_id': track_id} for track_id in crate.track_ids - existing_track_ids]
+            delete_rows(session, PortableCrateTrack.__table__, removed_rows)
+            insert_ignore(session, PortableCrateTrack.__table__, added_rows)
         return new_ids
 
     def update_playlists(self, playlists: list[Playlist]) -> list[int]:
-        new_ids = []
-        with self.make_session.begin() as session:
-            for playlist in playlists:
-                new_playlist = session.merge(PortablePlaylist(
-                    id=playlist.id,
-                    name=playlist.name,
-                    position=playlist.position,
-                    date_created=playlist.date_created,
-                    date_modified=playlist.date_modified,
-                    type=playlist.type,
-                    locked=playlist.locked
-                ))
-                session.flush()
-                new_ids.append(new_playlist.id)
-                # TODO: More sophisticated playlist merging strategy than just replacing?
-                session.execute(delete(PortablePlaylistTrack).where(PortablePlaylistTrack.playlist_id == new_playlist.id))
-                for i, track_id in enumerate(playlist.track_ids):
-                    session.merge(PortablePlaylistTrack(
-                        playlist_id=new_playlist.id,
-                        track_id=track_id,
-                        position=i
-                    ))
+        with self._write_session() as session:
+            new_ids = upsert(session, PortablePlaylist.__table__, [{
+                'id': playlist.id,
+                'name': playlist.name,
+                'position': playlist.position,
+                'date_created': playlist.date_created,
+                'date_modified': playlist.date_modified,
+                'type': playlist.type,
+                'locked': playlist.locked,
+            } for playlist in playlists])
+            # Only write the memberships that changed, by diffing them against the stored ones
+            existing = group_rows_in(session, PortablePlaylistTrack.playlist_id, new_ids, PortablePlaylistTrack.track_id, PortablePlaylistTrack.position, order_by=[PortablePlaylistTrack.position])
+            removed_rows = []
+            moved_rows = []
+            added_rows = []
+            for playlist, id in zip(playlists, new_ids):
+                # Since (playlist_id, track_id) is the primary key, only the first occurrence of a track is kept
+                track_ids = list(dict.fromkeys(playlist.track_ids))
+                diff = diff_list([(track_id, track_id, position) for track_id, position in existing.get(id, [])], track_ids)
+                removed_rows += [{'playlist_id': id, 'track_id': track_id} for track_id in diff.deletes]
+                moved_rows += [{'playlist_id': id, 'track_id': track_id, 'position': i} for track_id, i in diff.moves]
+                added_rows += [{'playlist_id': id, 'track_id': track_id, 'position': i} for i, track_id in diff.inserts]
+            delete_rows(session, PortablePlaylistTrack.__table__, removed_rows)
+            update_rows(session, PortablePlaylistTrack.__table__, moved_rows, key=('playlist_id', 'track_id'))
+            insert_ignore(session, PortablePlaylistTrack.__table__, added_rows)
         return new_ids
 
-    def download_track(self, location: str) -> bytes:
-        path = self.audio_path / location
+    @contextmanager
+    def read_track(self, location: str) -> Iterator[BinaryIO]:
+        if self.layout == CONTENT_LAYOUT:
+            track_file = self._track_file(location)
+            if not track_file:
+                raise FileNotFoundError(f"No audio stored for '{location}'")
+            path = self._blob_path(track_file.digest)
+        else:
+            path = self.audio_path / location
         with open(path, 'rb') as f:
-            return f.read()
+            yield f
+
+    @contextmanager
+    def write_track(self, location: str, mtime: Optional[float]=None) -> Iterator[BinaryIO]:
+        if self.layout == CONTENT_LAYOUT:
+            # Hash while writing to a temporary file, then move it to its blob path (unless already present)
+            self.blobs_path.mkdir(parents=True, exist_ok=True)
+            with NamedTemporaryFile(dir=self.blobs_path, prefix='.tmp-', delete=False) as f:
+                tmp_path = Path(f.name)
+                try:
+                    writer = HashingWriter(f)
+                    yield cast(BinaryIO, writer)
+                except:
+                    f.close()
+                    tmp_path.unlink()
+                    raise
+            digest = writer.hexdigest()
+            blob_path = self._blob_path(digest)
+            if blob_path.exists():
+                tmp_path.unlink()
+            else:
+                blob_path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path.replace(blob_path)
+            self._link_track_file(location, digest, writer.size, mtime)
+        else:
+            with write_replacing(self.audio_path / location, mtime=mtime) as f:
+                yield f
+
+    def track_file_info(self, location: str) -> Optional[TrackFileInfo]:
+        if self.layout == CONTENT_LAYOUT:
+            track_file = self._track_file(location)
+            return TrackFileInfo(size=track_file.size, mtime=track_file.mtime) if track_file else None
+        return file_info(self.audio_path / location)
+
+    def track_file_digest(self, location: str) -> Optional[str]:
+        if self.layout == CONTENT_LAYOUT:
+            track_file = self._track_file(location)
+            return track_file.digest if track_file else None
+        return super().track_file_digest(location)
+
+    def matches_track_digests(self) -> bool:
+        return True
+
+    def links_track_files(self) -> bool:
+        return self.layout == CONTENT_LAYOUT
+
+    def caches_track_file_digests(self) -> bool:
+        return self.layout == CONTENT_LAYOUT
 
-    def upload_track(self, location: str, raw: bytes):
-        path = self.audio_path / location
-        path.parent.mkdir(parents=True, exist_ok=True)
-        with open(path, 'wb') as f:
-            f.write(raw)
+    def link_track(self, location: str, digest: str, mtime: Optional[float]=None) -> bool:
+        if self.layout != CONTENT_LAYOUT:
+            return False
+        blob_info = file_info(self._blob_path(digest))
+        if not blob_info:
+            return False
+        self._link_track_file(location, digest, blob_info.size, mtime)
+        return True
@@ -0,0 +1,11 @@
+from sqlalchemy import Column, Integer, Text
+
+from mixync.store.portable.model import Base
+
+class PortableIdMapping(Base):
+    __tablename__ = 'id_mappings'
+
+    source = Column(Text, primary_key=True)
+    resource = Column(Text, primary_key=True)
+    source_id = Column(Integer, primary_key=True)
+    dest_id = Column(Integer, nullable=False)
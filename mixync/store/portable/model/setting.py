@@ -0,0 +1,9 @@
+from sqlalchemy import Column, Text
+
+from mixync.store.portable.model import Base
+
+class PortableSetting(Base):
+    __tablename__ = 'settings'
+
+    name = Column(Text, primary_key=True)
+    value = Column(Text, nullable=True)
@@ -0,0 +1,11 @@
+from sqlalchemy import Column, Integer, Text
+
+from mixync.store.portable.model import Base
+
+class PortableSyncHash(Base):
+    __tablename__ = 'sync_hashes'
+
+    peer = Column(Text, primary_key=True)
+    resource = Column(Text, primary_key=True)
+    id = Column(Integer, primary_key=True)
+    hash = Column(Text, nullable=False)
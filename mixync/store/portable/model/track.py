@@ -1,5 +1,5 @@
 from sqlalchemy import Column, Integer, Float, Text, DateTime, LargeBinary
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import deferred, relationship
 
 from mixync.store.portable.model import Base
 
@@ -20,17 +20,19 @@ class PortableTrack(Base):
     url = Column(Text, nullable=True)
     sample_rate = Column(Integer, nullable=True)
     bpm = Column(Float, nullable=True)
-    beats = Column(LargeBinary, nullable=True)
+    # Deferred, see PortableStore.load_track_blobs
+    beats = deferred(Column(LargeBinary, nullable=True))
     beats_version = Column(Text, nullable=True)
     beats_sub_version = Column(Text, nullable=True)
     channels = Column(Integer, nullable=True)
     times_played = Column(Integer, nullable=True)
     rating = Column(Integer, nullable=True)
     key = Column(Text, nullable=True)
-    keys = Column(LargeBinary, nullable=True)
+    keys = deferred(Column(LargeBinary, nullable=True))
     keys_version = Column(Text, nullable=True)
     keys_sub_version = Column(Text, nullable=True)
     color = Column(Integer, nullable=True)
     last_played_at = Column(DateTime, nullable=True)
+    digest = Column(Text, nullable=True, index=True)
 
     cues = relationship('PortableCue')
@@ -0,0 +1,13 @@
+from sqlalchemy import Column, Float, Integer, Text
+
+from mixync.store.portable.model import Base
+
+class PortableTrackFile(Base):
+    """Maps a track location to a content-addressed audio blob."""
+
+    __tablename__ = 'track_files'
+
+    location = Column(Text, primary_key=True)
+    digest = Column(Text, nullable=False, index=True)
+    size = Column(Integer, nullable=False)
+    mtime = Column(Float, nullable=True)
@@ -0,0 +1,238 @@
+from contextlib import contextmanager
+from http.client import HTTPConnection, HTTPException, HTTPResponse, HTTPSConnection
+from pathlib import Path
+from threading import Lock
+from typing import Any, BinaryIO, Iterable, Iterator, Optional, cast
+from urllib.parse import quote, urlencode, urlsplit
+
+import json
+
+from mixync.model.crate import Crate, CrateHeader
+from mixync.model.directory import Directory
+from mixync.model.playlist import Playlist, PlaylistHeader
+from mixync.model.track import Track, TrackHeader
+from mixync.model.track_file import TrackFileInfo
+from mixync.options import Options
+from mixync.protocol import API_PREFIX, decode_item, decode_result
+from mixync.store import Store
+from mixync.utils.codec import encode
+from mixync.utils.http import ChunkedWriter
+from mixync.utils.io import CHUNK_SIZE
+
+# The number of seconds to wait for the server before giving up.
+TIMEOUT_SECS = 300
+
+class RemoteStore(Store):
+    """
+    A musiclib served by 'mixync serve', accessed over HTTP. Metadata is
+    exchanged in batches (and listed as streams of JSON lines), track files
+    are streamed. Connections are kept alive and pooled, so parallel
+    transfers each reuse their own connection.
+    """
+
+    def __init__(self, url: str):
+        parts = urlsplit(url)
+        self.url = url.rstrip('/')
+        self.connection_cls = HTTPSConnection if parts.scheme == 'https' else HTTPConnection
+        self.host = parts.netloc
+        self.base_path = parts.path.rstrip('/') + API_PREFIX
+        self._idle_connections: list[HTTPConnection] = []
+        self._lock = Lock()
+        with self._request('GET', '/info') as response:
+            self._info = json.loads(response.read())
+
+    @classmethod
+    def parse_ref(cls, ref: str, opts: Options):
+        if ref.startswith('http://') or ref.startswith('https://'):
+            return RemoteStore(ref)
+        return None
+
+    def identity(self) -> str:
+        return self._info['identity']
+
+    def close(self):
+        with self._lock:
+            for connection in self._idle_connections:
+                connection.close()
+            self._idle_connections.clear()
+
+    # HTTP methods
+
+    def _acquire(self) -> HTTPConnection:
+        with self._lock:
+            if self._idle_connections:
+                return self._idle_connections.pop()
+        return self.connection_cls(self.host, timeout=TIMEOUT_SECS)
+
+    def _release(self, connection: HTTPConnection):
+        with self._lock:
+            self._idle_connections.append(connection)
+
+    @contextmanager
+    def _request(self, method: str, path: str, body: Optional[bytes]=None, headers: Optional[dict[str, str]]=None) -> Iterator[HTTPResponse]:
+        """Performs a request on a pooled connection, the response must be read in the enclosed block."""
+        connection = self._acquire()
+        try:
+            try:
+                connection.request(method, self.base_path + path, body=body, headers=headers or {})
+                response = connection.getresponse()
+            except (ConnectionError, HTTPException):
+                # The server may have been restarted since the connection was last used,
+                # so retry once on a new connection (if that is safe)
+                if method != 'GET':
+                    raise
+                connection.close()
+                connection.request(method, self.base_path + path, body=body, headers=headers or {})
+                response = connection.getresponse()
+            self._check(response)
+            yield response
+        except BaseException:
+            connection.close()
+            raise
+        if response.isclosed():
+            self._release(connection)
+        else:
+            # The response has not been read entirely, so the connection cannot be reused
+            connection.close()
+
+    def _check(self, response: HTTPResponse):
+        if response.status < 400:
+            return
+        try:
+            message = json.loads(response.read())['error']
+        except (ValueError, KeyError):
+            message = response.reason
+        if response.status == 404:
+            raise FileNotFoundError(message)
+        raise RuntimeError(f"Request to '{self.url}' failed with {response.status}: {message}")
+
+    def _call(self, method: str, *args: Any) -> Any:
+        body = json.dumps(encode(args)).encode('utf8')
+        with self._request('POST', f'/call/{method}', body=body, headers={'Content-Type': 'application/json'}) as response:
+            return decode_result(method, json.loads(response.read())['result'])
+
+    def _list(self, method: str, **filters: Optional[str]) -> Iterator[Any]:
+        query = urlencode({k: v for k, v in filters.items() if v})
+        with self._request('GET', f'/list/{method}?{query}') as response:
+            for line in response:
+                yield decode_item(method, json.loads(line))
+
+    def _file_path(self, location: str, **params: Any) -> str:
+        query = urlencode({k: v for k, v in params.items() if v is not None})
+        return f"/files/{quote(location)}{'?' + query if query else ''}"
+
+    # Id mapping and sync state methods
+
+    def load_id_mappings(self, source: str) -> dict[str, dict[int, int]]:
+        return self._call('load_id_mappings', source)
+
+    def save_id_mappings(self, source: str, mappings: dict[str, dict[int, int]]):
+        self._call('save_id_mappings', source, mappings)
+
+    def load_sync_hashes(self, peer: str) -> dict[str, dict[int, str]]:
+        return self._call('load_sync_hashes', peer)
+
+    def save_sync_hashes(self, peer: str, hashes: dict[str, dict[int, str]]):
+        self._call('save_sync_hashes', peer, hashes)
+
+    # Match methods
+
+    def match_tracks(self, tracks: list[TrackHeader]) -> Iterable[Optional[int]]:
+        return self._call('match_tracks', tracks)
+
+    def match_crates(self, crates: list[CrateHeader]) -> Iterable[Optional[int]]:
+        return self._call('match_crates', crates)
+
+    def match_playlists(self, playlists: list[PlaylistHeader]) -> Iterable[Optional[int]]:
+        return self._call('match_playlists', playlists)
+
+    def match_directories(self, directories: list[Directory]) -> Iterable[Optional[int]]:
+        return self._call('match_directories', directories)
+
+    # Query methods
+
+    def tracks(self, name: Optional[str]=None, artist: Optional[str]=None) -> Iterable[Track]:
+        return self._list('tracks', name=name, artist=artist)
+
+    def load_track_blobs(self, tracks: list[Track]) -> list[Track]:
+        return self._call('load_track_blobs', tracks)
+
+    def crates(self, name: Optional[str]=None) -> Iterable[Crate]:
+        return self._list('crates', name=name)
+
+    def playlists(self, name: Optional[str]=None) -> Iterable[Playlist]:
+        return self._list('playlists', name=name)
+
+    def directories(self) -> Iterable[Directory]:
+        return self._list('directories')
+
+    def track_directory_name(self, track: Track) -> Optional[str]:
+        # Served musiclibs store relative locations, like PortableStore
+        parts = Path(track.location).parts
+        return parts[0] if parts else None
+
+    # Update methods
+
+    def update_tracks(self, tracks: list[Track]) -> list[int]:
+        return self._call('update_tracks', tracks)
+
+    def update_crates(self, crates: list[Crate]) -> list[int]:
+        return self._call('update_crates', crates)
+
+    def update_playlists(self, playlists: list[Playlist]) -> list[int]:
+        return self._call('update_playlists', playlists)
+
+    def update_directories(self, directories: list[Directory]) -> list[int]:
+        return self._call('update_directories', directories)
+
+    # Upload/download methods
+
+    @contextmanager
+    def read_track(self, location: str) -> Iterator[BinaryIO]:
+        with self._request('GET', self._file_path(location)) as response:
+            yield cast(BinaryIO, response)
+
+    @contextmanager
+    def write_track(self, location: str, mtime: Optional[float]=None) -> Iterator[BinaryIO]:
+        connection = self._acquire()
+        try:
+            # Stream the upload, since the size is not known in advance
+            connection.putrequest('PUT', self.base_path + self._file_path(location, mtime=mtime))
+            connection.putheader('Content-Type', 'application/octet-stream')
+            connection.putheader('Transfer-Encoding', 'chunked')
+            connection.endheaders()
+            writer = ChunkedWriter(connection.send, buffer_size=CHUNK_SIZE)
+            yield cast(BinaryIO, writer)
+            writer.close()
+            response = connection.getresponse()
+            self._check(response)
+            response.read()
+        except BaseException:
+            connection.close()
+            raise
+        self._release(connection)
+
+    def track_file_info(self, location: str) -> Optional[TrackFileInfo]:
+        return self._call('track_file_info', location)
+
+    def track_file_digest(self, location: str) -> Optional[str]:
+        # Computed by the server, so the file is not transferred
+        return self._call('track_file_digest', location)
+
+    def track_audio_digest(self, location: str) -> Optional[str]:
+        return self._call('track_audio_digest', location)
+
+    def matches_track_digests(self) -> bool:
+        return self._info['matches_track_digests']
+
+    def links_track_files(self) -> bool:
+        return self._info['links_track_files']
+
+    def caches_track_file_digests(self) -> bool:
+        return self._info['caches_track_file_digests']
+
+    def is_remote(self) -> bool:
+        return True
+
+    def link_track(self, location: str, digest: str, mtime: Optional[float]=None) -> bool:
+        return self._call('link_track', location, digest, mtime)
@@ -0,0 +1,95 @@
+from dataclasses import replace
+from typing import Iterable, Optional, Union
+
+import json
+
+from mixync.metrics import Metrics
+from mixync.model.crate import Crate
+from mixync.model.playlist import Playlist
+from mixync.model.track import Track
+from mixync.options import Options
+from mixync.store import PERSISTED_RESOURCES, IdMappings, Store
+from mixync.utils.cli import info
+from mixync.utils.codec import encode
+from mixync.utils.hash import digest
+from mixync.utils.list import chunks
+
+def row_hash(value: Union[Track, Playlist, Crate]) -> str:
+    """Hashes the content of a track, playlist or crate, independent of its id."""
+    data = encode(replace(value, id=None))
+    if isinstance(value, Track):
+        data['cues'] = sorted(data['cues'], key=json.dumps)
+    else:
+        # Not every store keeps these, so they would differ on every read
+        del data['date_created'], data['date_modified']
+    if isinstance(value, Crate):
+        data['track_ids'].sort()
+    return digest(json.dumps(data, sort_keys=True).encode('utf8'))
+
+def row_hashes(store: Store, batch_size: int) -> dict[str, dict[int, str]]:
+    """
+    Hashes the tracks, playlists and crates of the given store (by resource name and id).
+    The beats and keys of the tracks are loaded in batches of the given size, so
+    that re-analyzed tracks count as changed too.
+    """
+    values: dict[str, Iterable[Union[Track, Playlist, Crate]]] = {
+        'tracks': (t for batch in chunks(store.tracks(), batch_size) for t in store.load_track_blobs(batch)),
+        'playlists': store.playlists(),
+        'crates': store.crates(),
+    }
+    return {resource: {v.id: row_hash(v) for v in resource_values if v.id} for resource, resource_values in values.items()}
+
+def changed_ids(hashes: dict[str, dict[int, str]], synced_hashes: dict[str, dict[int, str]], mappings: dict[str, dict[int, int]]) -> dict[str, set[int]]:
+    """The ids of the values that changed since they were last synced or that are not mapped to the peer."""
+    return {
+        resource: {
+            id for id, hash in resource_hashes.items()
+            if synced_hashes.get(resource, {}).get(id) != hash or id not in mappings.get(resource, {})
+        }
+        for resource, resource_hashes in hashes.items()
+    }
+
+def sync(store: Store, peer: Store, opts: Options, metrics: Optional[Metrics]=None):
+    """
+    Syncs the given stores in both directions, only copying the tracks, playlists
+    and crates that changed on either side since the last sync. Both stores record
+    the content hashes of their values after syncing, so later syncs can tell what
+    changed. Values changed on both sides are taken from the first store.
+    """
+    store_id, peer_id = store.identity(), peer.identity()
+    store_hashes, peer_hashes = row_hashes(store, opts.batch_size), row_hashes(peer, opts.batch_size)
+    store_synced_hashes, peer_synced_hashes = store.load_sync_hashes(peer_id), peer.load_sync_hashes(store_id)
+    store_to_peer = peer.load_id_mappings(store_id)
+    store_changed = changed_ids(store_hashes, store_synced_hashes, store_to_peer)
+    peer_changed = changed_ids(peer_hashes, peer_synced_hashes, store.load_id_mappings(peer_id))
+
+    conflict_count = 0
+    for resource, ids in store_changed.items():
+        conflicts = {store_to_peer.get(resource, {}).get(id) for id in ids} & peer_changed[resource]
+        peer_changed[resource] -= conflicts
+        conflict_count += len(conflicts)
+
+    if opts.log:
+        info(f'Syncing {sum(map(len, store_changed.values()))} changed values from the first and {sum(map(len, peer_changed.values()))} from the second store ({conflict_count} changed on both sides, keeping the first)')
+
+    # Values only written to the peer are known to the store by the inverse mappings, so they are not copied back
+    mappings = store.copy_to(peer, opts, metrics=metrics, only_ids=store_changed)
+    _save_inverse_id_mappings(store, peer_id, mappings, opts)
+    mappings = peer.copy_to(store, opts, metrics=metrics, only_ids=peer_changed)
+    _save_inverse_id_mappings(peer, store_id, mappings, opts)
+
+    if not opts.dry_run:
+        store.save_sync_hashes(peer_id, _changed_hashes(row_hashes(store, opts.batch_size), store_synced_hashes))
+        peer.save_sync_hashes(store_id, _changed_hashes(row_hashes(peer, opts.batch_size), peer_synced_hashes))
+
+def _save_inverse_id_mappings(store: Store, peer_id: str, mappings: IdMappings, opts: Options):
+    """Saves the given mappings from the store to the peer as mappings from the peer to the store."""
+    if opts.dry_run:
+        return
+    previous = store.load_id_mappings(peer_id)
+    inverse = IdMappings()
+    inverse.update({resource: {v: k for k, v in getattr(mappings, resource).mapping.items()} for resource in PERSISTED_RESOURCES})
+    store.save_id_mappings(peer_id, inverse.changes(previous, PERSISTED_RESOURCES))
+
+def _changed_hashes(hashes: dict[str, dict[int, str]], previous: dict[str, dict[int, str]]) -> dict[str, dict[int, str]]:
+    return {resource: {id: hash for id, hash in resource_hashes.items() if previous.get(resource, {}).get(id) != hash} for resource, resource_hashes in hashes.items()}
@@ -1,4 +1,5 @@
 from mixync.options import Options
+from mixync.utils.progress import ProgressLine
 
 RED_COLOR = '\033[91m'
 YELLOW_COLOR = '\033[93m'
@@ -9,7 +10,12 @@ PINK_COLOR = '\033[95m'
 CLEAR_COLOR = '\033[0m'
 
 def message(msg: str, color: str=BLUE_COLOR):
-    print(f'{color}==> {msg}{CLEAR_COLOR}')
+    line = f'{color}==> {msg}{CLEAR_COLOR}'
+    if ProgressLine.active:
+        # Keep the progress line below, e.g. when metadata is copied while transferring files
+        ProgressLine.active.print(line)
+    else:
+        print(line, flush=True)
 
 def info(msg: str):
     message(msg, BLUE_COLOR)
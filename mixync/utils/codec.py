@@ -0,0 +1,62 @@
+from base64 import b64decode, b64encode
+from dataclasses import fields, is_dataclass
+from datetime import datetime
+from enum import Enum
+from functools import lru_cache
+from pathlib import PurePath
+from typing import Any, Union, get_args, get_origin, get_type_hints
+
+import collections.abc
+
+def encode(value: Any) -> Any:
+    """Converts a (model) value to a JSON-serializable value."""
+    if value is None or isinstance(value, (bool, str)):
+        return value
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, bytes):
+        return b64encode(value).decode('ascii')
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, PurePath):
+        return str(value)
+    if is_dataclass(value):
+        return {f.name: encode(getattr(value, f.name)) for f in fields(value)}
+    if isinstance(value, dict):
+        return {str(k): encode(v) for k, v in value.items()}
+    if isinstance(value, collections.abc.Iterable):
+        return [encode(v) for v in value]
+    raise TypeError(f'Cannot encode {type(value).__name__}')
+
+@lru_cache(maxsize=None)
+def _field_types(cls: type) -> tuple[tuple[str, Any], ...]:
+    hints = get_type_hints(cls)
+    return tuple((f.name, hints[f.name]) for f in fields(cls))
+
+def decode(data: Any, hint: Any) -> Any:
+    """Converts a value produced by 'encode' back to the given type."""
+    if data is None or hint is Any:
+        return data
+    origin = get_origin(hint)
+    if origin is Union:
+        # Only Optional unions are used in the models
+        return decode(data, next(a for a in get_args(hint) if a is not type(None)))
+    if origin in (list, set, collections.abc.Iterable):
+        item_hint, = get_args(hint)
+        items = [decode(v, item_hint) for v in data]
+        return set(items) if origin is set else items
+    if origin is dict:
+        key_hint, value_hint = get_args(hint)
+        return {key_hint(k): decode(v, value_hint) for k, v in data.items()}
+    if hint is bytes:
+        return b64decode(data)
+    if hint is datetime:
+        return datetime.fromisoformat(data)
+    if isinstance(hint, type) and is_dataclass(hint):
+        return hint(**{name: decode(data[name], field_hint) for name, field_hint in _field_types(hint) if name in data})
+    if hint is float:
+        return float(data)
+    # Enums, ints, strs, bools and paths
+    return hint(data)
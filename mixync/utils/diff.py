@@ -0,0 +1,48 @@
+from dataclasses import dataclass, field
+from difflib import SequenceMatcher
+from typing import Generic, Hashable, TypeVar
+
+K = TypeVar('K')
+V = TypeVar('V', bound=Hashable)
+
+@dataclass
+class ListDiff(Generic[K, V]):
+    """The row changes that turn a stored list into a new one, see diff_list."""
+
+    # The keys of the rows to delete
+    deletes: list[K] = field(default_factory=list)
+    # The keys of the kept rows whose position changes, with their new positions
+    moves: list[tuple[K, int]] = field(default_factory=list)
+    # The positions and values of the rows to insert
+    inserts: list[tuple[int, V]] = field(default_factory=list)
+
+def diff_list(rows: list[tuple[K, V, int]], values: list[V]) -> ListDiff[K, V]:
+    """
+    Computes the row changes that turn the given stored rows (keys, values and
+    positions, ordered by position) into the given values at positions 0, 1, ...
+    The longest common runs of values are kept (as found by difflib) and the rows
+    of removed values are reused for the same values inserted elsewhere, so moved
+    values only change their positions.
+    """
+    matcher = SequenceMatcher(None, [value for _, value, _ in rows], values, autojunk=False)
+    kept: list[tuple[int, int]] = []
+    removed: dict[V, list[int]] = {}
+    added: list[int] = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            kept += zip(range(i1, i2), range(j1, j2))
+        else:
+            for i in range(i1, i2):
+                removed.setdefault(rows[i][1], []).append(i)
+            added += range(j1, j2)
+
+    diff: ListDiff[K, V] = ListDiff()
+    for j in added:
+        reusable = removed.get(values[j])
+        if reusable:
+            kept.append((reusable.pop(), j))
+        else:
+            diff.inserts.append((j, values[j]))
+    diff.deletes = [rows[i][0] for indices in removed.values() for i in indices]
+    diff.moves = [(rows[i][0], j) for i, j in kept if rows[i][2] != j]
+    return diff
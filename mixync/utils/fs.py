@@ -0,0 +1,46 @@
+import os
+
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Iterator, Optional, cast
+from uuid import uuid4
+
+from mixync.model.track_file import TrackFileInfo
+
+def file_info(path: Path) -> Optional[TrackFileInfo]:
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return TrackFileInfo(size=stat.st_size, mtime=stat.st_mtime)
+
+def set_mtime(path: Path, mtime: float):
+    os.utime(path, (mtime, mtime))
+
+def fsync_dir(path: Path):
+    """Flushes the entries of the given directory, e.g. to make a rename or deletion durable."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+@contextmanager
+def write_replacing(path: Path, mtime: Optional[float]=None) -> Iterator[BinaryIO]:
+    """
+    Writes a file through a temporary file in the same directory, which only
+    replaces the file at the given path once it has been written completely.
+    An interrupted write thus leaves an existing file intact.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Not a NamedTemporaryFile, since the file should get the usual permissions
+    tmp_path = path.with_name(f'.{path.name}.{uuid4().hex}.tmp')
+    try:
+        with open(tmp_path, 'xb') as f:
+            yield cast(BinaryIO, f)
+        if mtime is not None:
+            set_mtime(tmp_path, mtime)
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
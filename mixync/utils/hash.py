@@ -0,0 +1,79 @@
+from hashlib import sha256
+from typing import BinaryIO
+
+from mixync.utils.io import CHUNK_SIZE, Writable
+
+def digest(raw: bytes) -> str:
+    return sha256(raw).hexdigest()
+
+def digest_stream(stream: BinaryIO, chunk_size: int=CHUNK_SIZE) -> str:
+    hasher = sha256()
+    while chunk := stream.read(chunk_size):
+        hasher.update(chunk)
+    return hasher.hexdigest()
+
+# Sizes of the ID3 tags that MP3 files usually start (v2) or end (v1) with
+ID3V2_HEADER_SIZE = 10
+ID3V1_SIZE = 128
+# FLAC files start with this marker, followed by metadata blocks (e.g. Vorbis comments and pictures)
+FLAC_MARKER = b'fLaC'
+FLAC_BLOCK_HEADER_SIZE = 4
+
+def audio_digest_stream(stream: BinaryIO, chunk_size: int=CHUNK_SIZE) -> str:
+    """
+    Computes a digest of the audio content in the stream, i.e. skipping
+    leading ID3v2 and trailing ID3v1 tags and the metadata blocks of FLAC
+    files, so that the digest does not change when only the tags are edited.
+    Other formats (e.g. M4A or Ogg) embed their tags differently and are
+    digested entirely.
+    """
+    hasher = sha256()
+    pending = stream.read(ID3V2_HEADER_SIZE)
+    if len(pending) == ID3V2_HEADER_SIZE and pending.startswith(b'ID3'):
+        # The size is 'syncsafe', i.e. only uses 7 bits per byte, and excludes the header/footer
+        tag_size = (pending[6] & 0x7F) << 21 | (pending[7] & 0x7F) << 14 | (pending[8] & 0x7F) << 7 | (pending[9] & 0x7F)
+        _skip(stream, tag_size + (ID3V2_HEADER_SIZE if pending[5] & 0x10 else 0), chunk_size)
+        pending = stream.read(len(FLAC_MARKER))
+    if pending.startswith(FLAC_MARKER):
+        pending = pending[len(FLAC_MARKER):]
+        last = False
+        while not last:
+            if len(pending) < FLAC_BLOCK_HEADER_SIZE:
+                pending += stream.read(FLAC_BLOCK_HEADER_SIZE - len(pending))
+                if len(pending) < FLAC_BLOCK_HEADER_SIZE:
+                    break
+            # The header consists of a flag for the last block, the block type and the size
+            last = bool(pending[0] & 0x80)
+            block_size = int.from_bytes(pending[1:FLAC_BLOCK_HEADER_SIZE], 'big')
+            pending = pending[FLAC_BLOCK_HEADER_SIZE:]
+            buffered = min(block_size, len(pending))
+            pending = pending[buffered:]
+            _skip(stream, block_size - buffered, chunk_size)
+    # Hold back the last bytes, which may be an ID3v1 tag
+    while chunk := stream.read(chunk_size):
+        pending += chunk
+        hasher.update(pending[:-ID3V1_SIZE])
+        pending = pending[-ID3V1_SIZE:]
+    if not (len(pending) == ID3V1_SIZE and pending.startswith(b'TAG')):
+        hasher.update(pending)
+    return hasher.hexdigest()
+
+def _skip(stream: BinaryIO, size: int, chunk_size: int):
+    while size > 0 and (skipped := stream.read(min(chunk_size, size))):
+        size -= len(skipped)
+
+class HashingWriter:
+    """Wraps a writable stream and computes the digest of everything written through it."""
+
+    def __init__(self, stream: Writable):
+        self.stream = stream
+        self.hasher = sha256()
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self.hasher.update(data)
+        self.size += len(data)
+        return self.stream.write(data)
+
+    def hexdigest(self) -> str:
+        return self.hasher.hexdigest()
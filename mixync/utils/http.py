@@ -0,0 +1,65 @@
+from io import BufferedIOBase
+from typing import Any, Callable
+
+# The amount of data to buffer before sending it as a chunk.
+CHUNK_BUFFER_SIZE = 64 * 1024
+
+class ChunkedWriter:
+    """Encodes everything written through it using HTTP's chunked transfer coding, buffering small writes."""
+
+    def __init__(self, send: Callable[[bytes], Any], buffer_size: int=CHUNK_BUFFER_SIZE):
+        self.send = send
+        self.buffer_size = buffer_size
+        self.buffer = bytearray()
+
+    def write(self, data: bytes) -> int:
+        self.buffer += data
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self.buffer:
+            self.send(b'%x\r\n' % len(self.buffer) + bytes(self.buffer) + b'\r\n')
+            self.buffer.clear()
+
+    def close(self):
+        """Sends the remaining data and the final (empty) chunk."""
+        self.flush()
+        self.send(b'0\r\n\r\n')
+
+class ChunkedReader:
+    """Decodes a stream using HTTP's chunked transfer coding."""
+
+    def __init__(self, stream: BufferedIOBase):
+        self.stream = stream
+        self.remaining = 0
+        self.done = False
+
+    def read(self, size: int=-1) -> bytes:
+        data = bytearray()
+        while not self.done and (size < 0 or len(data) < size):
+            if self.remaining == 0:
+                self._next_chunk()
+                continue
+            n = self.remaining if size < 0 else min(self.remaining, size - len(data))
+            chunk = self.stream.read(n)
+            if not chunk:
+                raise EOFError('Incomplete chunked body')
+            data += chunk
+            self.remaining -= len(chunk)
+            if self.remaining == 0:
+                self.stream.readline()
+        return bytes(data)
+
+    def _next_chunk(self):
+        line = self.stream.readline()
+        if not line:
+            raise EOFError('Incomplete chunked body')
+        # Ignore chunk extensions
+        self.remaining = int(line.split(b';', 1)[0].strip(), 16)
+        if self.remaining == 0:
+            # Skip the trailer
+            while self.stream.readline() not in (b'\r\n', b'\n', b''):
+                pass
+            self.done = True
@@ -0,0 +1,22 @@
+from typing import Protocol
+
+# The buffer size used when streaming track files between stores.
+CHUNK_SIZE = 1024 * 1024
+
+class Readable(Protocol):
+    """A binary stream that can be read from, e.g. a file, an archive entry or a chunked HTTP body."""
+
+    def read(self, size: int, /) -> bytes: ...
+
+class Writable(Protocol):
+    """A binary stream that can be written to, e.g. a file or a chunked HTTP body."""
+
+    def write(self, data: bytes, /) -> int: ...
+
+def copy_stream(src: Readable, dst: Writable, chunk_size: int=CHUNK_SIZE) -> int:
+    """Copies the source to the destination stream using a fixed-size buffer, returns the number of bytes copied."""
+    total = 0
+    while chunk := src.read(chunk_size):
+        dst.write(chunk)
+        total += len(chunk)
+    return total
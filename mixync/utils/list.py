@@ -1,7 +1,8 @@
-from typing import Callable, Iterable, Optional, TypeVar, Any
+from typing import Callable, Iterable, Iterator, Optional, TypeVar, Any
 
 T = TypeVar('T')
 U = TypeVar('U')
+K = TypeVar('K')
 
 def zip_or(xs: list[Optional[T]], ys: list[Optional[T]]) -> list[Optional[T]]:
     return [x or y for x, y in zip(xs, ys)]
@@ -18,3 +19,19 @@ def uncompact(xs: list[T], pattern: list[Optional[Any]]) -> list[Optional[T]]:
 
 def with_compact(f: Callable[[list[T]], Iterable[U]], xs: list[Optional[T]]) -> list[Optional[U]]:
     return uncompact(list(f(compact(xs))), xs)
+
+def group_by(xs: Iterable[T], key: Callable[[T], K]) -> dict[K, list[T]]:
+    groups: dict[K, list[T]] = {}
+    for x in xs:
+        groups.setdefault(key(x), []).append(x)
+    return groups
+
+def chunks(xs: Iterable[T], size: int) -> Iterator[list[T]]:
+    chunk = []
+    for x in xs:
+        chunk.append(x)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -0,0 +1,30 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import Iterable, Optional
+
+class PathTrie:
+    """A trie over path components for quickly finding the stored path containing a given path."""
+
+    def __init__(self, paths: Iterable[Path]=()):
+        self.children: dict[str, PathTrie] = {}
+        self.path: Optional[Path] = None
+        for path in paths:
+            self.insert(path)
+
+    def insert(self, path: Path):
+        node = self
+        for part in path.parts:
+            node = node.children.setdefault(part, PathTrie())
+        node.path = path
+
+    def longest_prefix(self, path: Path) -> Optional[Path]:
+        """Finds the most specific stored path that the given path is relative to."""
+        node = self
+        found = node.path
+        for part in path.parts:
+            child = node.children.get(part)
+            if not child:
+                break
+            node = child
+            found = node.path or found
+        return found
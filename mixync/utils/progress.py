@@ -1,8 +1,12 @@
-from re import A
-
+from __future__ import annotations
+from threading import RLock
+from typing import Optional
 
 class ProgressLine:
-    """An abstraction for printing an updating progress line."""
+    """An abstraction for printing an updating progress line. Safe to update from multiple threads."""
+
+    # The progress line currently shown (if any), above which other messages are printed
+    active: Optional[ProgressLine] = None
 
     def __init__(self, total: int, with_bar: bool=True, bar_length: int=10, final_newline: bool=True):
         self.i = 0
@@ -12,19 +16,23 @@ class ProgressLine:
         self.with_bar = with_bar
         self.bar_length = bar_length
         self.final_newline = final_newline
+        self.lock = RLock()
     
     def __enter__(self):
+        ProgressLine.active = self
         return self
     
     def __exit__(self, t, v, tb):
+        ProgressLine.active = None
         if self.final_newline:
             print()
 
     def prefix(self):
-        progress = (self.i + 1) / self.total
-        steps = int(progress * self.bar_length)
-        bar = f"[{'█' * steps + '░' * (self.bar_length - steps)}]" if self.with_bar else ''
-        return f'{bar} [{self.i + 1}/{self.total}]'
+        with self.lock:
+            progress = (self.i + 1) / self.total
+            steps = int(progress * self.bar_length)
+            bar = f"[{'█' * steps + '░' * (self.bar_length - steps)}]" if self.with_bar else ''
+            return f'{bar} [{self.i + 1}/{self.total}]'
 
     def current(self):
         return ' '.join(s for s in [
@@ -33,12 +41,23 @@ class ProgressLine:
             ' ' * (len(self.last_msg) - len(self.msg)),
         ] if s)
 
+    def extend(self, count: int):
+        """Adds to the total, e.g. when the items are only known as they arrive."""
+        with self.lock:
+            self.total += count
+
     def update(self, msg: str):
-        self.last_msg = self.msg
-        self.msg = msg
-        self.i += 1
-        print(f'\r{self.current()}', end='', flush=True)
+        with self.lock:
+            self.last_msg = self.msg
+            self.msg = msg
+            self.i += 1
+            print(f'\r{self.current()}', end='', flush=True)
     
     def print(self, msg: str):
-        print(f"\r{msg}{' ' * (len(self.last_msg) - len(msg))}\n{self.current()}", end='', flush=True)
-        self.last_msg = msg
+        with self.lock:
+            if self.i == 0:
+                # Nothing has been shown yet
+                print(msg, flush=True)
+                return
+            print(f"\r{msg}{' ' * (len(self.last_msg) - len(msg))}\n{self.current()}", end='', flush=True)
+            self.last_msg = msg
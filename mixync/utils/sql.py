@@ -0,0 +1,172 @@
+from dataclasses import fields, replace
+from pathlib import Path
+from sqlalchemy import bindparam, create_engine, delete, event, func, inspect, text, tuple_, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.reflection import Inspector
+from typing import Any, Hashable, Iterable, Optional, Sequence, Union, cast
+
+from mixync.model.beats import Beats
+from mixync.model.keys import Keys
+from mixync.model.track import Track
+from mixync.utils.list import chunks
+from mixync.utils.sqlite import SQLiteProfile
+
+# SQLite limits the number of bound parameters per statement (999 on older versions).
+MAX_PARAMS = 999
+
+def create_sqlite_engine(path: Path, profile: SQLiteProfile) -> Engine:
+    """Creates an engine for the SQLite database at the given path, configured with the given profile."""
+    engine = cast(Engine, create_engine(f'sqlite:///{path}'))
+    pragmas = [(f.name, getattr(profile, f.name)) for f in fields(profile)]
+    pragmas = [(name, value) for name, value in pragmas if value is not None]
+
+    @event.listens_for(engine, 'connect')
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+
+    return engine
+
+def add_missing_columns(engine: Engine, table):
+    """
+    Adds the columns (and indices) of the given table that do not exist in the
+    database yet, i.e. columns that were added after the table was created.
+    """
+    existing = {c['name'] for c in cast(Inspector, inspect(engine)).get_columns(table.name)}
+    missing = [c for c in table.columns if c.name not in existing]
+    if not missing:
+        return
+    with engine.begin() as connection:
+        for column in missing:
+            connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}'))
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+def match_ids(session, id_column, key_columns: Sequence[Any], keys: Sequence[tuple[Hashable, ...]]) -> list[Optional[Any]]:
+    """
+    Looks up the id of the first row matching each key (a tuple of values
+    for the key columns). Instead of issuing one query per key, the distinct
+    keys are matched in chunks with a single 'IN' query each.
+    """
+    distinct_keys = list(dict.fromkeys(keys))
+    key_expr = tuple_(*key_columns) if len(key_columns) > 1 else key_columns[0]
+    chunk_size = max(1, MAX_PARAMS // len(key_columns))
+    ids: dict[tuple[Hashable, ...], Any] = {}
+    for chunk in chunks(distinct_keys, chunk_size):
+        values = chunk if len(key_columns) > 1 else [k[0] for k in chunk]
+        rows = session.query(id_column, *key_columns) \
+            .where(key_expr.in_(values)) \
+            .order_by(id_column)
+        for id, *key in rows:
+            ids.setdefault(tuple(key), id)
+    return [ids.get(k) for k in keys]
+
+def group_rows_in(session, column, values: Sequence[Any], *columns, order_by: Sequence[Any]=()) -> dict[Any, list[Any]]:
+    """
+    Fetches the given columns of the rows whose value in the given column is one
+    of the given values, grouped by that value (and ordered by the given columns
+    within each group). Queries in chunks with a single 'IN' query each.
+    """
+    groups: dict[Any, list[Any]] = {}
+    for chunk in chunks(values, MAX_PARAMS):
+        for key, *row in session.query(column, *columns).where(column.in_(chunk)).order_by(column, *order_by):
+            groups.setdefault(key, []).append(tuple(row))
+    return groups
+
+def load_track_blobs(session, model, tracks: list[Track]) -> list[Track]:
+    """
+    Loads the beats and keys of the given tracks from the given track model,
+    which stores them in Mixxx's columns (beats, beats_version, beats_sub_version
+    and likewise for keys). Tracks without a stored row are returned unchanged.
+    """
+    blobs = {}
+    for ids in chunks([t.id for t in tracks if t.id], MAX_PARAMS):
+        rows = session.query(
+            model.id,
+            model.beats,
+            model.beats_version,
+            model.beats_sub_version,
+            model.keys,
+            model.keys_version,
+            model.keys_sub_version,
+        ).where(model.id.in_(ids))
+        for id, beats, beats_version, beats_sub_version, keys, keys_version, keys_sub_version in rows:
+            blobs[id] = (
+                Beats(data=beats, version=beats_version, sub_version=beats_sub_version),
+                Keys(data=keys, version=keys_version, sub_version=keys_sub_version),
+            )
+    return [replace(t, beats=blobs[t.id][0], keys=blobs[t.id][1]) if t.id in blobs else t for t in tracks]
+
+def existing_ids(session, id_column, ids: Iterable[Any]) -> set[Any]:
+    """Fetches which of the given ids exist, in chunks with a single 'IN' query each."""
+    existing = set()
+    for chunk in chunks(list(ids), MAX_PARAMS):
+        existing.update(id for id, in session.query(id_column).where(id_column.in_(chunk)))
+    return existing
+
+def next_ids(session, id_column, count: int) -> list[int]:
+    """Reserves the given number of fresh ids following the current maximum id."""
+    max_id = session.query(func.max(id_column)).scalar() or 0
+    table = id_column.table
+    if table.kwargs.get('sqlite_autoincrement'):
+        # Never reuse ids of deleted rows, just like SQLite's AUTOINCREMENT
+        seq = session.execute(text('SELECT seq FROM sqlite_sequence WHERE name = :name'), {'name': table.name}).scalar()
+        max_id = max(max_id, seq or 0)
+    return list(range(max_id + 1, max_id + 1 + count))
+
+def upsert(session, table, rows: list[dict[str, Any]], key: Union[str, tuple[str, ...]]='id') -> list[Any]:
+    """
+    Inserts or updates the given rows (mappings from column names to values,
+    all with the same keys) using a single executemany-style statement.
+    Rows without a value for the (integer) key column are assigned fresh ids,
+    composite keys (tuples of column names) must always be given.
+    Returns the keys of the rows in order.
+    """
+    if not rows:
+        return []
+    key_names = (key,) if isinstance(key, str) else key
+    key_columns = [table.c[k] for k in key_names]
+    if isinstance(key, str):
+        missing = [r for r in rows if r.get(key) is None]
+        if missing:
+            for row, id in zip(missing, next_ids(session, key_columns[0], len(missing))):
+                row[key] = id
+    stmt = sqlite_insert(table)
+    update_columns = {c: stmt.excluded[c] for c in rows[0].keys() if c not in key_names}
+    stmt = stmt.on_conflict_do_update(index_elements=key_columns, set_=update_columns) if update_columns else stmt.on_conflict_do_nothing()
+    session.execute(stmt, rows)
+    return [r[key] if isinstance(key, str) else tuple(r[k] for k in key) for r in rows]
+
+def insert_ignore(session, table, rows: list[dict[str, Any]]):
+    """Inserts the given rows using an executemany-style statement, skipping those that already exist."""
+    if rows:
+        session.execute(sqlite_insert(table).on_conflict_do_nothing(), rows)
+
+def delete_in(session, column, values: Sequence[Any]):
+    """Deletes the rows whose value in the given column is one of the given values."""
+    for chunk in chunks(values, MAX_PARAMS):
+        session.execute(delete(column.table).where(column.in_(chunk)))
+
+def update_rows(session, table, rows: list[dict[str, Any]], key: Union[str, tuple[str, ...]]='id'):
+    """
+    Updates the given existing rows (mappings from column names to values, all
+    with the same keys, including the key columns) using a single
+    executemany-style statement.
+    """
+    if not rows:
+        return
+    key_names = (key,) if isinstance(key, str) else key
+    # The key values are bound under other names, since they are not updated
+    stmt = update(table) \
+        .where(*[table.c[k] == bindparam(f'key_{k}') for k in key_names]) \
+        .values({c: bindparam(c) for c in rows[0].keys() if c not in key_names})
+    session.execute(stmt, [{(f'key_{c}' if c in key_names else c): v for c, v in row.items()} for row in rows])
+
+def delete_rows(session, table, keys: list[dict[str, Any]]):
+    """Deletes the rows with the given keys (mappings from the key columns' names to values) using a single executemany-style statement."""
+    if keys:
+        stmt = delete(table).where(*[table.c[k] == bindparam(f'key_{k}') for k in keys[0].keys()])
+        session.execute(stmt, [{f'key_{k}': v for k, v in key.items()} for key in keys])
@@ -0,0 +1,43 @@
+from dataclasses import dataclass
+from typing import Optional
+
+@dataclass(frozen=True)
+class SQLiteProfile:
+    """
+    Connection settings for SQLite, applied as PRAGMAs to every new connection.
+    Settings that are None are left at the database's (or SQLite's) default.
+    See https://www.sqlite.org/pragma.html for the individual settings.
+    """
+
+    # The journal mode, e.g. DELETE or WAL. Note that WAL is persisted in the
+    # database file and does not work on network file systems.
+    journal_mode: Optional[str] = None
+    # How often SQLite syncs to disk, i.e. OFF, NORMAL or FULL.
+    synchronous: Optional[str] = None
+    # The page cache size, in pages if positive or in KiB if negative.
+    cache_size: Optional[int] = None
+    # The maximum number of bytes to memory-map.
+    mmap_size: Optional[int] = None
+    # Where to store temporary tables and indices, i.e. DEFAULT, FILE or MEMORY.
+    temp_store: Optional[str] = None
+    # How long to wait for locks held by other connections (e.g. a running Mixxx).
+    busy_timeout: Optional[int] = None # ms
+
+SQLITE_PROFILES = {
+    # Only waits for locks and keeps the database's durability settings,
+    # suitable for databases used by other applications (e.g. the live mixxxdb).
+    'safe': SQLiteProfile(
+        synchronous='FULL',
+        busy_timeout=5000,
+    ),
+    # Trades durability on power loss for throughput, suitable for bulk imports
+    # into databases owned by mixync (e.g. portable musiclibs).
+    'fast': SQLiteProfile(
+        journal_mode='WAL',
+        synchronous='NORMAL',
+        cache_size=-64_000,
+        mmap_size=256 * 1024 * 1024,
+        temp_store='MEMORY',
+        busy_timeout=5000,
+    ),
+}
@@ -1,3 +1,12 @@
 def truncate(s: str, max_len: int, suffix: str='...') -> str:
     actual_max_len = max_len - len(suffix)
     return s if len(s) < actual_max_len else s[:actual_max_len] + suffix
+
+def format_duration(secs: float) -> str:
+    minutes, secs = divmod(round(secs), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f'{hours}h {minutes}m'
+    if minutes:
+        return f'{minutes}m {secs}s'
+    return f'{secs}s'